@@ -58,8 +58,16 @@ class sbsDiff:
 
     def __init__(self):
         self.enable_syntax_highlighting = True
+        self.enable_stats_footer = False
+        # Comma separated line normalization modes, e.g.
+        # "ignore-space-change,ignore-case".
+        self.diff_normalization = ""
+        # "chars" or "tokens", see sbs_diff_helper.get_line_changed_regions.
+        self.intraline_mode = ""
         self.cwd = None
         self.koDiff = None
+        self.sbsdiff = None
+        self.stats_json = ""
 
     html_template = """
 <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN">
@@ -86,30 +94,36 @@ class sbsDiff:
         import sbs_diff_helper
         reload(sbs_diff_helper)
         self.koDiff = UnwrapObject(koIDiff)
-        sbsdiff = sbs_diff_helper.SideBySideDiff(self.koDiff,
-                                                 self.cwd,
-                                                 self.enable_syntax_highlighting)
-        return self.html_template % (sbsdiff.toHTML())
+        return self._generate(sbs_diff_helper, self.koDiff, self.cwd)
+
+    def generateSbsTreeDiff(self, left_dir, right_dir):
+        import sbs_diff_helper
+        reload(sbs_diff_helper)
+        # The tree comparison stands in for the koIDiff, SideBySideDiff finds
+        # its file diffs in the same place.
+        self.koDiff = sbs_diff_helper.TreeComparison(left_dir, right_dir)
+        return self._generate(sbs_diff_helper, self.koDiff, right_dir)
+
+    def _generate(self, sbs_diff_helper, koDiff, cwd):
+        normalize = [mode.strip() for mode in self.diff_normalization.split(",")
+                     if mode.strip()]
+        sbsdiff = sbs_diff_helper.SideBySideDiff(koDiff,
+                                                 cwd,
+                                                 self.enable_syntax_highlighting,
+                                                 self.enable_stats_footer,
+                                                 normalize,
+                                                 self.intraline_mode or None)
+        html = self.html_template % (sbsdiff.toHTML())
+        self.stats_json = sbsdiff.stats_json()
+        # Kept to map the chunk ids of the HTML back to files and lines.
+        self.sbsdiff = sbsdiff
+        return html
 
     def filepathFromChunkId(self, chunk_id):
-        sp = chunk_id.split(".")
-        if len(sp) == 3:
-            try:
-                file_pos = int(sp[1]) - 1
-                if file_pos >= 0 and file_pos < len(self.koDiff.diffex.file_diffs):
-                    return self.koDiff.diffex.file_diffs[file_pos].best_path(self.cwd)
-            except ValueError:
-                pass
+        if self.sbsdiff is not None:
+            return self.sbsdiff.get_filepath(chunk_id)
 
     def diffLinenoFromChunkId(self, chunk_id):
-        sp = chunk_id.split(".")
-        if len(sp) == 3:
-            try:
-                file_pos = int(sp[1]) - 1
-                if file_pos >= 0 and file_pos < len(self.koDiff.diffex.file_diffs):
-                    fd = self.koDiff.diffex.file_diffs[file_pos]
-                    diff_lineno = fd.hunks[0].start_line
-                    return self.koDiff.diffex.file_pos_from_diff_pos(diff_lineno, 0)[1]
-            except ValueError:
-                pass
+        if self.sbsdiff is not None:
+            return self.sbsdiff.get_diff_lineno(chunk_id)
         return -1
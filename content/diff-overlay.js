@@ -64,12 +64,15 @@ function loadSBSDiff() {
     g_sbsDiff = Components.classes["@activestate.com/sbsDiff;1"].
                 createInstance(Components.interfaces.sbsIDiff)
     g_sbsDiff.enable_syntax_highlighting = document.getElementById('enable_highlighting_checkbox').checked;
+    g_sbsDiff.diff_normalization = document.getElementById('diff_normalize_menulist').value;
     g_sbsDiff.cwd = g_diff_cwd;
     if (!g_diff_cwd) {
         // Cannot show full context diffs.
         document.getElementById('enable_highlighting_checkbox').setAttribute('disabled', 'true');
+        document.getElementById('diff_normalize_menulist').setAttribute('disabled', 'true');
     } else {
         document.getElementById('enable_highlighting_checkbox').removeAttribute('disabled');
+        document.getElementById('diff_normalize_menulist').removeAttribute('disabled');
     }
     var html = g_sbsDiff.generateSbsDiff(koIDiff);
 
@@ -11,13 +11,18 @@ try:
     from pygments.lexers import get_lexer_for_filename
     # from pygments.lexers import guess_lexer_for_filename
     from pygments.formatters import HtmlFormatter
+    from pygments.lexer import RegexLexer
     _have_pygments = True
 except ImportError:
     _have_pygments = False
 
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 
+from reviewboard.diffviewer.interdiff import InterDiffer, InterdiffError
 from reviewboard.diffviewer.myersdiff import MyersDiffer
 from reviewboard.diffviewer.smdiff import SMDiffer
 from reviewboard.scmtools.core import PRE_CREATION, HEAD
@@ -25,6 +30,19 @@ from reviewboard.scmtools.core import PRE_CREATION, HEAD
 
 DEFAULT_DIFF_COMPAT_VERSION = 1
 
+# The lexer state is checkpointed about every this many lines when
+# highlighting ranges of lines, see get_lexer_checkpoints.
+LEXER_CHECKPOINT_INTERVAL = 100
+
+# Bump this whenever the structure of the chunks returned by get_chunks
+# changes, so that cached chunks from older code are never used.
+CHUNKS_CACHE_VERSION = 1
+
+NEW_FILE_STR = _("New File")
+NEW_CHANGE_STR = _("New Change")
+
+_markup_tag_re = re.compile(r"<[^>]*>")
+
 
 class UserVisibleError(Exception):
     pass
@@ -187,49 +205,66 @@ def get_patched_file(buffer, filediff):
     return patch(filediff.diff, buffer, filediff.dest_file)
 
 
-def get_chunks(filediff, interfilediff, force_interdiff,
-               enable_syntax_highlighting):
-    def diff_line(vlinenum, oldlinenum, newlinenum, oldline, newline,
-                  oldmarkup, newmarkup):
-        if oldline and newline and oldline != newline:
-            oldregion, newregion = get_line_changed_regions(oldline, newline)
-        else:
-            oldregion = newregion = []
+def diff_line(vlinenum, oldlinenum, newlinenum, oldline, newline,
+              oldmarkup, newmarkup):
+    if oldline and newline and oldline != newline:
+        oldregion, newregion = get_line_changed_regions(oldline, newline)
+    else:
+        oldregion = newregion = []
 
-        return [vlinenum,
-                oldlinenum or '', mark_safe(oldmarkup or ''), oldregion,
-                newlinenum or '', mark_safe(newmarkup or ''), newregion]
+    return [vlinenum,
+            oldlinenum or '', mark_safe(oldmarkup or ''), oldregion,
+            newlinenum or '', mark_safe(newmarkup or ''), newregion]
 
-    def new_chunk(lines, numlines, tag, collapsable=False):
-        return {
-            'lines': lines,
-            'numlines': numlines,
-            'change': tag,
-            'collapsable': collapsable,
-        }
 
-    def add_ranged_chunks(lines, start, end, collapsable=False):
-        numlines = end - start
-        chunks.append(new_chunk(lines[start:end], end - start, 'equal',
-                      collapsable))
+def new_chunk(lines, numlines, tag, collapsable=False):
+    return {
+        'lines': lines,
+        'numlines': numlines,
+        'change': tag,
+        'collapsable': collapsable,
+    }
 
-    def apply_pygments(data, filename):
-        # XXX Guessing is preferable but really slow, especially on XML
-        #     files.
-        #if filename.endswith(".xml"):
-        lexer = get_lexer_for_filename(filename, stripnl=False)
-        #else:
-        #    lexer = guess_lexer_for_filename(filename, data, stripnl=False)
 
-        try:
-            # This is only available in 0.7 and higher
-            lexer.add_filter('codetagify')
-        except AttributeError:
-            pass
+def get_lexer(filename):
+    # XXX Guessing is preferable but really slow, especially on XML
+    #     files.
+    #if filename.endswith(".xml"):
+    lexer = get_lexer_for_filename(filename, stripnl=False)
+    #else:
+    #    lexer = guess_lexer_for_filename(filename, data, stripnl=False)
 
-        return pygments.highlight(data, lexer, HtmlFormatter()).splitlines()
+    try:
+        # This is only available in 0.7 and higher
+        lexer.add_filter('codetagify')
+    except AttributeError:
+        pass
+
+    return lexer
+
+
+def apply_pygments(data, filename):
+    return pygments.highlight(data, get_lexer(filename),
+                              HtmlFormatter()).splitlines()
 
 
+def apply_pygments_from_state(lines, lexer, stack):
+    """
+    Returns the markup of lines, lexed starting from the state stack of the
+    lexer, such as a checkpoint from RegexLexer.get_line_states.
+    """
+    tokens = lexer.get_tokens_from_state("\n".join(lines) + "\n", stack)
+    markup = pygments.format(tokens, HtmlFormatter(nowrap=True)).splitlines()
+
+    # The lexer drops trailing empty lines.
+    return markup + [u''] * (len(lines) - len(markup))
+
+
+def get_diff_contents(filediff, interfilediff, force_interdiff):
+    """
+    Returns the old and new contents to diff for a file, each ending with
+    a newline (unless empty).
+    """
     # There are three ways this function is called:
     #
     #     1) filediff, no interfilediff
@@ -251,6 +286,10 @@ def get_chunks(filediff, interfilediff, force_interdiff,
     #          between two diffs. It requires that the file is included in
     #          both revisions of a diffset.
     #
+    #          When both diffs apply to the same original file, their hunks
+    #          are composed directly (see get_interdiffer). Only when that
+    #          is ambiguous are both original files patched.
+    #
     #     3) filediff, no interfilediff, force_interdiff
     #        - Returns chunks showing the changes between a source
     #          diff and an unmodified version of the diff.
@@ -264,9 +303,20 @@ def get_chunks(filediff, interfilediff, force_interdiff,
 
     assert filediff
 
-    file = filediff.source_file
-    revision = filediff.source_revision
+    if interfilediff:
+        interdiffer = get_interdiffer(filediff, interfilediff)
 
+        if interdiffer is not None:
+            return interdiffer.old, interdiffer.new
+
+    return patch_diff_contents(filediff, interfilediff, force_interdiff)
+
+
+def patch_diff_contents(filediff, interfilediff, force_interdiff):
+    """
+    Returns the old and new contents to diff for a file like
+    get_diff_contents, always patching the full original files.
+    """
     old = get_original_file(filediff)
     new = get_patched_file(old, filediff)
 
@@ -288,78 +338,184 @@ def get_chunks(filediff, interfilediff, force_interdiff,
     if new and new[-1] != '\n':
         new += '\n'
 
-    a = re.split(r"\r?\n", old or '')
-    b = re.split(r"\r?\n", new or '')
+    return old, new
+
+
+def get_interdiffer(filediff, interfilediff, ignore_space=False):
+    """
+    Returns an InterDiffer composing the hunks of filediff and
+    interfilediff, or None if they don't apply to the same original file
+    or can't be composed exactly, in which case both files need patching.
+    """
+    if filediff.source_file != interfilediff.source_file or \
+       filediff.source_revision != interfilediff.source_revision:
+        return None
+
+    try:
+        return InterDiffer(get_original_file(filediff), filediff.diff,
+                           interfilediff.diff, ignore_space)
+    except InterdiffError, e:
+        logging.debug("Patching files for interdiff ids %s-%s: %s",
+                      filediff.id, interfilediff.id, e)
+        return None
+
+
+def get_diff_differ(filediff, interfilediff, force_interdiff,
+                    ignore_space=False):
+    """
+    Returns the old and new contents to diff for a file (see
+    get_diff_contents) along with the differ of their lines, which has
+    them as its a and b.
+    """
+    if interfilediff:
+        interdiffer = get_interdiffer(filediff, interfilediff, ignore_space)
+
+        if interdiffer is not None:
+            return interdiffer.old, interdiffer.new, interdiffer
+
+    old, new = patch_diff_contents(filediff, interfilediff, force_interdiff)
+    differ = Differ(split_lines(old), split_lines(new),
+                    ignore_space=ignore_space)
+
+    return old, new, differ
+
+
+def split_lines(data):
+    lines = re.split(r"\r?\n", data or '')
 
     # Remove the trailing newline, now that we've split this. This will
     # prevent a duplicate line number at the end of the diff.
-    del(a[-1])
-    del(b[-1])
+    del(lines[-1])
 
-    a_num_lines = len(a)
-    b_num_lines = len(b)
+    return lines
 
-    markup_a = markup_b = None
 
-    try:
-        # TODO: Try to figure out the right lexer for these files
-        #       once instead of twice.
-        markup_a = apply_pygments(old or '', filediff.source_file)
-        markup_b = apply_pygments(new or '', filediff.dest_file)
-    except ValueError:
-        pass
+def get_markup(data, filename, enable_syntax_highlighting):
+    """
+    Returns the lines of data as HTML, syntax highlighted if possible.
+    """
+    markup = None
 
-    #siteconfig = SiteConfiguration.objects.get_current()
+    if enable_syntax_highlighting and _have_pygments:
+        try:
+            markup = apply_pygments(data or '', filename)
+        except ValueError:
+            pass
 
-    chunks = []
-    linenum = 1
+    if not markup:
+        markup = re.split(r"\r?\n", escape(data or ''))
+
+    return markup
 
-    ignore_space = False
-    #for pattern in siteconfig.get("diffviewer_include_space_patterns"):
-    #    if fnmatch.fnmatch(file, pattern):
-    #        ignore_space = False
-    #        break
 
-    differ = Differ(a, b, ignore_space=ignore_space)
+def get_chunk_ranges(opcodes, a_num_lines, b_num_lines):
+    """
+    Splits the differ's opcodes into the ranges of lines making up each
+    chunk, collapsing long runs of equal lines except for some context.
 
+    Each range is a dict with the chunk's change tag, its i1/i2 and j1/j2
+    line ranges in the old and new files, the virtual line number of its
+    first line, its number of lines and whether it is collapsable.
+    """
     # TODO: Make this back into a preference if people really want it.
     context_num_lines = 5
     collapse_threshold = 2 * context_num_lines + 3
 
-    if interfilediff:
-        logging.debug("Generating diff chunks for interdiff ids %s-%s",
-                      filediff.id, interfilediff.id)
-    else:
-        logging.debug("Generating diff chunks for filediff id %s", filediff.id)
+    ranges = []
+    linenum = 1
 
-    for tag, i1, i2, j1, j2 in differ.get_opcodes():
-        oldlines = markup_a[i1:i2]
-        newlines = markup_b[j1:j2]
-        numlines = max(len(oldlines), len(newlines))
-
-        lines = map(diff_line,
-                    xrange(linenum, linenum + numlines),
-                    xrange(i1 + 1, i2 + 1), xrange(j1 + 1, j2 + 1),
-                    a[i1:i2], b[j1:j2], oldlines, newlines)
-        linenum += numlines
+    def add_range(tag, i1, i2, j1, j2, start, end, collapsable=False):
+        ranges.append({
+            'change': tag,
+            'i1': i1 + start,
+            'i2': i1 + min(end, i2 - i1),
+            'j1': j1 + start,
+            'j2': j1 + min(end, j2 - j1),
+            'linenum': linenum + start,
+            'numlines': end - start,
+            'collapsable': collapsable,
+        })
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        numlines = max(i2 - i1, j2 - j1)
 
         if tag == 'equal' and numlines > collapse_threshold:
             last_range_start = numlines - context_num_lines
 
-            if len(chunks) == 0:
-                add_ranged_chunks(lines, 0, last_range_start, True)
-                add_ranged_chunks(lines, last_range_start, numlines)
+            if len(ranges) == 0:
+                add_range(tag, i1, i2, j1, j2, 0, last_range_start, True)
+                add_range(tag, i1, i2, j1, j2, last_range_start, numlines)
             else:
-                add_ranged_chunks(lines, 0, context_num_lines)
+                add_range(tag, i1, i2, j1, j2, 0, context_num_lines)
 
                 if i2 == a_num_lines and j2 == b_num_lines:
-                    add_ranged_chunks(lines, context_num_lines, numlines, True)
+                    add_range(tag, i1, i2, j1, j2,
+                              context_num_lines, numlines, True)
                 else:
-                    add_ranged_chunks(lines, context_num_lines,
-                                      last_range_start, True)
-                    add_ranged_chunks(lines, last_range_start, numlines)
+                    add_range(tag, i1, i2, j1, j2,
+                              context_num_lines, last_range_start, True)
+                    add_range(tag, i1, i2, j1, j2,
+                              last_range_start, numlines)
         else:
-            chunks.append(new_chunk(lines, numlines, tag))
+            add_range(tag, i1, i2, j1, j2, 0, numlines)
+
+        linenum += numlines
+
+    return ranges
+
+
+def build_chunk(r, a, b, markup_a, markup_b, a_offset=0, b_offset=0):
+    """
+    Builds the chunk for a range from get_chunk_ranges. The markup lists
+    may only cover part of the files, starting at the given offsets.
+    """
+    i1, i2, j1, j2 = r['i1'], r['i2'], r['j1'], r['j2']
+    linenum = r['linenum']
+    lines = map(diff_line,
+                xrange(linenum, linenum + r['numlines']),
+                xrange(i1 + 1, i2 + 1), xrange(j1 + 1, j2 + 1),
+                a[i1:i2], b[j1:j2],
+                markup_a[i1 - a_offset:i2 - a_offset],
+                markup_b[j1 - b_offset:j2 - b_offset])
+
+    return new_chunk(lines, r['numlines'], r['change'], r['collapsable'])
+
+
+def get_chunks(filediff, interfilediff, force_interdiff,
+               enable_syntax_highlighting):
+    """
+    Returns the chunks showing all the changes to a file, see
+    get_diff_contents for the ways in which this can be called.
+    """
+    #siteconfig = SiteConfiguration.objects.get_current()
+
+    ignore_space = False
+    #for pattern in siteconfig.get("diffviewer_include_space_patterns"):
+    #    if fnmatch.fnmatch(file, pattern):
+    #        ignore_space = False
+    #        break
+
+    old, new, differ = get_diff_differ(filediff, interfilediff,
+                                       force_interdiff, ignore_space)
+    a = differ.a
+    b = differ.b
+
+    # TODO: Try to figure out the right lexer for these files
+    #       once instead of twice.
+    markup_a = get_markup(old, filediff.source_file,
+                          enable_syntax_highlighting)
+    markup_b = get_markup(new, filediff.dest_file,
+                          enable_syntax_highlighting)
+
+    if interfilediff:
+        logging.debug("Generating diff chunks for interdiff ids %s-%s",
+                      filediff.id, interfilediff.id)
+    else:
+        logging.debug("Generating diff chunks for filediff id %s", filediff.id)
+
+    chunks = [build_chunk(r, a, b, markup_a, markup_b)
+              for r in get_chunk_ranges(differ.get_opcodes(),
+                                        len(a), len(b))]
 
     if interfilediff:
         logging.debug("Done generating diff chunks for interdiff ids %s-%s",
@@ -371,6 +527,435 @@ def get_chunks(filediff, interfilediff, force_interdiff,
     return chunks
 
 
+def get_chunk_index(file, contents=None):
+    """
+    Returns the chunk index of a file dict from get_diff_files: the
+    differ's opcodes, the ranges of every chunk (see get_chunk_ranges) and
+    the number of lines of both files.
+
+    The index is small and cached for as long as the chunks would be, so
+    that single chunks or line ranges can be built without highlighting
+    and intraline diffing the whole file. contents is the (old, new,
+    differ) tuple returned by get_diff_differ, if already known.
+    """
+    key = get_file_cache_key('diff-chunk-index', file)
+    index = cache.get(key)
+
+    if index is None:
+        if contents is None:
+            contents = get_diff_differ(file['filediff'],
+                                       file['interfilediff'],
+                                       file['force_interdiff'])
+
+        differ = contents[2]
+        a = differ.a
+        b = differ.b
+        opcodes = list(differ.get_opcodes())
+        index = {
+            'opcodes': opcodes,
+            'ranges': get_chunk_ranges(opcodes, len(a), len(b)),
+            'a_num_lines': len(a),
+            'b_num_lines': len(b),
+        }
+        cache.set(key, index, settings.CACHE_EXPIRATION_TIME)
+
+    return index
+
+
+def get_lexer_checkpoints(file, side, lines, filename):
+    """
+    Returns the lexer checkpoints of one side ('a' or 'b') of a file dict,
+    a list of (line index, state stack) pairs about every
+    LEXER_CHECKPOINT_INTERVAL lines, so that highlighting a range of lines
+    can start lexing from the nearest checkpoint instead of from the start
+    of the file. The list is empty if the file's lexer can't resume lexing.
+
+    Finding the checkpoints lexes the whole file once (without formatting
+    it), so they're cached like the chunk index.
+    """
+    key = get_file_cache_key('diff-lexer-checkpoints-%s' % side, file)
+    checkpoints = cache.get(key)
+
+    if checkpoints is None:
+        checkpoints = []
+        lexer = get_lexer(filename)
+
+        if isinstance(lexer, RegexLexer) and lexer.is_resumable():
+            states = lexer.get_line_states("\n".join(lines) + "\n")
+
+            # Lines starting inside of a token can't be resumed from, take
+            # the next one that can.
+            for i, state in enumerate(states):
+                if state is not None and \
+                   (not checkpoints or
+                    i >= checkpoints[-1][0] + LEXER_CHECKPOINT_INTERVAL):
+                    checkpoints.append((i, state))
+
+        cache.set(key, checkpoints, settings.CACHE_EXPIRATION_TIME)
+
+    return checkpoints
+
+
+def _get_markup_window(file, side, lines, start, end, filename,
+                       enable_syntax_highlighting):
+    """
+    Returns the markup of lines[start:end]. Highlighting lexes the text
+    between the lexer checkpoints around the window, or from the start of
+    the file to the end of the window if there are none.
+    """
+    if start >= end:
+        return []
+
+    if enable_syntax_highlighting and _have_pygments:
+        try:
+            checkpoints = get_lexer_checkpoints(file, side, lines, filename)
+
+            first, stack = 0, None
+            last = end
+
+            if checkpoints:
+                # No token spans a checkpoint, so the text between two of
+                # them lexes the same as the whole file.
+                first, stack = [c for c in checkpoints if c[0] <= start][-1]
+                last = ([c[0] for c in checkpoints if c[0] >= end] or
+                        [len(lines)])[0]
+
+            if first == 0:
+                # Highlighted like the whole file would be.
+                prefix = "\n".join(lines[:last]) + "\n"
+                return apply_pygments(prefix, filename)[start:end]
+
+            markup = apply_pygments_from_state(lines[first:last],
+                                               get_lexer(filename), stack)
+            return markup[start - first:end - first]
+        except ValueError:
+            pass
+
+    return [escape(line) for line in lines[start:end]]
+
+
+def get_chunks_in_range(file, enable_syntax_highlighting,
+                        first_line, last_line):
+    """
+    Returns the chunks of a file dict restricted to the virtual line
+    numbers first_line to last_line (inclusive), using the chunk index so
+    that only the lines in that range are highlighted and diffed.
+    """
+    contents = None
+    key = get_file_cache_key('diff-chunk-index', file)
+
+    if cache.get(key) is None:
+        contents = get_diff_differ(file['filediff'], file['interfilediff'],
+                                   file['force_interdiff'])
+
+    index = get_chunk_index(file, contents)
+    ranges = []
+
+    for r in index['ranges']:
+        r_last = r['linenum'] + r['numlines'] - 1
+
+        if r['numlines'] == 0 or r_last < first_line or \
+           r['linenum'] > last_line:
+            continue
+
+        start = max(first_line, r['linenum']) - r['linenum']
+        end = min(last_line, r_last) - r['linenum'] + 1
+        ranges.append({
+            'change': r['change'],
+            'i1': r['i1'] + min(start, r['i2'] - r['i1']),
+            'i2': r['i1'] + min(end, r['i2'] - r['i1']),
+            'j1': r['j1'] + min(start, r['j2'] - r['j1']),
+            'j2': r['j1'] + min(end, r['j2'] - r['j1']),
+            'linenum': r['linenum'] + start,
+            'numlines': end - start,
+            'collapsable': r['collapsable'],
+        })
+
+    if not ranges:
+        return []
+
+    if contents is None:
+        contents = get_diff_differ(file['filediff'], file['interfilediff'],
+                                   file['force_interdiff'])
+
+    a = contents[2].a
+    b = contents[2].b
+    a_start, a_end = ranges[0]['i1'], ranges[-1]['i2']
+    b_start, b_end = ranges[0]['j1'], ranges[-1]['j2']
+    markup_a = _get_markup_window(file, 'a', a, a_start, a_end,
+                                  file['filediff'].source_file,
+                                  enable_syntax_highlighting)
+    markup_b = _get_markup_window(file, 'b', b, b_start, b_end,
+                                  file['filediff'].dest_file,
+                                  enable_syntax_highlighting)
+
+    return [build_chunk(r, a, b, markup_a, markup_b, a_start, b_start)
+            for r in ranges]
+
+
+def get_revision_str(revision):
+    if revision == HEAD:
+        return "HEAD"
+    elif revision == PRE_CREATION:
+        return ""
+    else:
+        return "Revision %s" % revision
+
+
+def get_diff_files(diffset, filediff=None, interdiffset=None,
+                   enable_syntax_highlighting=True):
+    """
+    Returns a list of file dicts describing each file of the diffset (or
+    only the given filediff), paired up with the matching file of the
+    interdiffset, if any.
+
+    The chunks of the files are not computed here. They are only needed
+    when a fragment isn't already cached, see get_file_chunks.
+    """
+    if filediff:
+        filediffs = [filediff]
+    else:
+        filediffs = diffset.files.all()
+
+    # A map used to quickly look up the equivalent interfilediff given a
+    # source file.
+    interdiff_map = {}
+    if interdiffset:
+        for interfilediff in interdiffset.files.all():
+            if not filediff or \
+               filediff.source_file == interfilediff.source_file:
+                interdiff_map[interfilediff.source_file] = interfilediff
+
+    # In order to support interdiffs properly, we need to display diffs
+    # on every file in the union of both diffsets. We build a list of the
+    # source filediff, the interdiff filediff (if any) and whether to force
+    # showing an interdiff (when the file was reverted in the interdiff).
+    filediff_parts = []
+
+    for filediff in filediffs:
+        interfilediff = interdiff_map.pop(filediff.source_file, None)
+        filediff_parts.append((filediff, interfilediff, interdiffset != None))
+
+    if interdiffset:
+        # What's left are files that are new in the interdiff. They have no
+        # file to diff against, so show them as a standard diff.
+        filediff_parts += [(interfilediff, None, False)
+                           for interfilediff in interdiff_map.values()]
+
+    files = []
+
+    for filediff, interfilediff, force_interdiff in filediff_parts:
+        newfile = (filediff.source_revision == PRE_CREATION)
+
+        if interdiffset:
+            if interfilediff and filediff.diff == interfilediff.diff:
+                # Nothing changed between the two revisions.
+                continue
+
+            source_revision = _("Diff Revision %s") % diffset.revision
+
+            if not interfilediff and force_interdiff:
+                dest_revision = _("Diff Revision %s - File Reverted") % \
+                                interdiffset.revision
+            else:
+                dest_revision = _("Diff Revision %s") % interdiffset.revision
+        else:
+            source_revision = get_revision_str(filediff.source_revision)
+
+            if newfile:
+                dest_revision = NEW_FILE_STR
+            else:
+                dest_revision = NEW_CHANGE_STR
+
+        i = filediff.source_file.rfind('/')
+
+        if i != -1:
+            basepath = filediff.source_file[:i]
+            basename = filediff.source_file[i + 1:]
+        else:
+            basepath = ""
+            basename = filediff.source_file
+
+        files.append({
+            'depot_filename': filediff.source_file,
+            'basename': basename,
+            'basepath': basepath,
+            'revision': source_revision,
+            'dest_revision': dest_revision,
+            'filediff': filediff,
+            'interfilediff': interfilediff,
+            'force_interdiff': force_interdiff,
+            'binary': filediff.binary,
+            'newfile': newfile,
+            'index': len(files),
+        })
+
+    return files
+
+
+def get_file_cache_key(prefix, file):
+    """
+    Returns a cache key for data computed from the filediffs of a file
+    dict, versioned along with the chunks.
+    """
+    key = '%s-v%s-%s-' % (prefix, CHUNKS_CACHE_VERSION,
+                          DEFAULT_DIFF_COMPAT_VERSION)
+
+    if file['force_interdiff']:
+        if file['interfilediff']:
+            key += 'interdiff-%s-%s' % (file['filediff'].id,
+                                        file['interfilediff'].id)
+        else:
+            key += 'interdiff-%s-none' % file['filediff'].id
+    else:
+        key += str(file['filediff'].id)
+
+    return key
+
+
+def get_chunks_cache_key(file, enable_syntax_highlighting):
+    """
+    Returns the cache key of the computed chunks of a file dict, which
+    depends on the filediffs involved and the differ version, but not on
+    how the chunks are later rendered.
+    """
+    key = get_file_cache_key('diff-chunks', file)
+
+    if enable_syntax_highlighting:
+        key += '-highlighting'
+
+    return key
+
+
+def strip_chunks_markup(chunks):
+    """
+    Returns a copy of highlighted chunks with the syntax highlighting
+    markup removed, which is much cheaper than computing them again.
+    """
+    result = []
+
+    for chunk in chunks:
+        chunk = dict(chunk)
+        chunk['lines'] = [
+            [line[0],
+             line[1], mark_safe(_markup_tag_re.sub('', line[2])), line[3],
+             line[4], mark_safe(_markup_tag_re.sub('', line[5])), line[6]]
+            for line in chunk['lines']
+        ]
+        result.append(chunk)
+
+    return result
+
+
+def get_file_chunks(file, enable_syntax_highlighting):
+    """
+    Returns the chunks of a file dict from get_diff_files.
+
+    This is the lower of the two diff caching tiers: the chunks are cached
+    independently of the rendered fragments, so every rendering of a file
+    (collapsed, expanded, a single chunk) is derived from one computation.
+    Unhighlighted chunks are derived from the cached highlighted ones when
+    those exist.
+    """
+    if file['binary']:
+        return []
+
+    key = get_chunks_cache_key(file, enable_syntax_highlighting)
+    chunks = cache.get(key)
+
+    if chunks is not None:
+        return chunks
+
+    if not enable_syntax_highlighting:
+        highlighted = cache.get(get_chunks_cache_key(file, True))
+
+        if highlighted is not None:
+            chunks = strip_chunks_markup(highlighted)
+
+    if chunks is None:
+        chunks = get_chunks(file['filediff'], file['interfilediff'],
+                            file['force_interdiff'],
+                            enable_syntax_highlighting)
+
+    cache.set(key, chunks, settings.CACHE_EXPIRATION_TIME)
+
+    return chunks
+
+
+def slice_chunks(chunks, first_line, last_line):
+    """
+    Returns the parts of chunks covering the virtual line numbers
+    first_line to last_line (inclusive).
+    """
+    result = []
+
+    for chunk in chunks:
+        lines = [line for line in chunk['lines']
+                 if first_line <= line[0] <= last_line]
+
+        if lines:
+            chunk = dict(chunk)
+            chunk['lines'] = lines
+            chunk['numlines'] = len(lines)
+            result.append(chunk)
+
+    return result
+
+
+def get_file_chunks_in_range(file, enable_syntax_highlighting,
+                             first_line, last_line):
+    """
+    Returns the chunks of a file dict covering the virtual line numbers
+    first_line to last_line (inclusive).
+
+    These are sliced out of the cached chunks of the whole file when
+    present. Otherwise only the requested lines are built, from the chunk
+    index, so that large files can be fetched a screenful at a time.
+    """
+    if file['binary']:
+        return []
+
+    chunks = cache.get(get_chunks_cache_key(file, enable_syntax_highlighting))
+
+    if chunks is not None:
+        return slice_chunks(chunks, first_line, last_line)
+
+    return get_chunks_in_range(file, enable_syntax_highlighting,
+                               first_line, last_line)
+
+
+def get_file_chunk(file, enable_syntax_highlighting, chunkindex):
+    """
+    Returns the chunk at chunkindex in a file dict, or None if there's no
+    such chunk. Only that chunk is built when the file's chunks aren't
+    cached yet.
+    """
+    if file['binary'] or chunkindex < 0:
+        return None
+
+    chunks = cache.get(get_chunks_cache_key(file, enable_syntax_highlighting))
+
+    if chunks is not None:
+        if chunkindex < len(chunks):
+            return chunks[chunkindex]
+
+        return None
+
+    ranges = get_chunk_index(file)['ranges']
+
+    if chunkindex >= len(ranges):
+        return None
+
+    r = ranges[chunkindex]
+    chunks = get_chunks_in_range(file, enable_syntax_highlighting,
+                                 r['linenum'],
+                                 r['linenum'] + r['numlines'] - 1)
+
+    if not chunks:
+        return None
+
+    return chunks[0]
+
 
 class FileDiff:
     def __init__(self, id, source_file, source_revision, diff, dest_file):
@@ -1 +1 @@
-SEQUENCE = ['add_parent_diffs']
+SEQUENCE = ['add_parent_diffs', 'compressed_diffs']
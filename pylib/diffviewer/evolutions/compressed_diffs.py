@@ -0,0 +1,12 @@
+from djblets.util.dbevolution import FakeChangeFieldType
+
+from reviewboard.diffviewer.fields import CompressedDiffField
+
+
+# The columns keep their type and names. Existing rows are still read as
+# base64 and are compressed when saved again, or all at once with
+# "manage.py compressdiffs".
+MUTATIONS = [
+    FakeChangeFieldType('FileDiff', 'diff', CompressedDiffField),
+    FakeChangeFieldType('FileDiff', 'parent_diff', CompressedDiffField),
+]
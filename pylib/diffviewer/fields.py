@@ -0,0 +1,145 @@
+import base64
+import re
+import zlib
+
+from django.db import models
+from django.db.models import signals
+from django.dispatch import dispatcher
+
+
+# Prefix of the values stored by CompressedDiffField. Base64 never contains
+# a colon, so values without it are rows stored by the older Base64Field.
+COMPRESSED_PREFIX = 'zlib:'
+
+# Diffs are written once and read many times, so compress them as much as
+# possible.
+COMPRESSION_LEVEL = 9
+
+
+def encode_diff(data):
+    """
+    Returns the stored form of a diff: zlib compressed, then base64 encoded
+    (without line breaks) as the columns are text columns.
+    """
+    return COMPRESSED_PREFIX + base64.b64encode(zlib.compress(data,
+                                                              COMPRESSION_LEVEL))
+
+
+def decode_diff(value):
+    """
+    Returns the diff of a stored value, which is either compressed (see
+    encode_diff) or a plain base64 value of an older Base64Field row.
+    """
+    value = str(value)
+
+    if value.startswith(COMPRESSED_PREFIX):
+        return zlib.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX):]))
+
+    return base64.decodestring(value)
+
+
+def is_compressed(value):
+    return value is not None and str(value).startswith(COMPRESSED_PREFIX)
+
+
+# Base64 values as the older Base64Field stored them. Diffs always hold
+# characters outside of this set ("-", "@", " "...).
+_base64_re = re.compile(r'^[A-Za-z0-9+/=\s]*$')
+
+
+def is_stored(value):
+    """
+    Returns whether value is in a stored form, compressed or base64.
+    """
+    return isinstance(value, basestring) and \
+           not isinstance(value, DecodedDiff) and \
+           (is_compressed(value) or _base64_re.match(value) is not None)
+
+
+# Set on model instances once constructed, see CompressedDiffFieldCreator.
+INITTED_ATTR = '_compressed_diffs_initted'
+
+
+class DecodedDiff(str):
+    """
+    A diff as seen by the application, as opposed to its stored form.
+    """
+    pass
+
+
+class CompressedDiffFieldCreator(object):
+    """
+    Descriptor holding the stored form of a CompressedDiffField, and
+    decoding it on first access only. Listing file diffs doesn't cost any
+    decompression until their diffs are actually looked at.
+    """
+    def __init__(self, field):
+        self.field = field
+        self.cache_name = '_%s_decoded' % field.name
+
+    def __set__(self, obj, value):
+        # While an object is being constructed, values in a stored form come
+        # from the database, whether or not a primary key was given. Anything
+        # assigned later on comes from the application.
+        from_db = not obj.__dict__.get(INITTED_ATTR, False) and \
+                  is_stored(value)
+
+        if value is not None and not from_db:
+            obj.__dict__[self.cache_name] = DecodedDiff(value)
+            value = encode_diff(value)
+        else:
+            obj.__dict__.pop(self.cache_name, None)
+
+        obj.__dict__[self.field.name] = value
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            raise AttributeError('Can only be accessed via an instance.')
+
+        decoded = obj.__dict__.get(self.cache_name)
+
+        if decoded is None:
+            value = obj.__dict__[self.field.name]
+
+            if value is None:
+                return None
+
+            decoded = DecodedDiff(decode_diff(value))
+            obj.__dict__[self.cache_name] = decoded
+
+        return decoded
+
+
+class CompressedDiffField(models.TextField):
+    """
+    A text field storing a diff compressed with zlib.
+
+    Reading the value gives the diff itself. Rows written by the Base64Field
+    this replaces are still read, and get compressed when saved again.
+    """
+    def contribute_to_class(self, cls, name):
+        super(CompressedDiffField, self).contribute_to_class(cls, name)
+        setattr(cls, self.name, CompressedDiffFieldCreator(self))
+        dispatcher.connect(self._post_init, signal=signals.post_init,
+                           sender=cls)
+
+    def _post_init(self, instance):
+        instance.__dict__[INITTED_ATTR] = True
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+
+        if value is not None and not is_compressed(value):
+            value = encode_diff(decode_diff(value))
+            model_instance.__dict__[self.attname] = value
+
+        return value
+
+    def get_db_prep_save(self, value):
+        if isinstance(value, DecodedDiff):
+            value = encode_diff(value)
+
+        return super(CompressedDiffField, self).get_db_prep_save(value)
+
+    def save_form_data(self, instance, data):
+        setattr(instance, self.name, DecodedDiff(data))
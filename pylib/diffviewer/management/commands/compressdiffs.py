@@ -0,0 +1,60 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+
+class Command(NoArgsCommand):
+    help = "Compresses the stored diffs of file diffs written before " \
+           "diffs were compressed."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=500,
+                    help='Number of file diffs to convert per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        from django.db import transaction
+        from reviewboard.diffviewer.fields import decode_diff, encode_diff, \
+                                                  is_compressed
+        from reviewboard.diffviewer.models import FileDiff
+
+        batch_size = options.get('batch_size', 500)
+        verbosity = int(options.get('verbosity', 1))
+        last_id = 0
+        converted = 0
+        saved = 0
+
+        while True:
+            # values() gives the stored values, without decoding them.
+            rows = list(FileDiff.objects.filter(pk__gt=last_id)
+                                        .order_by('pk')
+                                        .values('id', 'diff', 'parent_diff')
+                                        [:batch_size])
+
+            if not rows:
+                break
+
+            for row in rows:
+                changes = {}
+
+                for name in ('diff', 'parent_diff'):
+                    value = row[name]
+
+                    if value is not None and not is_compressed(value):
+                        changes[name] = encode_diff(decode_diff(value))
+                        saved += len(value) - len(changes[name])
+
+                if changes:
+                    FileDiff.objects.filter(pk=row['id']).update(**changes)
+                    converted += 1
+
+            transaction.commit_unless_managed()
+            last_id = rows[-1]['id']
+
+            if verbosity > 1:
+                print "Converted file diffs up to id %s" % last_id
+
+        if verbosity > 0:
+            print "Compressed %d file diffs, saving %d bytes." % (converted,
+                                                                 saved)
@@ -1,9 +1,12 @@
+import time
 from datetime import datetime
 
+from django.core.cache import cache
 from django.db import models
+from django.db.models import signals
+from django.dispatch import dispatcher
 from django.utils.translation import ugettext_lazy as _
-from djblets.util.fields import Base64Field
-
+from reviewboard.diffviewer.fields import CompressedDiffField
 from reviewboard.scmtools.models import Repository
 
 
@@ -22,10 +25,17 @@ class FileDiff(models.Model):
     dest_file = models.CharField(_("destination file"), max_length=256)
     source_revision = models.CharField(_("source file revision"), max_length=512)
     dest_detail = models.CharField(_("destination file details"), max_length=512)
-    diff = Base64Field(_("diff"), db_column="diff_base64")
+    diff = CompressedDiffField(_("diff"), db_column="diff_base64")
     binary = models.BooleanField(_("binary file"), default=False)
-    parent_diff = Base64Field(_("parent diff"), db_column="parent_diff_base64",
-                              blank=True)
+    parent_diff = CompressedDiffField(_("parent diff"),
+                                      db_column="parent_diff_base64",
+                                      blank=True)
+
+    def save(self, **kwargs):
+        super(FileDiff, self).save(**kwargs)
+
+        # The diffset's list of files has changed.
+        self.diffset.invalidate_cache()
 
     def __unicode__(self):
         return u"%s (%s) -> %s (%s)" % (self.source_file, self.source_revision,
@@ -66,6 +76,29 @@ class DiffSet(models.Model):
                 self.revision = self.history.diffsets.latest().revision + 1
 
         super(DiffSet, self).save()
+        self.invalidate_cache()
+
+    def get_cache_generation(self):
+        """
+        Returns a token identifying the current state of this diffset, for
+        use in the keys of cached data derived from it.
+        """
+        key = get_generation_key(self.id)
+        generation = cache.get(key)
+
+        if generation is None:
+            # Never cached, evicted or invalidated. A new token makes every
+            # entry keyed on the previous one unreachable.
+            generation = repr(time.time())
+            cache.set(key, generation)
+
+        return generation
+
+    def invalidate_cache(self):
+        """
+        Invalidates all cached data derived from this diffset.
+        """
+        cache.delete(get_generation_key(self.id))
 
     def __unicode__(self):
         return u"[%s] %s r%s" % (self.id, self.name, self.revision)
@@ -75,6 +108,21 @@ class DiffSet(models.Model):
         ordering = ['revision', 'timestamp']
 
 
+def get_generation_key(diffset_id):
+    return 'diffset-generation-%s' % diffset_id
+
+
+def filediff_deleted(instance):
+    """
+    Invalidates the cached data of a deleted FileDiff's diffset, whose list
+    of files has changed. Deleting a queryset sends this for every FileDiff.
+    """
+    cache.delete(get_generation_key(instance.diffset_id))
+
+dispatcher.connect(filediff_deleted, signal=signals.post_delete,
+                   sender=FileDiff)
+
+
 class DiffSetHistory(models.Model):
     """
     A collection of diffsets.
@@ -1,9 +1,40 @@
+from bisect import bisect_right
+
+
+def _strip_trailing_cr(line):
+    if line.endswith("\r"):
+        return line[:-1]
+    return line
+
+
 class MyersDiffer:
     """
     An implementation of Eugene Myers's O(ND) Diff algorithm based on GNU diff.
     """
     SNAKE_LIMIT = 20
 
+    # Line normalization modes, used to compare lines while ignoring
+    # differences that don't matter to the reader.
+    IGNORE_ALL_SPACE = "ignore-all-space"
+    IGNORE_SPACE_CHANGE = "ignore-space-change"
+    IGNORE_CASE = "ignore-case"
+    IGNORE_TRAILING_CR = "ignore-trailing-cr"
+
+    NORMALIZERS = {
+        IGNORE_ALL_SPACE: lambda line: "".join(line.split()),
+        IGNORE_SPACE_CHANGE: lambda line: " ".join(line.split()),
+        IGNORE_CASE: lambda line: line.lower(),
+        IGNORE_TRAILING_CR: _strip_trailing_cr,
+    }
+
+    # Blocks of fewer lines aren't reported as moved, see
+    # get_opcodes_with_moves().
+    MOVE_MIN_LINES = 4
+
+    # Parameters of the rolling hash of the line codes of moved blocks.
+    HASH_BASE = 1000003
+    HASH_MODULUS = 2147483647
+
     DISCARD_NONE = 0
     DISCARD_FOUND = 1
     DISCARD_CANCEL = 2
@@ -24,17 +55,25 @@ class MyersDiffer:
             return self.modified.has_key(line) and self.modified[line]
 
 
-    def __init__(self, a, b, ignore_space=False):
+    def __init__(self, a, b, ignore_space=False, normalize=None):
+        """
+        normalize is an optional list of normalization modes (see
+        NORMALIZERS) and/or callables, each taking a line and returning the
+        key it should be compared by. They are applied in order.
+        """
         if type(a) != type(b):
             raise TypeError
 
         self.a = a
         self.b = b
         self.code_table = {}
+        self.line_table = {}
         self.last_code = 0
         self.a_data = self.b_data = None
         self.ignore_space = ignore_space
+        self.normalizers = self._get_normalizers(normalize or [])
         self.minimal_diff = False
+        self.moves = []
 
         # SMS State
         self.max_lines = 0
@@ -133,6 +172,149 @@ class MyersDiffer:
 
         yield last_group
 
+    def get_opcodes_with_moves(self, min_lines=None):
+        """
+        Generator returning the opcodes of get_opcodes(), with the blocks of
+        at least min_lines lines deleted from one place and inserted
+        unchanged at another split out of the other opcodes. The lines
+        i1:i2 of a moved to j1:j2 in b are returned as ("move", i1, i2, j, j)
+        where they were deleted and ("move", i, i, j1, j2) where they were
+        inserted. The (i1, i2, j1, j2) moves are kept in self.moves.
+        """
+        if min_lines is None:
+            min_lines = self.MOVE_MIN_LINES
+
+        opcodes = list(self.get_opcodes())
+        self.moves = self._find_moves(opcodes, min_lines)
+
+        if not self.moves:
+            for opcode in opcodes:
+                yield opcode
+            return
+
+        a_moves = dict([(move[0], move) for move in self.moves])
+        b_moves = dict([(move[2], move) for move in self.moves])
+        a_starts = sorted(a_moves.keys())
+        b_starts = sorted(b_moves.keys())
+
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                yield tag, i1, i2, j1, j2
+                continue
+
+            i, j = i1, j1
+
+            while i < i2 or j < j2:
+                if i < i2 and i in a_moves:
+                    end = a_moves[i][1]
+                    yield "move", i, end, j, j
+                    i = end
+                elif j < j2 and j in b_moves:
+                    end = b_moves[j][3]
+                    yield "move", i, i, j, end
+                    j = end
+                else:
+                    # The lines up to the next moves are still changed.
+                    k = bisect_right(a_starts, i)
+                    a_end = i2
+                    if k < len(a_starts):
+                        a_end = min(a_end, a_starts[k])
+
+                    k = bisect_right(b_starts, j)
+                    b_end = j2
+                    if k < len(b_starts):
+                        b_end = min(b_end, b_starts[k])
+
+                    if i < a_end and j < b_end:
+                        yield "replace", i, a_end, j, b_end
+                    elif i < a_end:
+                        yield "delete", i, a_end, j, j
+                    else:
+                        yield "insert", i, i, j, b_end
+
+                    i, j = a_end, b_end
+
+    def _find_moves(self, opcodes, min_lines):
+        """
+        Returns the (i1, i2, j1, j2) blocks of deleted lines a[i1:i2] that
+        were inserted unchanged as b[j1:j2], longest first from the top of
+        a, matching the windows of min_lines line codes of the deleted lines
+        against an index of the rolling hashes of the inserted ones.
+        """
+        a_codes = self.a_data.data
+        b_codes = self.b_data.data
+
+        index = {}
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag in ("insert", "replace"):
+                for j, key in self._get_window_hashes(b_codes, j1, j2,
+                                                      min_lines):
+                    index.setdefault(key, []).append((j, j2))
+
+        if not index:
+            return []
+
+        moves = []
+        taken = {}
+
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag not in ("delete", "replace"):
+                continue
+
+            hashes = dict(self._get_window_hashes(a_codes, i1, i2, min_lines))
+            i = i1
+
+            while i + min_lines <= i2:
+                best_j = best_size = None
+
+                for j, j_end in index.get(hashes[i], []):
+                    size = 0
+                    while i + size < i2 and j + size < j_end and \
+                          a_codes[i + size] == b_codes[j + size] and \
+                          j + size not in taken:
+                        size += 1
+
+                    if size >= min_lines and size > best_size:
+                        best_j, best_size = j, size
+
+                if best_j is None or \
+                   not "".join(self.a[i:i + best_size]).strip():
+                    # Blocks of blank lines aren't worth showing as moved.
+                    i += 1
+                    continue
+
+                moves.append((i, i + best_size, best_j, best_j + best_size))
+
+                for j in xrange(best_j, best_j + best_size):
+                    taken[j] = True
+
+                i += best_size
+
+        return moves
+
+    def _get_window_hashes(self, codes, lower, upper, size):
+        """
+        Returns the (start, hash) pairs of every run of size codes in
+        codes[lower:upper].
+        """
+        if upper - lower < size:
+            return []
+
+        base = self.HASH_BASE
+        modulus = self.HASH_MODULUS
+        high = pow(base, size - 1, modulus)
+
+        key = 0
+        for k in xrange(lower, lower + size):
+            key = (key * base + codes[k]) % modulus
+
+        hashes = [(lower, key)]
+        for k in xrange(lower + size, upper):
+            key = ((key - codes[k - size] * high) * base + codes[k]) % modulus
+            hashes.append((k - size + 1, key))
+
+        return hashes
+
     def _gen_diff_data(self):
         """
         Generate all the diff data needed to return opcodes or the diff ratio.
@@ -161,32 +343,71 @@ class MyersDiffer:
         self._shift_chunks(self.a_data, self.b_data)
         self._shift_chunks(self.b_data, self.a_data)
 
+    def _get_normalizers(self, normalize):
+        if callable(normalize) or isinstance(normalize, basestring):
+            normalize = [normalize]
+
+        normalizers = []
+
+        for mode in normalize:
+            if callable(mode):
+                normalizers.append(mode)
+            elif mode in self.NORMALIZERS:
+                normalizers.append(self.NORMALIZERS[mode])
+            elif mode:
+                raise ValueError("Unknown line normalization mode %r" % mode)
+
+        return normalizers
+
+    def _normalize_line(self, line):
+        if self.ignore_space:
+            temp = line.lstrip()
+
+            # We still want to show lines that contain only whitespace.
+            if temp != "":
+                line = temp
+
+        for normalizer in self.normalizers:
+            line = normalizer(line)
+
+        return line
+
     def _gen_diff_codes(self, lines):
         """
         Converts all unique lines of text into unique numbers. Comparing
         lists of numbers is faster than comparing lists of strings.
+
+        Lines are normalized once per distinct line; lines that normalize to
+        the same key share a code.
         """
         codes = []
+        normalize = self.ignore_space or self.normalizers
 
-        for line in lines:
-            # TODO: Handle ignoring/triming spaces, ignoring casing, and
-            #       special hooks
+        if normalize:
+            line_table = self.line_table
+        else:
+            # Lines are their own keys, so a single table does the job.
+            line_table = self.code_table
 
-            if self.ignore_space:
-                temp = line.lstrip()
+        for line in lines:
+            if line in line_table:
+                codes.append(line_table[line])
+                continue
 
-                # We still want to show lines that contain only whitespace.
-                if temp != "":
-                    line = temp
+            if normalize:
+                key = self._normalize_line(line)
+            else:
+                key = line
 
-            if self.code_table.has_key(line):
-                code = self.code_table[line]
+            if self.code_table.has_key(key):
+                code = self.code_table[key]
             else:
                 # This is a new, unrecorded line, so mark it and store it.
                 self.last_code += 1
                 code = self.last_code
-                self.code_table[line] = code
+                self.code_table[key] = code
 
+            line_table[line] = code
             codes.append(code)
 
         return codes
@@ -25,6 +25,7 @@ class DiffParser(object):
     """
 
     INDEX_SEP = "=" * 67
+    BINARY_FILES_RE = re.compile(r"^Binary files (.+) and (.+) differ$")
 
     def __init__(self, data):
         self.data = data
@@ -90,6 +91,7 @@ class DiffParser(object):
                 line = self.lines[i]
 
                 if line.startswith("--- ") or line.startswith("+++ ") or \
+                   line.startswith("Binary files ") or \
                    line.startswith("RCS file: ") or \
                    line.startswith("retrieving revision ") or \
                    line.startswith("diff ") or \
@@ -154,6 +156,15 @@ class DiffParser(object):
             except ValueError:
                 raise DiffParserError("The diff file is missing revision " +
                                       "information", linenum)
+        elif linenum < len(self.lines):
+            # Binary files have no hunks, just a one line summary.
+            m = self.BINARY_FILES_RE.match(self.lines[linenum])
+
+            if m:
+                info['binary'] = True
+                info['origFile'], info['newFile'] = m.group(1, 2)
+                info['origInfo'] = info['newInfo'] = ""
+                linenum += 1
 
         return linenum
 
@@ -1,11 +1,24 @@
+import base64
 import os
 import unittest
 
+from django.template import Context, Template
+from django.template.compiler import compile_template, \
+                                     get_compiled_template, \
+                                     CompiledTemplate
+from django.template.loader import find_template_source
 from django.test import TestCase
 from djblets.siteconfig.models import SiteConfiguration
+import pygments
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_for_filename
 
+from reviewboard.diffviewer.interdiff import InterDiffer, InterdiffError
+from reviewboard.diffviewer.patiencediff import PatienceDiffer
 from reviewboard.diffviewer.templatetags.difftags import highlightregion
 import reviewboard.diffviewer.diffutils as diffutils
+import reviewboard.diffviewer.fields as difffields
+from reviewboard.diffviewer.models import FileDiff
 import reviewboard.diffviewer.parser as diffparser
 
 
@@ -76,11 +89,158 @@ class MyersDifferTest(TestCase):
                           ("equal",  19, 20, 402, 403)])
 
 
+    def testNormalizedDiff(self):
+        """Testing myers differ with line normalization"""
+        a = ["int x = 1;", "  foo( a,b );", "Bar\r"]
+        b = ["int  x = 1;", "foo(a, b);", "bar"]
+
+        self.__test_diff(a, b, [("replace", 0, 3, 0, 3)])
+        self.__test_diff(a, b, [("equal",   0, 1, 0, 1),
+                                ("replace", 1, 3, 1, 3)],
+                         ["ignore-space-change"])
+        self.__test_diff(a, b, [("equal",   0, 2, 0, 2),
+                                ("replace", 2, 3, 2, 3)],
+                         ["ignore-all-space"])
+        self.__test_diff(a, b, [("equal", 0, 3, 0, 3)],
+                         ["ignore-all-space", "ignore-case",
+                          "ignore-trailing-cr"])
+        self.__test_diff(["a1", "b"], ["a2", "b"], [("equal", 0, 2, 0, 2)],
+                         [lambda line: line[0]])
+
+    def testMovedBlocks(self):
+        """Testing myers differ with moved block detection"""
+        block = ["def f():", "    a = 1", "    b = 2", "    return a + b"]
+        rest = ["line %d" % i for i in range(10)]
+
+        differ = diffutils.MyersDiffer(block + rest, rest + block)
+        self.assertEquals(list(differ.get_opcodes_with_moves()),
+                          [("move",  0,  4,  0,  0),
+                           ("equal", 4, 14,  0, 10),
+                           ("move", 14, 14, 10, 14)])
+        self.assertEquals(differ.moves, [(0, 4, 10, 14)])
+
+        # Blocks under the minimum size stay deleted and inserted.
+        differ = diffutils.MyersDiffer(block + rest, rest + block)
+        self.assertEquals(list(differ.get_opcodes_with_moves(5)),
+                          [("delete", 0,  4,  0,  0),
+                           ("equal",  4, 14,  0, 10),
+                           ("insert", 14, 14, 10, 14)])
+        self.assertEquals(differ.moves, [])
+
+        # Moved lines are split out of replaced lines.
+        differ = diffutils.MyersDiffer(["x"] + block + rest,
+                                       ["y"] + rest + ["z"] + block)
+        self.assertEquals(list(differ.get_opcodes_with_moves()),
+                          [("replace", 0,  1,  0,  1),
+                           ("move",    1,  5,  1,  1),
+                           ("equal",   5, 15,  1, 11),
+                           ("insert", 15, 15, 11, 12),
+                           ("move",   15, 15, 12, 16)])
+
+    def __test_diff(self, a, b, expected, normalize=None):
+        opcodes = list(diffutils.MyersDiffer(a, b,
+                                             normalize=normalize).get_opcodes())
+        self.assertEquals(opcodes, expected)
+
+
+class PatienceDifferTest(unittest.TestCase):
+    def testDiff(self):
+        """Testing patience differ"""
+        self.__test_diff(["1", "2", "3"],
+                         ["1", "2", "3"],
+                         [("equal", 0, 3, 0, 3)])
+
+        self.__test_diff(["1", "2", "3"],
+                         [],
+                         [("delete", 0, 3, 0, 0)])
+
+        self.__test_diff(["a", "b", "c", "d", "e"],
+                         ["a", "x", "c", "d", "y", "e"],
+                         [("equal",   0, 1, 0, 1),
+                          ("replace", 1, 2, 1, 2),
+                          ("equal",   2, 4, 2, 4),
+                          ("insert",  4, 4, 4, 5),
+                          ("equal",   4, 5, 5, 6)])
+
+    def testUniqueLines(self):
+        """Testing patience differ matching unique lines"""
+        # Only one of the two swapped unique lines can be kept.
+        self.__test_diff(["}", "f", "}", "g", "}"],
+                         ["}", "g", "}", "f", "}"],
+                         [("equal",  0, 1, 0, 1),
+                          ("insert", 1, 1, 1, 3),
+                          ("equal",  1, 2, 3, 4),
+                          ("delete", 2, 4, 4, 4),
+                          ("equal",  4, 5, 4, 5)])
+
+        # Matches extend over the repeated lines around them.
+        self.__test_diff(["1", "2", "1", "3"],
+                         ["3", "1", "2", "1"],
+                         [("insert", 0, 0, 0, 1),
+                          ("equal",  0, 3, 1, 4),
+                          ("delete", 3, 4, 4, 4)])
+
     def __test_diff(self, a, b, expected):
-        opcodes = list(diffutils.MyersDiffer(a, b).get_opcodes())
+        opcodes = list(PatienceDiffer(a, b).get_opcodes())
         self.assertEquals(opcodes, expected)
 
 
+class InterDifferTest(unittest.TestCase):
+    PREFIX = 'diffviewer/testdata'
+
+    ORIG = "1\n2\n3\n4\n5\n6\n7\n8\n9\n"
+    DIFF1 = "--- f\n+++ f\n@@ -1,3 +1,3 @@\n 1\n-2\n+two\n 3\n"
+    DIFF2 = "--- f\n+++ f\n@@ -1,3 +1,3 @@\n 1\n-2\n+2.0\n 3\n" \
+            "@@ -7,3 +7,4 @@\n 7\n 8\n+8.5\n 9\n"
+
+    def testCompose(self):
+        """Testing interdiffs composed from hunks"""
+        differ = InterDiffer(self.ORIG, self.DIFF1, self.DIFF2)
+        self.assertEqual(differ.old, "1\ntwo\n3\n4\n5\n6\n7\n8\n9\n")
+        self.assertEqual(differ.new,
+                         "1\n2.0\n3\n4\n5\n6\n7\n8\n8.5\n9\n")
+        self.assertEqual(list(differ.get_opcodes()),
+                         [("equal",   0, 1, 0, 1),
+                          ("replace", 1, 2, 1, 2),
+                          ("equal",   2, 8, 2, 8),
+                          ("insert",  8, 8, 8, 9),
+                          ("equal",   8, 9, 9, 10)])
+
+        # The same change in both diffs cancels out.
+        differ = InterDiffer(self.ORIG, self.DIFF1, self.DIFF1)
+        self.assertEqual(list(differ.get_opcodes()),
+                         [("equal", 0, 9, 0, 9)])
+
+    def testPatchedFile(self):
+        """Testing interdiffs against patching"""
+        for file, orig_file in (('foo.c', 'foo.c'),
+                                ('README', 'README'),
+                                ('README', 'README.crlf')):
+            orig = self._get_file('orig_src', orig_file)
+            new = self._get_file('new_src', file)
+            diff = self._get_file('diffs', 'unified', '%s.diff' % orig_file)
+
+            differ = InterDiffer(orig, "", diff)
+            self.assertEqual(differ.new, new)
+
+    def testAmbiguous(self):
+        """Testing interdiffs of hunks that don't apply exactly"""
+        # The context doesn't match, patch would look for an offset.
+        diff = "--- f\n+++ f\n@@ -2,3 +2,3 @@\n 1\n-2\n+two\n 3\n"
+        self.assertRaises(InterdiffError,
+                          lambda: InterDiffer(self.ORIG, diff, self.DIFF2))
+
+        diff = self._get_file('diffs', 'context', 'foo.c.diff')
+        self.assertRaises(InterdiffError,
+                          lambda: InterDiffer(self.ORIG, diff, self.DIFF2))
+
+    def _get_file(self, *relative):
+        f = open(os.path.join(*tuple([self.PREFIX] + list(relative))))
+        data = f.read()
+        f.close()
+        return data
+
+
 class DiffParserTest(unittest.TestCase):
     PREFIX = 'diffviewer/testdata'
 
@@ -123,6 +283,16 @@ class DiffParserTest(unittest.TestCase):
         files = diffparser.DiffParser(data).parse()
         self.compareDiffs(files, "context")
 
+    def testBinaryDiff(self):
+        """Testing parse on a diff containing a binary file"""
+        data = "Index: logo.png\n" + diffparser.DiffParser.INDEX_SEP + "\n" + \
+               "Binary files a/logo.png and b/logo.png differ\n"
+        files = diffparser.DiffParser(data).parse()
+        self.assertEqual(len(files), 1)
+        self.failUnless(files[0].binary)
+        self.assertEqual(files[0].origFile, "a/logo.png")
+        self.assertEqual(files[0].newFile, "b/logo.png")
+
     def testPatch(self):
         """Testing patching"""
 
@@ -218,6 +388,227 @@ class DiffParserTest(unittest.TestCase):
         return data
 
 
+class StripChunksMarkupTest(unittest.TestCase):
+    def testStripChunksMarkup(self):
+        """Testing deriving unhighlighted chunks from highlighted chunks"""
+        chunks = [{
+            'lines': [[1, 1, '<span class="k">if</span> a &lt; b', [(0, 2)],
+                          1, '<span class="k">if</span> a &gt; b', [(0, 2)]]],
+            'numlines': 1,
+            'change': 'replace',
+            'collapsable': False,
+        }]
+        stripped = diffutils.strip_chunks_markup(chunks)
+        self.assertEqual(stripped[0]['lines'],
+                         [[1, 1, 'if a &lt; b', [(0, 2)],
+                              1, 'if a &gt; b', [(0, 2)]]])
+        self.assertEqual(stripped[0]['change'], 'replace')
+        self.assertEqual(chunks[0]['lines'][0][2],
+                         '<span class="k">if</span> a &lt; b')
+
+
+class ChunkRangesTest(unittest.TestCase):
+    def testChunkRanges(self):
+        """Testing splitting opcodes into collapsed chunk ranges"""
+        ranges = diffutils.get_chunk_ranges(
+            [('equal', 0, 20, 0, 20), ('replace', 20, 21, 20, 21),
+             ('equal', 21, 40, 21, 40)], 40, 40)
+        self.assertEqual([(r['change'], r['linenum'], r['numlines'],
+                           r['collapsable']) for r in ranges],
+                         [('equal', 1, 15, True), ('equal', 16, 5, False),
+                          ('replace', 21, 1, False), ('equal', 22, 5, False),
+                          ('equal', 27, 14, True)])
+        self.assertEqual((ranges[4]['i1'], ranges[4]['i2']), (26, 40))
+
+    def testSliceChunks(self):
+        """Testing slicing chunks to a range of lines"""
+        chunks = [
+            diffutils.new_chunk([[1], [2], [3]], 3, 'equal', True),
+            diffutils.new_chunk([[4], [5]], 2, 'insert'),
+        ]
+        sliced = diffutils.slice_chunks(chunks, 3, 4)
+        self.assertEqual([(c['change'], c['lines'], c['numlines'])
+                          for c in sliced],
+                         [('equal', [[3]], 1), ('insert', [[4]], 1)])
+        self.assertEqual(len(chunks[0]['lines']), 3)
+
+
+class CompressedDiffTest(unittest.TestCase):
+    def testEncodeDecode(self):
+        """Testing compressing and decompressing stored diffs"""
+        diff = "--- README\n+++ README\n@@ -1 +1 @@\n-a\n+b\n" * 100
+        value = difffields.encode_diff(diff)
+        self.assert_(difffields.is_compressed(value))
+        self.assert_(len(value) < len(diff))
+        self.assertEqual(difffields.decode_diff(value), diff)
+        self.assertEqual(difffields.decode_diff(difffields.encode_diff("")),
+                         "")
+
+    def testDecodeBase64(self):
+        """Testing reading diffs stored by the older base64 field"""
+        diff = "--- README\n+++ README\n"
+        value = base64.encodestring(diff)
+        self.assert_(not difffields.is_compressed(value))
+        self.assertEqual(difffields.decode_diff(value), diff)
+
+    def testConstructWithPk(self):
+        """Testing constructing FileDiffs with an explicit primary key"""
+        diff = "--- README\n+++ README\n@@ -1 +1 @@\n-a\n+b\n"
+
+        filediff = FileDiff(id=5, diff=diff)
+        self.assert_(difffields.is_compressed(filediff.__dict__['diff']))
+        self.assertEqual(filediff.diff, diff)
+
+        # Stored forms, as read from the database.
+        for value in (difffields.encode_diff(diff),
+                      base64.encodestring(diff)):
+            self.assertEqual(FileDiff(id=5, diff=value).diff, diff)
+
+
+class LexerStateTest(unittest.TestCase):
+    def testLineStates(self):
+        """Testing resuming lexing from line state checkpoints"""
+        lexer = get_lexer_for_filename('test.py', stripnl=False)
+        lines = ['def f(a):', '    """Doc', '    string"""',
+                 '    s = \'\'\'a', 'b\'\'\'', '', '    return a']
+        text = '\n'.join(lines) + '\n'
+        states = lexer.get_line_states(text)
+        self.assertEqual(len(states), len(lines))
+        self.assertEqual(states[0], ('root',))
+        self.assertEqual(states[2], None)
+
+        formatter = HtmlFormatter(nowrap=True)
+        markup = pygments.format(lexer.get_tokens(text),
+                                 formatter).splitlines()
+        resumed = 0
+
+        for i, state in enumerate(states):
+            if state is None:
+                continue
+
+            tail = '\n'.join(lines[i:]) + '\n'
+            self.assertEqual(
+                pygments.format(lexer.get_tokens_from_state(tail, state),
+                                formatter).splitlines(),
+                markup[i:])
+            resumed += 1
+
+        self.assert_(resumed >= 5)
+
+    def testHighlightFragments(self):
+        """Testing highlighting hunks of a file separately"""
+        lines = ['x = 1', 'y = """a', 'b"""', '', '']
+        markup = diffutils.apply_pygments_from_state(
+            lines[1:], get_lexer_for_filename('test.py'), ('root',))
+        self.assertEqual(len(markup), 4)
+        self.assert_('class="s"' in markup[1])
+
+
+class ContextTest(unittest.TestCase):
+    def testLookups(self):
+        """Testing context lookups across pushes and pops"""
+        context = Context({'a': 1, 'b': 2})
+        self.assertEqual(context['a'], 1)
+        context.push()
+        context['a'] = 3
+        self.assertEqual((context['a'], context.get('b')), (3, 2))
+        context.update({'b': 4})
+        self.assertEqual(context['b'], 4)
+        context.pop()
+        self.assertEqual((context['a'], context['b']), (3, 2))
+        context.pop()
+        self.assertEqual(context['a'], 1)
+        del context['a']
+        self.assert_('a' not in context)
+        self.assertEqual(context.get('a', 5), 5)
+        self.assertRaises(KeyError, lambda: context['a'])
+
+    def testPushedDicts(self):
+        """Testing context lookups see keys added to pushed dicts"""
+        outer = {'a': 1}
+        context = Context(outer)
+        dicts = context.dicts
+        self.assertEqual(context['a'], 1)
+        context.push()['a'] = 2
+        self.assertEqual(context['a'], 2)
+        context.update({})['a'] = 3
+        self.assertEqual(context['a'], 3)
+        self.assertEqual(dicts, [outer])
+        context.pop()
+        context.pop()
+        outer['b'] = 4
+        self.assertEqual((context['a'], context['b']), (1, 4))
+
+
+class CompiledTemplateTest(unittest.TestCase):
+    def _get_lines(self, count):
+        return [[i, i, u'a <b> \xe9 %d' % i, [(0, 1)],
+                 i, u'b\t%d ' % i, [(2, 4)]]
+                for i in range(1, count + 1)]
+
+    def testDiffFragment(self):
+        """Testing compiled diff fragments match interpreted ones"""
+        source, origin = \
+            find_template_source('diffviewer/diff_file_fragment.html')
+        template = Template(source, origin)
+        compiled = compile_template(template)
+        chunks = [
+            diffutils.new_chunk(self._get_lines(20), 20, 'equal', True),
+            diffutils.new_chunk(self._get_lines(3), 3, 'replace'),
+            diffutils.new_chunk(self._get_lines(1), 1, 'insert'),
+            diffutils.new_chunk(self._get_lines(2), 2, 'equal'),
+        ]
+
+        for binary in (False, True):
+            for standalone in (False, True):
+                for collapseall in (False, True):
+                    file = {
+                        'id': 1,
+                        'newfile': True,
+                        'binary': binary,
+                        'chunks': chunks,
+                        'dest_file': 'a<b>.py',
+                        'source_revision': '1',
+                        'dest_revision': '2',
+                    }
+                    context = {
+                        'file': file,
+                        'collapseall': collapseall,
+                        'standalone': standalone,
+                    }
+                    self.assertEqual(compiled.render(Context(context)),
+                                     template.render(Context(context)))
+
+    def testTags(self):
+        """Testing compiled templates match interpreted ones"""
+        sources = [
+            '{% for a in b reversed %}{{ forloop.counter }}'
+            '{% for c in b %}{{ forloop.parentloop.last }}{{ c }}{% endfor %}'
+            '{{ a|default:"x" }}{% endfor %}',
+            '{% if a or not b %}y{% else %}n{% endif %}'
+            '{% if a and b.0 %}y{% endif %}{{ "literal" }}{{ _("x") }}',
+            '{% ifequal a "1" %}e{% endifequal %}'
+            '{% ifnotequal a b %}{{ a|join:", " }}{% endifnotequal %}'
+            '{{ missing|default:"-" }}{% comment %}{{ a }}{% endcomment %}',
+        ]
+        contexts = [{}, {'a': [1, '<2>'], 'b': [3, 4]}, {'a': '1'}]
+
+        for source in sources:
+            for context in contexts:
+                self.assertEqual(
+                    compile_template(Template(source)).render(
+                        Context(context)),
+                    Template(source).render(Context(context)))
+
+    def testUncompilable(self):
+        """Testing falling back on uncompilable templates"""
+        template = get_compiled_template('{% cycle a b %}')
+        self.assert_(not isinstance(template, CompiledTemplate))
+        template = get_compiled_template('{{ a }}')
+        self.assert_(isinstance(template, CompiledTemplate))
+        self.assert_(get_compiled_template('{{ a }}') is template)
+
+
 class HighlightRegionTest(TestCase):
     def setUp(self):
         siteconfig = SiteConfiguration.objects.get_current()
@@ -0,0 +1,22 @@
+from django.conf.urls.defaults import patterns, url
+
+
+urlpatterns = patterns('reviewboard.diffviewer.views',
+    url(r'^(?P<diffset_id>[0-9]+)/$', 'view_diff', name="view-diff"),
+    url(r'^(?P<diffset_id>[0-9]+)-(?P<interdiffset_id>[0-9]+)/$',
+        'view_diff', name="view-interdiff"),
+
+    # File fragments
+    url(r'^(?P<diffset_id>[0-9]+)/fragment/(?P<filediff_id>[0-9]+)/$',
+        'view_diff_fragment', name="diff-fragment"),
+    url(r'^(?P<diffset_id>[0-9]+)/fragment/(?P<filediff_id>[0-9]+)/'
+        r'chunk/(?P<chunkindex>[0-9]+)/$',
+        'view_diff_fragment', name="diff-fragment-chunk"),
+    url(r'^(?P<diffset_id>[0-9]+)/fragment/(?P<filediff_id>[0-9]+)/'
+        r'lines/(?P<first_line>[0-9]+)-(?P<last_line>[0-9]+)/$',
+        'view_diff_fragment_lines', name="diff-fragment-lines"),
+    url(r'^(?P<diffset_id>[0-9]+)-(?P<interdiffset_id>[0-9]+)/fragment/'
+        r'(?P<filediff_id>[0-9]+)/lines/'
+        r'(?P<first_line>[0-9]+)-(?P<last_line>[0-9]+)/$',
+        'view_diff_fragment_lines', name="interdiff-fragment-lines"),
+)
@@ -1,7 +1,10 @@
 import logging
 import traceback
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db import connection
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
@@ -15,7 +18,10 @@ from djblets.util.misc import cache_memoize, get_object_or_none
 from reviewboard.accounts.models import Profile
 from reviewboard.admin.checks import get_can_enable_syntax_highlighting
 from reviewboard.diffviewer.models import DiffSet, FileDiff
-from reviewboard.diffviewer.diffutils import UserVisibleError, get_diff_files
+from reviewboard.diffviewer.diffutils import UserVisibleError, \
+                                             get_diff_files, get_file_chunks, \
+                                             get_file_chunk, \
+                                             get_file_chunks_in_range
 
 
 def get_enable_highlighting(user):
@@ -31,9 +37,11 @@ def get_enable_highlighting(user):
             get_can_enable_syntax_highlighting())
 
 
-def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
-                        context,
-                        template_name='diffviewer/diff_file_fragment.html'):
+def get_diff_fragment_cache_key(file, chunkindex, highlighting, collapseall,
+                                template_name, lines=None):
+    """
+    Returns the cache key of a rendered fragment, see build_diff_fragment.
+    """
     key = template_name + '-'
 
     if file['force_interdiff']:
@@ -45,27 +53,200 @@ def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
     else:
         key += str(file['filediff'].id)
 
-    if chunkindex:
-        chunkindex = int(chunkindex)
-        if chunkindex < 0 or chunkindex >= len(file['chunks']):
-            raise UserVisibleError(_(u"Invalid chunk index %s specified.") % \
-                                   chunkindex)
-
-        file['chunks'] = [file['chunks'][chunkindex]]
+    if chunkindex is not None:
         key += '-chunk-%s' % chunkindex
 
+    if lines:
+        key += '-lines-%s-%s' % lines
+
     if collapseall:
         key += '-collapsed'
-        context['collapseall'] = True
 
     if highlighting:
         key += '-highlighting'
 
+    return key
+
+
+def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
+                        context,
+                        template_name='diffviewer/diff_file_fragment.html',
+                        lines=None):
+    """
+    Returns the rendered fragment of a file.
+
+    Rendered fragments are the upper of two caching tiers. On a miss, the
+    chunks come from the lower tier (see get_file_chunks), which is shared
+    by every rendering variant of the file. A single chunk, or the range of
+    virtual line numbers given as a (first, last) tuple in lines, is built
+    on its own from the file's chunk index when the whole file's chunks
+    aren't cached yet.
+    """
+    if chunkindex:
+        chunkindex = int(chunkindex)
+    else:
+        chunkindex = None
+
+    key = get_diff_fragment_cache_key(file, chunkindex, highlighting,
+                                      collapseall, template_name, lines)
+    fragment = cache.get(key)
+
+    if fragment is not None:
+        return fragment
+
+    if collapseall:
+        context['collapseall'] = True
+
     context['file'] = file
 
-    return cache_memoize(key,
-        lambda: render_to_string(template_name,
-                                 RequestContext(request, context)))
+    if chunkindex is not None:
+        chunk = get_file_chunk(file, highlighting, chunkindex)
+
+        if chunk is None:
+            raise UserVisibleError(
+                _(u"Invalid chunk index %s specified.") % chunkindex)
+
+        chunks = [chunk]
+    elif lines:
+        chunks = get_file_chunks_in_range(file, highlighting, *lines)
+    else:
+        chunks = get_file_chunks(file, highlighting)
+
+    file['chunks'] = chunks
+
+    fragment = render_to_string(template_name,
+                                RequestContext(request, context))
+    cache.set(key, fragment, settings.CACHE_EXPIRATION_TIME)
+
+    return fragment
+
+
+def get_diff_page_files(diffset, interdiffset):
+    """
+    Returns the list of file dicts for the diff viewer and a map of filediff
+    ids to file indexes, used to find the page a file is on. Both are
+    cached per diffset/interdiffset pair. Saving either diffset invalidates
+    them.
+
+    Caching the FileDiffs would pickle every diff of the diffset, so the
+    file dicts only hold their ids, as filediff_id and interfilediff_id.
+    load_file_diffs() looks up the FileDiffs of the files on a page.
+    """
+    key = 'diff-page-files-%s-%s' % (diffset.id, diffset.get_cache_generation())
+
+    if interdiffset:
+        key += '-%s-%s' % (interdiffset.id,
+                           interdiffset.get_cache_generation())
+
+    def build_page_files():
+        files = get_diff_files(diffset, None, interdiffset)
+        file_indexes = {}
+
+        for i, f in enumerate(files):
+            filediff = f.pop('filediff')
+            interfilediff = f.pop('interfilediff')
+            f['filediff_id'] = filediff.id
+            f['interfilediff_id'] = interfilediff and interfilediff.id
+            file_indexes.setdefault(filediff.id, i)
+
+        return files, file_indexes
+
+    return cache_memoize(key, build_page_files)
+
+
+def load_file_diffs(files):
+    """
+    Sets the filediff and interfilediff of file dicts from
+    get_diff_page_files, with a single query. Returns the files whose
+    FileDiff still exists.
+    """
+    ids = []
+
+    for file in files:
+        ids.append(file['filediff_id'])
+
+        if file['interfilediff_id']:
+            ids.append(file['interfilediff_id'])
+
+    filediffs = FileDiff.objects.in_bulk(ids)
+    found = []
+
+    for file in files:
+        # Deleting a FileDiff invalidates the cached files, but the cache
+        # may have been read just before.
+        if file['filediff_id'] in filediffs:
+            file['filediff'] = filediffs[file['filediff_id']]
+            file['interfilediff'] = filediffs.get(file['interfilediff_id'])
+            found.append(file)
+
+    return found
+
+
+def get_fragment_placeholder(file):
+    return '<!-- diff-fragment-%s -->' % file['index']
+
+
+class DiffPageStream(object):
+    """
+    The content of a streamed diff page response, see stream_diff_page.
+
+    The fragments are built while the response is sent, after Django has
+    closed the request's database connection, and their queries open it
+    again. It's closed once the page has been sent, or when the response
+    is closed early.
+    """
+    def __init__(self, *args):
+        self.args = args
+
+    def __iter__(self):
+        for data in stream_diff_page(*self.args):
+            yield data
+
+        self.close()
+
+    def close(self):
+        connection.close()
+
+
+def stream_diff_page(request, content, files, highlighting, collapseall,
+                     context, fragments=None):
+    """
+    Yields a diff page rendered with fragment placeholders piece by piece,
+    building each file's fragment only when its turn comes. This way the
+    start of the page is sent before the whole diff has been rendered, and
+    only one fragment at a time is held in memory.
+
+    fragments maps file indexes to their already fetched fragments.
+    """
+    if fragments is None:
+        fragments = {}
+
+    for file in files:
+        placeholder = get_fragment_placeholder(file)
+        i = content.find(placeholder)
+
+        if i == -1:
+            continue
+
+        yield content[:i]
+        content = content[i + len(placeholder):]
+
+        if file['index'] in fragments:
+            yield fragments[file['index']]
+            continue
+
+        try:
+            yield build_diff_fragment(request, file, None, highlighting,
+                                      collapseall, context)
+        except Exception, e:
+            # The response is already on its way, so the error can only be
+            # shown in place of the fragment.
+            logging.error("Error rendering the diff fragment for filediff "
+                          "id %s: %s", file['filediff'].id, e)
+            yield exception_traceback(
+                request, e, 'diffviewer/diff_file_fragment.html').content
+
+    yield content
 
 
 def view_diff(request, diffset_id, interdiffset_id=None, extra_context={},
@@ -87,10 +268,9 @@ def view_diff(request, diffset_id, interdiffset_id=None, extra_context={},
             logging.debug("Generating diff viewer page for filediff id %s",
                           diffset_id)
 
-        files = get_diff_files(diffset, None, interdiffset, highlighting)
-
         # Break the list of files into pages
         siteconfig = SiteConfiguration.objects.get_current()
+        files, file_indexes = get_diff_page_files(diffset, interdiffset)
 
         paginator = Paginator(files,
                               siteconfig.get("diffviewer_paginate_by"),
@@ -101,14 +281,13 @@ def view_diff(request, diffset_id, interdiffset_id=None, extra_context={},
         if request.GET.get('file', False):
             file_id = int(request.GET['file'])
 
-            for i, f in enumerate(files):
-                if f['filediff'].id == file_id:
-                    page_num = i // paginator.per_page + 1
-                    if page_num > paginator.num_pages:
-                        page_num = paginator.num_pages
-                    break
+            if file_id in file_indexes:
+                page_num = file_indexes[file_id] // paginator.per_page + 1
+                if page_num > paginator.num_pages:
+                    page_num = paginator.num_pages
 
         page = paginator.page(page_num)
+        page.object_list = load_file_diffs(page.object_list)
 
         if request.GET.get('expand', False):
             collapseall = False
@@ -126,17 +305,29 @@ def view_diff(request, diffset_id, interdiffset_id=None, extra_context={},
         }
         context.update(extra_context)
 
-        # XXX We can probably make this even more awesome and completely skip
-        #     the get_diff_files call, caching basically the entire context.
+        # Only the files on the requested page are rendered. Their fragments
+        # are cached, and so is the file list itself. The page is rendered
+        # with placeholders in place of the fragments, which are built while
+        # the response is being sent (see stream_diff_page).
         for file in page.object_list:
-            file['fragment'] = mark_safe(build_diff_fragment(request,
-                                                             file, None,
-                                                             highlighting,
-                                                             collapseall,
-                                                             context))
+            file['fragment'] = mark_safe(get_fragment_placeholder(file))
 
         context['files'] = page.object_list
 
+        # Fetch all of the page's cached fragments in one go.
+        keys = {}
+
+        for file in page.object_list:
+            key = get_diff_fragment_cache_key(
+                file, None, highlighting, collapseall,
+                'diffviewer/diff_file_fragment.html')
+            keys[key] = file['index']
+
+        fragments = {}
+
+        for key, fragment in cache.get_many(keys.keys()).iteritems():
+            fragments[keys[key]] = fragment
+
         # Add the pagination context
         context['is_paginated'] = page.has_other_pages()
         context['page'] = page.number
@@ -148,8 +339,12 @@ def view_diff(request, diffset_id, interdiffset_id=None, extra_context={},
         context['previous_page'] = page.previous_page_number()
         context['page_start_index'] = page.start_index()
 
-        response = render_to_response(template_name,
-                                      RequestContext(request, context))
+        content = render_to_string(template_name,
+                                   RequestContext(request, context))
+        response = HttpResponse(DiffPageStream(request, content,
+                                               page.object_list,
+                                               highlighting, collapseall,
+                                               context, fragments))
         response.set_cookie('collapsediffs', collapseall)
 
         if interdiffset_id:
@@ -198,6 +393,52 @@ def view_diff_fragment(request, diffset_id, filediff_id, interdiffset_id=None,
                                    {'standalone': True})
 
 
+def view_diff_fragment_lines(request, diffset_id, filediff_id, first_line,
+                             last_line, interdiffset_id=None,
+                             template_name='diffviewer/diff_file_fragment.html'):
+    """
+    Renders the lines first_line to last_line (inclusive, numbered as in
+    the side-by-side view) of a file's diff, so that large files can be
+    loaded a screenful at a time.
+    """
+    diffset = get_object_or_404(DiffSet, pk=diffset_id)
+    filediff = get_object_or_404(FileDiff, pk=filediff_id, diffset=diffset)
+    interdiffset = get_object_or_none(DiffSet, pk=interdiffset_id)
+    highlighting = get_enable_highlighting(request.user)
+
+    try:
+        first_line = int(first_line)
+        last_line = int(last_line)
+
+        if first_line < 1 or last_line < first_line:
+            raise UserVisibleError(
+                _(u"Invalid line range %(first)s-%(last)s specified.") % {
+                    'first': first_line,
+                    'last': last_line,
+                })
+
+        files = get_diff_files(diffset, filediff, interdiffset, highlighting)
+
+        if files:
+            assert len(files) == 1
+            file = files[0]
+
+            context = {
+                'standalone': True,
+            }
+
+            return HttpResponse(build_diff_fragment(request, file, None,
+                                                    highlighting, False,
+                                                    context, template_name,
+                                                    (first_line, last_line)))
+        raise UserVisibleError(
+            _(u"Internal error. Unable to locate file record for filediff %s") % \
+            filediff.id)
+    except Exception, e:
+        return exception_traceback(request, e, template_name,
+                                   {'standalone': True})
+
+
 def exception_traceback(request, e, template_name, extra_context={}):
     context = { 'error': e }
     context.update(extra_context)
@@ -169,6 +169,10 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 # Output to use in template system for invalid (e.g. misspelled) variables.
 TEMPLATE_STRING_IF_INVALID = ''
 
+# Whether to compile templates using only the core tags into Python code,
+# which renders them much faster. Ignored when TEMPLATE_DEBUG is set.
+TEMPLATE_COMPILE = False
+
 # URL prefix for admin media -- CSS, JavaScript and images. Make sure to use a
 # trailing slash.
 # Examples: "http://foo.com/media/", "/media/".
@@ -298,8 +302,21 @@ MIDDLEWARE_CLASSES = (
 #     'django.middleware.gzip.GZipMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.doc.XViewMiddleware',
+#     'django.middleware.profile.ProfileMiddleware',
 )
 
+#############
+# PROFILING #
+#############
+
+# Whether ProfileMiddleware profiles requests asking for it with a "profile"
+# query parameter or an X-Profile header.
+PROFILE_VIEWS = False
+
+# Directory where ProfileMiddleware dumps the aggregated profile of each view.
+# If None, profiles are only kept in memory.
+PROFILE_DATA_DIR = None
+
 ############
 # SESSIONS #
 ############
@@ -57,6 +57,27 @@ class BaseCache(object):
                 d[k] = val
         return d
 
+    def set_many(self, data, timeout=None):
+        """
+        Set a bunch of values in the cache at once from a dict of key/value
+        pairs. For certain backends (memcached), this is much more efficient
+        than calling set() multiple times.
+
+        If timeout is given, that timeout will be used for the key; otherwise
+        the default cache timeout will be used.
+        """
+        for key, value in data.items():
+            self.set(key, value, timeout)
+
+    def delete_many(self, keys):
+        """
+        Delete a bunch of keys from the cache at once, failing silently. For
+        certain backends (memcached), this is much more efficient than calling
+        delete() multiple times.
+        """
+        for key in keys:
+            self.delete(key)
+
     def has_key(self, key):
         """
         Returns True if the key is in the cache and has not expired.
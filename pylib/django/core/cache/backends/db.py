@@ -37,9 +37,62 @@ class CacheClass(BaseCache):
             return default
         return pickle.loads(base64.decodestring(row[1]))
 
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        cursor = connection.cursor()
+        cursor.execute("SELECT cache_key, value, expires FROM %s WHERE cache_key IN (%s)" % (self._table, ', '.join(['%s'] * len(keys))), keys)
+        now = datetime.now()
+        d = {}
+        expired = []
+        for key, value, expires in cursor.fetchall():
+            if expires < now:
+                expired.append(key)
+            else:
+                d[key] = pickle.loads(base64.decodestring(value))
+        if expired:
+            self._delete_keys(cursor, expired)
+            transaction.commit_unless_managed()
+        return d
+
     def set(self, key, value, timeout=None):
         return self._base_set('set', key, value, timeout)
 
+    def set_many(self, data, timeout=None):
+        if not data:
+            return
+        if timeout is None:
+            timeout = self.default_timeout
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM %s" % self._table)
+        num = cursor.fetchone()[0]
+        now = datetime.now().replace(microsecond=0)
+        exp = str(datetime.fromtimestamp(time.time() + timeout).replace(microsecond=0))
+        if num > self._max_entries:
+            self._cull(cursor, now)
+        keys = data.keys()
+        cursor.execute("SELECT cache_key FROM %s WHERE cache_key IN (%s)" % (self._table, ', '.join(['%s'] * len(keys))), keys)
+        existing = dict([(row[0], True) for row in cursor.fetchall()])
+        updates = []
+        inserts = []
+        for key, value in data.items():
+            encoded = base64.encodestring(pickle.dumps(value, 2)).strip()
+            if key in existing:
+                updates.append([encoded, exp, key])
+            else:
+                inserts.append([key, encoded, exp])
+        try:
+            if updates:
+                cursor.executemany("UPDATE %s SET value = %%s, expires = %%s WHERE cache_key = %%s" % self._table, updates)
+            if inserts:
+                cursor.executemany("INSERT INTO %s (cache_key, value, expires) VALUES (%%s, %%s, %%s)" % self._table, inserts)
+        except DatabaseError:
+            # To be threadsafe, updates/inserts are allowed to fail silently
+            pass
+        else:
+            transaction.commit_unless_managed()
+
     def add(self, key, value, timeout=None):
         return self._base_set('add', key, value, timeout)
 
@@ -71,6 +124,16 @@ class CacheClass(BaseCache):
         cursor.execute("DELETE FROM %s WHERE cache_key = %%s" % self._table, [key])
         transaction.commit_unless_managed()
 
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            cursor = connection.cursor()
+            self._delete_keys(cursor, keys)
+            transaction.commit_unless_managed()
+
+    def _delete_keys(self, cursor, keys):
+        cursor.execute("DELETE FROM %s WHERE cache_key IN (%s)" % (self._table, ', '.join(['%s'] * len(keys))), keys)
+
     def has_key(self, key):
         cursor = connection.cursor()
         cursor.execute("SELECT cache_key FROM %s WHERE cache_key = %%s" % self._table, [key])
@@ -21,5 +21,11 @@ class CacheClass(BaseCache):
     def get_many(self, *args, **kwargs):
         return {}
 
+    def set_many(self, *args, **kwargs):
+        pass
+
+    def delete_many(self, *args, **kwargs):
+        pass
+
     def has_key(self, *args, **kwargs):
         return False
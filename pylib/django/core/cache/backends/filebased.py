@@ -2,70 +2,393 @@
 
 import md5
 import os, time
+import tempfile
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 from django.core.cache.backends.base import BaseCache
 
+class CacheIndex(object):
+    """
+    Incrementally maintained index of a file-based cache directory, holding
+    the size, expiry time and last access time of every entry.
+
+    It is stored on disk as an append-only journal of one line records
+    (set, delete and access), so every change costs a single small append
+    instead of a walk over the cache directory. Processes sharing the cache
+    pick up each other's changes by reading the journal from where they
+    last stopped. The journal is compacted into a snapshot, atomically,
+    once it holds many more records than there are entries.
+    """
+    JOURNAL_NAME = 'cache.index'
+
+    # Access times are only journaled when they move by at least this many
+    # seconds, so that hot entries don't cause a write on every read.
+    ACCESS_GRANULARITY = 60
+
+    def __init__(self, dir):
+        self._dir = dir
+        self.path = os.path.join(dir, self.JOURNAL_NAME)
+        self._reset()
+        if not os.path.exists(self.path):
+            self._build()
+
+    def _reset(self):
+        self.entries = {}
+        self.size = 0
+        self._pos = 0
+        self._ino = None
+        self._records = 0
+
+    def _build(self):
+        """
+        Creates the journal from the files already in the cache directory.
+        This only reads the expiry header of each file.
+        """
+        for root, _, files in os.walk(self._dir):
+            for f in files:
+                fname = os.path.join(root, f)
+                # The path below the cache directory, without separators.
+                name = fname[len(self._dir):].replace(os.sep, '')
+                if len(name) != 32:
+                    # Not a cache entry (the journal, a temporary file...)
+                    continue
+                try:
+                    fp = open(fname, 'rb')
+                    try:
+                        exp = pickle.load(fp)
+                    finally:
+                        fp.close()
+                    st = os.stat(fname)
+                except (IOError, OSError, EOFError, pickle.PickleError):
+                    continue
+                self._apply(['S', name, str(st.st_size), repr(exp),
+                             repr(st.st_atime)])
+        self.compact()
+
+    def _apply(self, fields):
+        # Entries are [size, expiry, last access, last journaled access].
+        op, name = fields[0], fields[1]
+        if op == 'S':
+            entry = self.entries.get(name)
+            size = int(fields[2])
+            atime = journaled = float(fields[4])
+            if entry is not None:
+                self.size -= entry[0]
+                # Replaying a record mustn't lose a later access.
+                atime = max(atime, entry[2])
+                journaled = max(journaled, entry[3])
+            self.entries[name] = [size, float(fields[3]), atime, journaled]
+            self.size += size
+        elif op == 'D':
+            entry = self.entries.pop(name, None)
+            if entry is not None:
+                self.size -= entry[0]
+        elif op == 'A':
+            entry = self.entries.get(name)
+            if entry is not None:
+                atime = float(fields[2])
+                entry[2] = max(entry[2], atime)
+                entry[3] = max(entry[3], atime)
+
+    def sync(self):
+        """
+        Applies the journal records written since the last call, by this
+        or any other process.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        if st.st_ino != self._ino or st.st_size < self._pos:
+            # The journal was compacted (replaced), start over.
+            self._reset()
+            self._ino = st.st_ino
+        if st.st_size <= self._pos:
+            return
+        try:
+            f = open(self.path, 'rb')
+            try:
+                f.seek(self._pos)
+                data = f.read()
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return
+        # A record still being appended is picked up on the next sync.
+        end = data.rfind('\n') + 1
+        for line in data[:end].splitlines():
+            fields = line.split()
+            if fields:
+                self._records += 1
+                self._apply(fields)
+        self._pos += end
+
+    def _append(self, fields):
+        # Records are applied straight away; replaying them during a later
+        # sync() is harmless as every record is idempotent.
+        self._apply(fields)
+        line = ' '.join(fields) + '\n'
+        try:
+            f = open(self.path, 'ab')
+            try:
+                f.write(line)
+                f.flush()
+                ino = os.fstat(f.fileno()).st_ino
+            finally:
+                f.close()
+            if os.stat(self.path).st_ino != ino:
+                # The journal was replaced by another process's compact()
+                # after it copied the old journal's records over, so the
+                # record goes to the new journal too.
+                f = open(self.path, 'ab')
+                try:
+                    f.write(line)
+                finally:
+                    f.close()
+        except (IOError, OSError):
+            pass
+        if self._records > 2 * len(self.entries) + 1000:
+            self.compact()
+
+    def record_set(self, name, size, exp, now):
+        self._append(['S', name, str(size), repr(exp), repr(now)])
+
+    def record_delete(self, name):
+        self._append(['D', name])
+
+    def record_access(self, name, now):
+        entry = self.entries.get(name)
+        if entry is not None:
+            entry[2] = now
+            if now - entry[3] >= self.ACCESS_GRANULARITY:
+                self._append(['A', name, repr(now)])
+
+    def compact(self):
+        """
+        Atomically replaces the journal by a snapshot of the current index.
+
+        The snapshot includes the records other processes appended up to
+        now, and the ones they append while it's written are copied over
+        from the old journal once it's replaced. Records appended after
+        that find the journal replaced and are appended again (see
+        _append()).
+        """
+        old = None
+        if os.name != 'nt':
+            # Windows can't replace a file that is open.
+            try:
+                old = open(self.path, 'rb')
+            except IOError:
+                pass
+        try:
+            self.sync()
+            if old is not None and \
+               os.fstat(old.fileno()).st_ino != self._ino:
+                # Another process compacted the journal meanwhile.
+                return
+            pos = self._pos
+            lines = ['S %s %d %r %r\n' % (name, entry[0], entry[1], entry[2])
+                     for name, entry in self.entries.iteritems()]
+            try:
+                fd, tmp = tempfile.mkstemp(dir=self._dir, prefix='.index')
+                f = os.fdopen(fd, 'wb')
+                try:
+                    f.writelines(lines)
+                finally:
+                    f.close()
+                _rename(tmp, self.path)
+                st = os.stat(self.path)
+            except (IOError, OSError):
+                return
+            self._ino = st.st_ino
+            self._pos = st.st_size
+            self._records = len(lines)
+
+            if old is not None:
+                old.seek(pos)
+                data = old.read()
+                data = data[:data.rfind('\n') + 1]
+                if data:
+                    # Picked up by the next sync().
+                    try:
+                        f = open(self.path, 'ab')
+                        try:
+                            f.write(data)
+                        finally:
+                            f.close()
+                    except (IOError, OSError):
+                        pass
+        finally:
+            if old is not None:
+                old.close()
+
+    def oldest_first(self):
+        """
+        Returns the entry names sorted by last access time, oldest first.
+        """
+        items = [(entry[2], name) for name, entry in self.entries.iteritems()]
+        items.sort()
+        return [name for _, name in items]
+
+
+def _rename(src, dst):
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows won't rename over an existing file.
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        os.rename(src, dst)
+
+
 class CacheClass(BaseCache):
+    """
+    File-based cache.
+
+    Passing index=1 (or a max_size) in the backend URI keeps a CacheIndex
+    of the entries, which makes entry counting O(1), lets has_key() and
+    expiry checks skip opening the files of indexed entries, and culls
+    least recently accessed entries first, bounded by max_entries and by
+    max_size, the total size in bytes of the cache files (0 means no byte
+    limit). Files missing from the index are looked up on disk, and
+    recorded in it when found.
+
+    Example: "file:///var/cache/rb?index=1&max_entries=50000&max_size=1073741824"
+    """
     def __init__(self, dir, params):
         BaseCache.__init__(self, params)
-        
+
         max_entries = params.get('max_entries', 300)
         try:
             self._max_entries = int(max_entries)
         except (ValueError, TypeError):
             self._max_entries = 300
-            
+
         cull_frequency = params.get('cull_frequency', 3)
         try:
             self._cull_frequency = int(cull_frequency)
         except (ValueError, TypeError):
             self._cull_frequency = 3
-            
+
+        max_size = params.get('max_size', 0)
+        try:
+            self._max_size = int(max_size)
+        except (ValueError, TypeError):
+            self._max_size = 0
+
         self._dir = dir
         if not os.path.exists(self._dir):
             self._createdir()
 
+        self._index = None
+        if params.get('index', '0') not in ('0', 'false', 'False') or \
+           self._max_size > 0:
+            self._index = CacheIndex(self._dir)
+
     def add(self, key, value, timeout=None):
         if self.has_key(key):
             return None
-        
+
         self.set(key, value, timeout)
 
     def get(self, key, default=None):
-        fname = self._key_to_file(key)
+        if self._index is not None:
+            self._index.sync()
+        return self._get(self._key_to_file(key), time.time(), default)
+
+    def get_many(self, keys):
+        # The index is only synced once for all the keys.
+        if self._index is not None:
+            self._index.sync()
+        now = time.time()
+        d = {}
+        for key in keys:
+            value = self._get(self._key_to_file(key), now, None)
+            if value is not None:
+                d[key] = value
+        return d
+
+    def _get(self, fname, now, default):
+        entry = None
+        if self._index is not None:
+            name = self._file_to_name(fname)
+            entry = self._index.entries.get(name)
+            if entry is not None:
+                if entry[1] < now:
+                    try:
+                        self._delete(fname)
+                    except (IOError, OSError):
+                        pass
+                    return default
+                self._index.record_access(name, now)
         try:
             f = open(fname, 'rb')
-            exp = pickle.load(f)
-            now = time.time()
-            if exp < now:
+            try:
+                exp = pickle.load(f)
+                if exp < now:
+                    f.close()
+                    self._delete(fname)
+                else:
+                    value = pickle.load(f)
+                    if self._index is not None and entry is None:
+                        self._record_missing(fname, f, exp, now)
+                    return value
+            finally:
                 f.close()
-                self._delete(fname)
-            else:
-                return pickle.load(f)
         except (IOError, OSError, EOFError, pickle.PickleError):
             pass
         return default
 
+    def _record_missing(self, fname, f, exp, now):
+        """
+        Records an entry the index doesn't know about, set by a process
+        whose record was lost, so that it counts against the budget and
+        gets culled like the others.
+        """
+        self._index.record_set(self._file_to_name(fname),
+                               os.fstat(f.fileno()).st_size, exp, now)
+
     def set(self, key, value, timeout=None):
+        self._cull()
+        self._set(key, value, timeout)
+
+    def set_many(self, data, timeout=None):
+        # Culling is done once for the whole batch.
+        self._cull()
+        for key, value in data.items():
+            self._set(key, value, timeout)
+
+    def _set(self, key, value, timeout=None):
         fname = self._key_to_file(key)
         dirname = os.path.dirname(fname)
-        
+
         if timeout is None:
             timeout = self.default_timeout
-            
-        self._cull()
-        
+
         try:
             if not os.path.exists(dirname):
                 os.makedirs(dirname)
 
-            f = open(fname, 'wb')
-            now = time.time()
-            pickle.dump(now + timeout, f, pickle.HIGHEST_PROTOCOL)
-            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            # Write to a temporary file and rename it into place, so that
+            # readers never see a partially written entry.
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+            f = os.fdopen(fd, 'wb')
+            try:
+                now = time.time()
+                pickle.dump(now + timeout, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            finally:
+                f.close()
+            _rename(tmp, fname)
+
+            if self._index is not None:
+                self._index.record_set(self._file_to_name(fname), size,
+                                       now + timeout, now)
         except (IOError, OSError):
             pass
 
@@ -76,6 +399,8 @@ class CacheClass(BaseCache):
             pass
 
     def _delete(self, fname):
+        if self._index is not None:
+            self._index.record_delete(self._file_to_name(fname))
         os.remove(fname)
         try:
             # Remove the 2 subdirs if they're empty
@@ -87,6 +412,18 @@ class CacheClass(BaseCache):
 
     def has_key(self, key):
         fname = self._key_to_file(key)
+        entry = None
+        if self._index is not None:
+            self._index.sync()
+            entry = self._index.entries.get(self._file_to_name(fname))
+            if entry is not None:
+                if entry[1] < time.time():
+                    try:
+                        self._delete(fname)
+                    except (IOError, OSError):
+                        pass
+                    return False
+                return True
         try:
             f = open(fname, 'rb')
             exp = pickle.load(f)
@@ -96,19 +433,25 @@ class CacheClass(BaseCache):
                 self._delete(fname)
                 return False
             else:
+                if self._index is not None:
+                    self._record_missing(fname, f, exp, now)
+                f.close()
                 return True
         except (IOError, OSError, EOFError, pickle.PickleError):
             return False
 
     def _cull(self):
+        if self._index is not None:
+            return self._cull_indexed()
+
         if int(self._num_entries) < self._max_entries:
             return
-        
+
         try:
             filelist = os.listdir(self._dir)
         except (IOError, OSError):
             return
-        
+
         if self._cull_frequency == 0:
             doomed = filelist
         else:
@@ -122,6 +465,40 @@ class CacheClass(BaseCache):
             except (IOError, OSError):
                 pass
 
+    def _cull_indexed(self):
+        """
+        Deletes the least recently accessed entries once the cache is over
+        max_entries or max_size. Expired entries go first. To keep culls
+        rare, 1/cull_frequency of the budget is freed up on each cull.
+        """
+        index = self._index
+        index.sync()
+        max_entries, max_size = self._max_entries, self._max_size
+        if len(index.entries) < max_entries and \
+           (not max_size or index.size < max_size):
+            return
+
+        if self._cull_frequency == 0:
+            max_entries = max_size = 0
+        else:
+            max_entries -= max_entries // self._cull_frequency
+            max_size -= max_size // self._cull_frequency
+
+        now = time.time()
+        expired = [name for name, entry in index.entries.iteritems()
+                   if entry[1] < now]
+        for name in expired + index.oldest_first():
+            if name not in index.entries:
+                continue
+            if len(index.entries) < max_entries and \
+               (not self._max_size or index.size <= max_size):
+                break
+            try:
+                self._delete(self._name_to_file(name))
+            except (IOError, OSError):
+                # Already gone, keep the index in step.
+                index.record_delete(name)
+
     def _createdir(self):
         try:
             os.makedirs(self._dir)
@@ -133,18 +510,31 @@ class CacheClass(BaseCache):
         Convert the filename into an md5 string. We'll turn the first couple
         bits of the path into directory prefixes to be nice to filesystems
         that have problems with large numbers of files in a directory.
-        
+
         Thus, a cache key of "foo" gets turnned into a file named
         ``{cache-dir}ac/bd/18db4cc2f85cedef654fccc4a4d8``.
         """
         path = md5.new(key.encode('utf-8')).hexdigest()
-        path = os.path.join(path[:2], path[2:4], path[4:])
+        return self._name_to_file(path)
+
+    def _name_to_file(self, name):
+        path = os.path.join(name[:2], name[2:4], name[4:])
         return os.path.join(self._dir, path)
 
+    def _file_to_name(self, fname):
+        """
+        Returns the md5 hex digest a cache file name was built from.
+        """
+        dirname, tail = os.path.split(fname)
+        dirname, mid = os.path.split(dirname)
+        return os.path.basename(dirname) + mid + tail
+
     def _get_num_entries(self):
+        if self._index is not None:
+            self._index.sync()
+            return len(self._index.entries)
         count = 0
         for _,_,files in os.walk(self._dir):
             count += len(files)
         return count
     _num_entries = property(_get_num_entries)
-
@@ -9,7 +9,30 @@ except ImportError:
 from django.core.cache.backends.base import BaseCache
 from django.utils.synch import RWLock
 
+# Field indexes of the nodes in the LRU doubly linked list.
+PREV, NEXT, KEY = 0, 1, 2
+
 class CacheClass(BaseCache):
+    """
+    In-memory cache.
+
+    By default, entries are culled by deleting every cull_frequency'th key
+    once max_entries is reached. Passing strategy=lru (or a max_size) in the
+    backend URI switches to least-recently-used eviction, bounded both by
+    max_entries and by max_size, the total size in bytes of the stored
+    values (0 means no byte limit). With pickle_strings=0, str and unicode
+    values are stored as-is instead of being pickled, as they're immutable.
+
+    Reads don't take the lock: stored values are never modified in place and
+    single dict operations are atomic, so get() and has_key() only do plain
+    dict lookups. Expired entries are left for writers to delete. In LRU
+    mode, a read only marks its entry as referenced, and writers give
+    referenced entries a second chance before evicting them, which
+    approximates LRU order. Pass lock_free_reads=0 to lock on every read
+    (and keep exact LRU order) instead.
+
+    Example: "locmem:///?strategy=lru&max_entries=5000&max_size=67108864"
+    """
     def __init__(self, _, params):
         BaseCache.__init__(self, params)
         self._cache = {}
@@ -27,61 +50,238 @@ class CacheClass(BaseCache):
         except (ValueError, TypeError):
             self._cull_frequency = 3
 
+        max_size = params.get('max_size', 0)
+        try:
+            self._max_size = int(max_size)
+        except (ValueError, TypeError):
+            self._max_size = 0
+
+        self._lru = params.get('strategy') == 'lru' or self._max_size > 0
+        self._pickle_strings = params.get('pickle_strings', '1') not in \
+                               ('0', 'false', 'False')
+        self._lock_free_reads = params.get('lock_free_reads', '1') not in \
+                                ('0', 'false', 'False')
+
+        # Byte accounting and recency list, only maintained in LRU mode.
+        # The list is circular, the root's NEXT is the most recently used.
+        self._sizes = {}
+        self._size = 0
+        self._nodes = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None]
+
+        # Keys read since they were last linked, see _evict().
+        self._referenced = {}
+
+        # No entry expires before this time (None when there are none), see
+        # _purge_expired().
+        self._next_expiry = None
+
+        # Statistics. These are only approximate under concurrent readers.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
         self._lock = RWLock()
 
+    def _encode(self, value):
+        """
+        Returns the form in which value is stored, and its size in bytes.
+        """
+        if not self._pickle_strings and isinstance(value, basestring):
+            if isinstance(value, unicode):
+                # len() counts characters, not bytes.
+                return (value,), len(value.encode('utf-8'))
+            return (value,), len(value)
+        pickled = pickle.dumps(value)
+        return pickled, len(pickled)
+
+    def _decode(self, stored):
+        if type(stored) is tuple:
+            return stored[0]
+        return pickle.loads(stored)
+
     def add(self, key, value, timeout=None):
         self._lock.writer_enters()
         try:
             exp = self._expire_info.get(key)
             if exp is None or exp <= time.time():
                 try:
-                    self._set(key, pickle.dumps(value), timeout)
+                    self._set(key, value, timeout)
                 except pickle.PickleError:
                     pass
         finally:
             self._lock.writer_leaves()
 
     def get(self, key, default=None):
+        if self._lock_free_reads:
+            return self._get_lock_free(key, default)
+        if self._lru:
+            return self._get_lru(key, default)
         self._lock.reader_enters()
         try:
             exp = self._expire_info.get(key)
             if exp is None:
+                self.misses += 1
                 return default
             elif exp > time.time():
                 try:
-                    return pickle.loads(self._cache[key])
+                    value = self._decode(self._cache[key])
+                    self.hits += 1
+                    return value
                 except pickle.PickleError:
+                    self.misses += 1
                     return default
         finally:
             self._lock.reader_leaves()
         self._lock.writer_enters()
         try:
-            del self._cache[key]
-            del self._expire_info[key]
+            self._delete(key)
+            self.misses += 1
             return default
         finally:
             self._lock.writer_leaves()
 
+    def _get_lock_free(self, key, default):
+        # Writers store the value before its expiry time and delete it
+        # after, so a reader finding a valid expiry time only misses the
+        # value if it's deleted in between.
+        exp = self._expire_info.get(key)
+        if exp is None or exp <= time.time():
+            self.misses += 1
+            return default
+        stored = self._cache.get(key)
+        if stored is None:
+            self.misses += 1
+            return default
+        try:
+            value = self._decode(stored)
+        except pickle.PickleError:
+            self.misses += 1
+            return default
+        if self._lru:
+            self._referenced[key] = True
+        self.hits += 1
+        return value
+
+    def _get_lru(self, key, default):
+        # Looking a key up changes its recency, so this needs exclusive
+        # access to the linked list.
+        self._lock.writer_enters()
+        try:
+            exp = self._expire_info.get(key)
+            if exp is None:
+                self.misses += 1
+                return default
+            elif exp <= time.time():
+                self._delete(key)
+                self.misses += 1
+                return default
+            try:
+                value = self._decode(self._cache[key])
+            except pickle.PickleError:
+                self.misses += 1
+                return default
+            self._unlink(key)
+            self._link(key)
+            self.hits += 1
+            return value
+        finally:
+            self._lock.writer_leaves()
+
+    def get_many(self, keys):
+        if self._lock_free_reads:
+            d = {}
+            for key in keys:
+                value = self._get_lock_free(key, None)
+                if value is not None:
+                    d[key] = value
+            return d
+
+        # Look everything up under a single lock, deleting expired entries
+        # at the end.
+        d = {}
+        expired = []
+        now = time.time()
+        self._lock.writer_enters()
+        try:
+            for key in keys:
+                exp = self._expire_info.get(key)
+                if exp is None:
+                    self.misses += 1
+                    continue
+                elif exp <= now:
+                    expired.append(key)
+                    self.misses += 1
+                    continue
+                try:
+                    d[key] = self._decode(self._cache[key])
+                except pickle.PickleError:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                if self._lru:
+                    self._unlink(key)
+                    self._link(key)
+            for key in expired:
+                self._delete(key)
+        finally:
+            self._lock.writer_leaves()
+        return d
+
     def _set(self, key, value, timeout=None):
-        if len(self._cache) >= self._max_entries:
-            self._cull()
+        stored, size = self._encode(value)
         if timeout is None:
             timeout = self.default_timeout
-        self._cache[key] = value
-        self._expire_info[key] = time.time() + timeout
+        if self._lru:
+            self._delete(key)
+            if self._max_size and size > self._max_size:
+                # Storing it would flush the whole cache for nothing.
+                return
+            # Room is made first, so that the new entry can't be evicted
+            # after the entries read since they were linked.
+            self._evict(1, size)
+            exp = time.time() + timeout
+            self._cache[key] = stored
+            self._expire_info[key] = exp
+            if self._next_expiry is None or exp < self._next_expiry:
+                self._next_expiry = exp
+            self._sizes[key] = size
+            self._size += size
+            self._link(key)
+        else:
+            if len(self._cache) >= self._max_entries:
+                self._cull()
+            self._cache[key] = stored
+            self._expire_info[key] = time.time() + timeout
 
     def set(self, key, value, timeout=None):
         self._lock.writer_enters()
         # Python 2.3 and 2.4 don't allow combined try-except-finally blocks.
         try:
             try:
-                self._set(key, pickle.dumps(value), timeout)
+                self._set(key, value, timeout)
             except pickle.PickleError:
                 pass
         finally:
             self._lock.writer_leaves()
 
+    def set_many(self, data, timeout=None):
+        self._lock.writer_enters()
+        try:
+            for key, value in data.items():
+                try:
+                    self._set(key, value, timeout)
+                except pickle.PickleError:
+                    pass
+        finally:
+            self._lock.writer_leaves()
+
     def has_key(self, key):
+        if self._lock_free_reads:
+            exp = self._expire_info.get(key)
+            return exp is not None and exp > time.time()
+
         self._lock.reader_enters()
         try:
             exp = self._expire_info.get(key)
@@ -94,20 +294,85 @@ class CacheClass(BaseCache):
 
         self._lock.writer_enters()
         try:
-            del self._cache[key]
-            del self._expire_info[key]
+            self._delete(key)
             return False
         finally:
             self._lock.writer_leaves()
 
     def _cull(self):
+        # Expired entries go first, readers leave them behind.
+        now = time.time()
+        for k in [k for (k, exp) in self._expire_info.items() if exp <= now]:
+            self._delete(k)
+        if len(self._cache) < self._max_entries:
+            return
         if self._cull_frequency == 0:
+            self.evictions += len(self._cache)
             self._cache.clear()
             self._expire_info.clear()
         else:
             doomed = [k for (i, k) in enumerate(self._cache) if i % self._cull_frequency == 0]
             for k in doomed:
                 self._delete(k)
+            self.evictions += len(doomed)
+
+    def _evict(self, entries=0, size=0):
+        """
+        Evicts least recently used entries until the cache fits within
+        max_entries and max_size, with room for the given number of entries
+        and bytes more.
+        """
+        if not self._is_full(entries, size):
+            return
+        # Readers leave expired entries behind, they go first.
+        self._purge_expired()
+        root = self._root
+        second_chances = len(self._cache)
+        while self._cache and self._is_full(entries, size):
+            key = root[PREV][KEY]
+            if self._referenced.pop(key, False) and second_chances > 0:
+                # Read since it was linked, move it back to the front.
+                second_chances -= 1
+                self._unlink(key)
+                self._link(key)
+                continue
+            self._delete(key)
+            self.evictions += 1
+
+    def _is_full(self, entries=0, size=0):
+        return len(self._cache) + entries > self._max_entries or \
+               (self._max_size and self._size + size > self._max_size)
+
+    def _purge_expired(self):
+        """
+        Deletes the expired entries, if any can have expired since the last
+        purge.
+        """
+        now = time.time()
+        if self._next_expiry is None or self._next_expiry > now:
+            return
+        next_expiry = None
+        for key, exp in self._expire_info.items():
+            if exp <= now:
+                self._delete(key)
+            elif next_expiry is None or exp < next_expiry:
+                next_expiry = exp
+        self._next_expiry = next_expiry
+
+    def _link(self, key):
+        # Insert as the most recently used entry.
+        root = self._root
+        first = root[NEXT]
+        node = [root, first, key]
+        first[PREV] = root[NEXT] = node
+        self._nodes[key] = node
+
+    def _unlink(self, key):
+        node = self._nodes.pop(key, None)
+        if node is not None:
+            prev, next = node[PREV], node[NEXT]
+            prev[NEXT] = next
+            next[PREV] = prev
 
     def _delete(self, key):
         try:
@@ -118,6 +383,10 @@ class CacheClass(BaseCache):
             del self._expire_info[key]
         except KeyError:
             pass
+        if self._lru:
+            self._size -= self._sizes.pop(key, 0)
+            self._unlink(key)
+            self._referenced.pop(key, None)
 
     def delete(self, key):
         self._lock.writer_enters()
@@ -125,3 +394,24 @@ class CacheClass(BaseCache):
             self._delete(key)
         finally:
             self._lock.writer_leaves()
+
+    def delete_many(self, keys):
+        self._lock.writer_enters()
+        try:
+            for key in keys:
+                self._delete(key)
+        finally:
+            self._lock.writer_leaves()
+
+    def get_stats(self):
+        """
+        Returns a dict of hit, miss and eviction counts along with the
+        current number of entries and, in LRU mode, their total size.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._cache),
+            'size': self._size,
+        }
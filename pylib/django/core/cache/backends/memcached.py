@@ -38,4 +38,24 @@ class CacheClass(BaseCache):
         self._cache.delete(smart_str(key))
 
     def get_many(self, keys):
-        return self._cache.get_multi(map(smart_str,keys))
+        d = self._cache.get_multi(map(smart_str,keys))
+        for key, val in d.items():
+            if isinstance(val, basestring):
+                d[key] = smart_unicode(val)
+        return d
+
+    def set_many(self, data, timeout=0):
+        if not hasattr(self._cache, 'set_multi'):
+            # cmemcache has no multi-key set.
+            return BaseCache.set_many(self, data, timeout)
+        safe_data = {}
+        for key, value in data.items():
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            safe_data[smart_str(key)] = value
+        self._cache.set_multi(safe_data, timeout or self.default_timeout)
+
+    def delete_many(self, keys):
+        if not hasattr(self._cache, 'delete_multi'):
+            return BaseCache.delete_many(self, keys)
+        self._cache.delete_multi(map(smart_str, keys))
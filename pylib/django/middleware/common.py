@@ -103,8 +103,10 @@ class CommonMiddleware(object):
                                   % (referer, request.get_full_path(), ua, ip))
                 return response
 
-        # Use ETags, if requested.
-        if settings.USE_ETAGS:
+        # Use ETags, if requested. Streamed responses can't be hashed without
+        # consuming them.
+        if settings.USE_ETAGS and (response._is_string or
+                                   response.has_header('ETag')):
             if response.has_header('ETag'):
                 etag = response['ETag']
             else:
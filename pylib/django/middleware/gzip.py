@@ -1,7 +1,8 @@
 import re
 
-from django.utils.text import compress_string
+from django.utils.text import compress_string, compress_sequence
 from django.utils.cache import patch_vary_headers
+from django.utils.encoding import smart_str
 
 re_accepts_gzip = re.compile(r'\bgzip\b')
 
@@ -10,10 +11,15 @@ class GZipMiddleware(object):
     This middleware compresses content if the browser allows gzip compression.
     It sets the Vary header accordingly, so that caches will base their storage
     on the Accept-Encoding header.
+
+    Responses built from an iterator are compressed incrementally while
+    they're sent, instead of being materialized first.
     """
     def process_response(self, request, response):
         # It's not worth compressing non-OK or really short responses.
-        if response.status_code != 200 or len(response.content) < 200:
+        # The length of a streamed response isn't known up front.
+        if response.status_code != 200 or \
+           (response._is_string and len(response.content) < 200):
             return response
 
         patch_vary_headers(response, ('Accept-Encoding',))
@@ -33,6 +39,14 @@ class GZipMiddleware(object):
         if not re_accepts_gzip.search(ae):
             return response
 
+        if not response._is_string:
+            charset = response._charset
+            response._container = compress_sequence(
+                smart_str(chunk, charset) for chunk in response._container)
+            response['Content-Encoding'] = 'gzip'
+            del response['Content-Length']
+            return response
+
         response.content = compress_string(response.content)
         response['Content-Encoding'] = 'gzip'
         response['Content-Length'] = str(len(response.content))
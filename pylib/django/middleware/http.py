@@ -10,7 +10,8 @@ class ConditionalGetMiddleware(object):
     """
     def process_response(self, request, response):
         response['Date'] = http_date()
-        if not response.has_header('Content-Length'):
+        # Computing the length of a streamed response would consume it.
+        if not response.has_header('Content-Length') and response._is_string:
             response['Content-Length'] = str(len(response.content))
 
         if response.has_header('ETag'):
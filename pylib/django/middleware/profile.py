@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.profiling import ProfileAggregator, format_stats
+
+_aggregator = None
+
+def get_aggregator():
+    global _aggregator
+    if _aggregator is None:
+        _aggregator = ProfileAggregator(settings.PROFILE_DATA_DIR)
+    return _aggregator
+
+class ProfileMiddleware(object):
+    """
+    Profiles views with cProfile, on request.
+
+    When settings.PROFILE_VIEWS is True, a request carrying a "profile"
+    query parameter or an X-Profile header has its view run under the
+    profiler. Profiles are aggregated by view name (e.g.
+    "reviewboard.diffviewer.views.view_diff") and, if
+    settings.PROFILE_DATA_DIR is set, dumped there as <view name>.prof.
+
+    With profile=report, the response is replaced by the text report of
+    the request's profile. profile=total reports the aggregated profile of
+    the view instead.
+
+    Streamed (iterator) responses are consumed while profiling, so that the
+    work they defer is part of the profile.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.PROFILE_VIEWS:
+            return None
+
+        mode = request.GET.get('profile', request.META.get('HTTP_X_PROFILE'))
+        if mode is None:
+            return None
+
+        name = '%s.%s' % (view_func.__module__, view_func.__name__)
+
+        def run_view():
+            response = view_func(request, *view_args, **view_kwargs)
+            if not response._is_string:
+                response.content = response.content
+            return response
+
+        aggregator = get_aggregator()
+        response, stats = aggregator.runcall(name, run_view)
+
+        if mode == 'report':
+            return HttpResponse(format_stats(stats), mimetype='text/plain')
+        elif mode == 'total':
+            return HttpResponse(aggregator.get_report(name),
+                                mimetype='text/plain')
+        return response
@@ -0,0 +1,364 @@
+"""
+Compiles parsed templates into Python functions.
+
+Rendering a Template interprets its tree of nodes: every node render goes
+through NodeList.render, every variable through FilterExpression.resolve and
+the context stack, and every loop iteration through ForNode.render. For
+templates rendered very often, or with large loops (such as a diff fragment,
+rendering one row per line), compile_template() turns the tree into straight
+Python code instead: text is appended as constants, loop variables and
+``forloop`` are Python locals, and filters are called directly.
+
+The compiled code renders exactly what the nodes would. Only templates made
+of the core nodes below can be compiled (anything else raises
+TemplateCompilationError), which is checked by get_compiled_template():
+
+    text, variables, {% if %}, {% ifequal %}, {% ifnotequal %}, {% for %}
+    (with a single loop variable), {% load %}, {% comment %} and {% trans %}
+
+Compiled templates are used by the loader when settings.TEMPLATE_COMPILE is
+set (and TEMPLATE_DEBUG isn't).
+"""
+
+from django.conf import settings
+from django.template import Template, NodeList, TextNode, VariableNode, \
+                            VariableDoesNotExist, resolve_lookups
+from django.template.defaulttags import ForNode, IfNode, IfEqualNode, \
+                                        LoadNode, CommentNode
+from django.templatetags.i18n import TranslateNode
+from django.utils.encoding import force_unicode
+from django.utils.html import escape
+from django.utils.safestring import SafeData, EscapeData, mark_safe, \
+                                    mark_for_escaping
+from django.utils.translation import ugettext
+
+# Compiled templates are cached by name and source, and the cache is simply
+# emptied once it holds this many templates.
+MAX_CACHED_TEMPLATES = 200
+
+_compiled_templates = {}
+
+class TemplateCompilationError(Exception):
+    pass
+
+class CompiledTemplate(Template):
+    """
+    A Template rendered through its compiled function.
+    """
+    def __init__(self, nodelist, name, render_func):
+        self.nodelist = nodelist
+        self.name = name
+        self.render_func = render_func
+
+    def render(self, context):
+        return self.render_func(context)
+
+def _invalid_variable(filter_expression):
+    # The failure handling of FilterExpression.resolve() for a non-empty
+    # TEMPLATE_STRING_IF_INVALID.
+    if '%s' in settings.TEMPLATE_STRING_IF_INVALID:
+        return settings.TEMPLATE_STRING_IF_INVALID % filter_expression.var
+    return settings.TEMPLATE_STRING_IF_INVALID
+
+class _CodeGenerator(object):
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+        self.indent = 1
+        self.namespace = {
+            '_force': force_unicode,
+            '_escape': escape,
+            '_mark_safe': mark_safe,
+            '_mark_for_escaping': mark_for_escaping,
+            '_SafeData': SafeData,
+            '_EscapeData': EscapeData,
+            '_VDNE': VariableDoesNotExist,
+            '_UDE': UnicodeDecodeError,
+            '_resolve': resolve_lookups,
+            '_ugettext': ugettext,
+            '_invalid': _invalid_variable,
+        }
+        self.counter = 0
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def new_name(self, prefix):
+        self.counter += 1
+        return '%s%d' % (prefix, self.counter)
+
+    def constant(self, value):
+        name = self.new_name('_k')
+        self.namespace[name] = value
+        return name
+
+    def compile(self, nodelist):
+        self.emit('_out = []')
+        self.emit('_a = _out.append')
+        self.emit('_autoescape = context.autoescape')
+        self.nodelist(nodelist, {})
+        self.emit("return _mark_safe(u''.join(_out))")
+        source = 'def render(context):\n%s\n' % '\n'.join(self.lines)
+        code = compile(source, '<compiled template %s>' % self.name, 'exec')
+        exec code in self.namespace
+        render = self.namespace['render']
+        render.source = source
+        return render
+
+    # Nodes
+
+    def nodelist(self, nodelist, scope):
+        if not nodelist:
+            self.emit('pass')
+        for node in nodelist:
+            self.node(node, scope)
+
+    def node(self, node, scope):
+        node_type = type(node)
+        if node_type is TextNode:
+            if node.s:
+                self.emit('_a(%s)' % self.constant(force_unicode(node.s)))
+        elif node_type is VariableNode:
+            self.variable_node(node, scope)
+        elif node_type is IfNode:
+            self.if_node(node, scope)
+        elif node_type is IfEqualNode:
+            self.ifequal_node(node, scope)
+        elif node_type is ForNode:
+            self.for_node(node, scope)
+        elif node_type is TranslateNode:
+            value = self.variable(node.value, scope)
+            if not node.noop:
+                value = '_ugettext(%s)' % value
+            self.emit('_a(_force(%s))' % value)
+        elif node_type in (LoadNode, CommentNode):
+            pass
+        elif not isinstance(node, basestring):
+            raise TemplateCompilationError("Can't compile %r" % node)
+        elif node:
+            # NodeList can hold plain strings.
+            self.emit('_a(%s)' % self.constant(force_unicode(node)))
+
+    def variable_node(self, node, scope):
+        # See VariableNode.render().
+        self.emit('try:')
+        self.indent += 1
+        self.filter_expression(node.filter_expression, '_v', scope, False)
+        self.emit('_v = _force(_v)')
+        self.emit('if (_autoescape and not isinstance(_v, _SafeData)) or '
+                  'isinstance(_v, _EscapeData):')
+        self.emit('    _v = _force(_escape(_v))')
+        self.emit('_a(_v)')
+        self.indent -= 1
+        self.emit('except _UDE:')
+        self.emit('    pass')
+
+    def if_node(self, node, scope):
+        # See IfNode.render(), the expressions are only resolved as far as
+        # needed.
+        result = self.new_name('_c')
+        is_or = node.link_type == IfNode.LinkTypes.or_
+        self.emit('%s = %s' % (result, not is_or))
+        depth = 0
+        for ifnot, bool_expr in node.bool_exprs:
+            value = self.new_name('_b')
+            self.emit('try:')
+            self.indent += 1
+            self.filter_expression(bool_expr, value, scope, True)
+            self.indent -= 1
+            self.emit('except _VDNE:')
+            self.emit('    %s = None' % value)
+            if ifnot:
+                test = 'not %s' % value
+            else:
+                test = value
+            if is_or:
+                self.emit('if %s:' % test)
+            else:
+                self.emit('if not (%s):' % test)
+            self.emit('    %s = %s' % (result, is_or))
+            self.emit('else:')
+            self.indent += 1
+            depth += 1
+        self.emit('pass')
+        self.indent -= depth
+        self.emit('if %s:' % result)
+        self.indent += 1
+        self.nodelist(node.nodelist_true, scope)
+        self.indent -= 1
+        if node.nodelist_false:
+            self.emit('else:')
+            self.indent += 1
+            self.nodelist(node.nodelist_false, scope)
+            self.indent -= 1
+
+    def ifequal_node(self, node, scope):
+        # See IfEqualNode.render().
+        values = []
+        for var in (node.var1, node.var2):
+            value = self.new_name('_e')
+            self.emit('try:')
+            self.emit('    %s = %s' % (value, self.variable(var, scope)))
+            self.emit('except _VDNE:')
+            self.emit('    %s = None' % value)
+            values.append(value)
+        if node.negate:
+            self.emit('if %s != %s:' % tuple(values))
+        else:
+            self.emit('if %s == %s:' % tuple(values))
+        self.indent += 1
+        self.nodelist(node.nodelist_true, scope)
+        self.indent -= 1
+        if node.nodelist_false:
+            self.emit('else:')
+            self.indent += 1
+            self.nodelist(node.nodelist_false, scope)
+            self.indent -= 1
+
+    def for_node(self, node, scope):
+        # See ForNode.render(). The loop variable and forloop are locals, the
+        # context isn't touched at all.
+        if len(node.loopvars) != 1:
+            raise TemplateCompilationError("Can't compile loops with more "
+                                           "than one variable")
+        values = self.new_name('_s')
+        length = self.new_name('_n')
+        index = self.new_name('_i')
+        item = self.new_name('_l')
+        loop = self.new_name('_f')
+
+        if 'forloop' in scope:
+            parentloop = scope['forloop']
+        else:
+            parentloop = self.new_name('_p')
+            self.emit("if 'forloop' in context:")
+            self.emit("    %s = context['forloop']" % parentloop)
+            self.emit('else:')
+            self.emit('    %s = {}' % parentloop)
+
+        self.emit('try:')
+        self.indent += 1
+        self.filter_expression(node.sequence, values, scope, True)
+        self.indent -= 1
+        self.emit('except _VDNE:')
+        self.emit('    %s = []' % values)
+        self.emit('if %s is None:' % values)
+        self.emit('    %s = []' % values)
+        self.emit("if not hasattr(%s, '__len__'):" % values)
+        self.emit('    %s = list(%s)' % (values, values))
+        self.emit('%s = len(%s)' % (length, values))
+        if node.is_reversed:
+            self.emit('%s = reversed(%s)' % (values, values))
+        self.emit("%s = {'parentloop': %s}" % (loop, parentloop))
+        self.emit('for %s, %s in enumerate(%s):' % (index, item, values))
+        self.indent += 1
+        self.emit("%s['counter0'] = %s" % (loop, index))
+        self.emit("%s['counter'] = %s + 1" % (loop, index))
+        self.emit("%s['revcounter'] = %s - %s" % (loop, length, index))
+        self.emit("%s['revcounter0'] = %s - %s - 1" % (loop, length, index))
+        self.emit("%s['first'] = (%s == 0)" % (loop, index))
+        self.emit("%s['last'] = (%s == %s - 1)" % (loop, index, length))
+        body_scope = dict(scope)
+        body_scope['forloop'] = loop
+        body_scope[node.loopvars[0]] = item
+        self.nodelist(node.nodelist_loop, body_scope)
+        self.indent -= 1
+
+    # Expressions
+
+    def variable(self, var, scope):
+        """
+        Returns the expression resolving a Variable, which raises
+        VariableDoesNotExist like Variable.resolve().
+        """
+        if var.lookups is None:
+            value = self.constant(var.literal)
+        elif var.lookups[0] in scope:
+            value = scope[var.lookups[0]]
+            if len(var.lookups) > 1:
+                value = '_resolve(%s, %s)' % (value,
+                                              self.constant(var.lookups[1:]))
+        else:
+            value = '_resolve(context, %s)' % self.constant(var.lookups)
+        if var.translate:
+            value = '_ugettext(%s)' % value
+        return value
+
+    def filter_expression(self, fe, target, scope, ignore_failures):
+        """
+        Emits the statements resolving a FilterExpression into target, see
+        FilterExpression.resolve().
+        """
+        skip_filters = False
+        self.emit('try:')
+        self.emit('    %s = %s' % (target, self.variable(fe.var, scope)))
+        self.emit('except _VDNE:')
+        if ignore_failures:
+            self.emit('    %s = None' % target)
+        elif settings.TEMPLATE_STRING_IF_INVALID:
+            # The filters aren't applied to the invalid string.
+            self.emit('    %s = _invalid(%s)' % (target, self.constant(fe)))
+            skip_filters = True
+        else:
+            self.emit('    %s = %s' % (
+                target, self.constant(settings.TEMPLATE_STRING_IF_INVALID)))
+
+        if not fe.filters:
+            return
+
+        if skip_filters:
+            self.emit('else:')
+            self.indent += 1
+
+        for func, args in fe.filters:
+            arg_vals = [target]
+            for lookup, arg in args:
+                if lookup:
+                    arg_vals.append(self.variable(arg, scope))
+                else:
+                    arg_vals.append(self.constant(mark_safe(arg)))
+            if getattr(func, 'needs_autoescape', False):
+                arg_vals.append('autoescape=_autoescape')
+            self.emit('_r = %s(%s)' % (self.constant(func), ', '.join(arg_vals)))
+            if getattr(func, 'is_safe', False):
+                self.emit('if isinstance(%s, _SafeData):' % target)
+                self.emit('    %s = _mark_safe(_r)' % target)
+                self.emit('elif isinstance(%s, _EscapeData):' % target)
+            else:
+                self.emit('if isinstance(%s, _EscapeData):' % target)
+            self.emit('    %s = _mark_for_escaping(_r)' % target)
+            self.emit('else:')
+            self.emit('    %s = _r' % target)
+
+        if skip_filters:
+            self.indent -= 1
+
+def compile_template(template):
+    """
+    Returns a CompiledTemplate rendering the same as template, a Template.
+    Raises TemplateCompilationError if the template uses tags that can't be
+    compiled.
+    """
+    render_func = _CodeGenerator(template.name).compile(template.nodelist)
+    return CompiledTemplate(template.nodelist, template.name, render_func)
+
+def get_compiled_template(source, origin=None, name=None):
+    """
+    Returns the compiled template for the given template code, or a plain
+    Template if it can't be compiled. Compiled templates are cached, so the
+    code is only parsed and compiled again when it changes.
+    """
+    key = (name, source)
+    template = _compiled_templates.get(key)
+    if template is None:
+        template = Template(source, origin, name)
+        try:
+            template = compile_template(template)
+        except TemplateCompilationError:
+            # Uncompilable templates might hold state between renders (e.g.
+            # {% cycle %}), so they're parsed for every use as usual.
+            return template
+        if len(_compiled_templates) >= MAX_CACHED_TEMPLATES:
+            _compiled_templates.clear()
+        _compiled_templates[key] = template
+    return template
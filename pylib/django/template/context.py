@@ -8,11 +8,22 @@ class ContextPopException(Exception):
     pass
 
 class Context(object):
-    "A stack container for variable context"
+    """
+    A stack container for variable context.
+
+    Lookups remember the dict each variable was found in, so repeated
+    lookups in a loop don't scan the stack again. Only reads are cached:
+    every push, pop or update() forgets them all, and a variable set
+    through the context is owned by the current dict. Code that adds keys
+    to a pushed dict directly should do so before looking them up, as
+    Django's tags do after push().
+    """
     def __init__(self, dict_=None, autoescape=True):
         dict_ = dict_ or {}
         self.dicts = [dict_]
         self.autoescape = autoescape
+        # Maps variable names to the dict in self.dicts holding them.
+        self._owners = {}
 
     def __repr__(self):
         return repr(self.dicts)
@@ -24,45 +35,66 @@ class Context(object):
     def push(self):
         d = {}
         self.dicts = [d] + self.dicts
+        self._owners = {}
         return d
 
     def pop(self):
         if len(self.dicts) == 1:
             raise ContextPopException
+        self._owners = {}
         return self.dicts.pop(0)
 
+    def _find(self, key):
+        """
+        Scans the stack for the dict holding key and remembers it. Returns
+        None if key isn't found.
+        """
+        for d in self.dicts:
+            if key in d:
+                self._owners[key] = d
+                return d
+        return None
+
     def __setitem__(self, key, value):
         "Set a variable in the current context"
-        self.dicts[0][key] = value
+        d = self.dicts[0]
+        d[key] = value
+        self._owners[key] = d
 
     def __getitem__(self, key):
         "Get a variable's value, starting at the current context and going upward"
-        for d in self.dicts:
-            if key in d:
-                return d[key]
-        raise KeyError(key)
+        try:
+            return self._owners[key][key]
+        except KeyError:
+            d = self._find(key)
+            if d is None:
+                raise KeyError(key)
+            return d[key]
 
     def __delitem__(self, key):
         "Delete a variable from the current context"
         del self.dicts[0][key]
+        self._owners.pop(key, None)
 
     def has_key(self, key):
-        for d in self.dicts:
-            if key in d:
-                return True
-        return False
+        d = self._owners.get(key)
+        return (d is not None and key in d) or self._find(key) is not None
 
     __contains__ = has_key
 
     def get(self, key, otherwise=None):
-        for d in self.dicts:
-            if key in d:
-                return d[key]
-        return otherwise
+        try:
+            return self._owners[key][key]
+        except KeyError:
+            d = self._find(key)
+            if d is None:
+                return otherwise
+            return d[key]
 
     def update(self, other_dict):
         "Like dict.update(). Pushes an entire dictionary's keys and values onto the context."
         self.dicts = [other_dict] + self.dicts
+        self._owners = {}
         return other_dict
 
 # This is a function rather than module-level procedural code because we only
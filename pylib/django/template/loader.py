@@ -85,7 +85,13 @@ def get_template_from_string(source, origin=None, name=None):
     """
     Returns a compiled Template object for the given template code,
     handling template inheritance recursively.
+
+    With settings.TEMPLATE_COMPILE, templates that only use the core tags are
+    compiled into Python code, see django.template.compiler.
     """
+    if settings.TEMPLATE_COMPILE and not settings.TEMPLATE_DEBUG:
+        from django.template.compiler import get_compiled_template
+        return get_compiled_template(source, origin, name)
     return Template(source, origin, name)
 
 def render_to_string(template_name, dictionary=None, context_instance=None):
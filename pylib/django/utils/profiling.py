@@ -0,0 +1,104 @@
+"""
+Profiling with cProfile, with the results aggregated by name (a view name,
+a function name...) across calls.
+"""
+
+import os
+import re
+import threading
+from cStringIO import StringIO
+
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+import pstats
+
+_unsafe_chars_re = re.compile(r'[^\w.-]')
+
+class ProfileAggregator(object):
+    """
+    Collects the profiles of calls grouped by name.
+
+    If data_dir is given, the aggregated stats of a name are also dumped to
+    ``{data_dir}/{name}.prof`` after each call, to be loaded with pstats or
+    any tool reading its format.
+    """
+    def __init__(self, data_dir=None):
+        self.data_dir = data_dir
+        self._stats = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def runcall(self, name, func, *args, **kwargs):
+        """
+        Calls func under the profiler, adds its profile to the ones of name
+        and returns a (result, pstats.Stats of this call) tuple.
+        """
+        prof = profile.Profile()
+        try:
+            result = prof.runcall(func, *args, **kwargs)
+        finally:
+            stats = self.add(name, prof)
+        return result, stats
+
+    def add(self, name, prof):
+        """
+        Adds a finished profile to the ones of name and returns its stats.
+        """
+        stats = pstats.Stats(prof)
+        self._lock.acquire()
+        try:
+            total = self._stats.get(name)
+            if total is None:
+                total = self._stats[name] = pstats.Stats(prof)
+            else:
+                total.add(stats)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if self.data_dir:
+                try:
+                    if not os.path.exists(self.data_dir):
+                        os.makedirs(self.data_dir)
+                    total.dump_stats(self.get_path(name))
+                except (IOError, OSError):
+                    pass
+        finally:
+            self._lock.release()
+        return stats
+
+    def get_path(self, name):
+        return os.path.join(self.data_dir,
+                            '%s.prof' % _unsafe_chars_re.sub('_', name))
+
+    def names(self):
+        return self._stats.keys()
+
+    def get_count(self, name):
+        return self._counts.get(name, 0)
+
+    def get_report(self, name, sort='cumulative', limit=40):
+        """
+        Returns the aggregated stats of name as text, or None if it was
+        never profiled.
+        """
+        stats = self._stats.get(name)
+        if stats is None:
+            return None
+        self._lock.acquire()
+        try:
+            return format_stats(stats, sort, limit)
+        finally:
+            self._lock.release()
+
+def format_stats(stats, sort='cumulative', limit=40):
+    """
+    Returns the text report of a pstats.Stats.
+    """
+    buf = StringIO()
+    stream = stats.stream
+    stats.stream = buf
+    try:
+        stats.sort_stats(sort).print_stats(limit)
+    finally:
+        stats.stream = stream
+    return buf.getvalue()
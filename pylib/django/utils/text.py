@@ -176,6 +176,33 @@ def compress_string(s):
     zfile.close()
     return zbuf.getvalue()
 
+def compress_sequence(sequence):
+    """
+    Compresses an iterable of strings as it is consumed, yielding the gzip
+    stream in pieces. Each piece of input is flushed so that it can be sent
+    to the client right away, without waiting for the rest.
+
+    The stream is built with zlib rather than GzipFile, whose flush() only
+    takes a mode from Python 2.6 on.
+    """
+    import struct, time, zlib
+    # The gzip header: magic, deflate, no flags, mtime, extra flags and OS,
+    # as GzipFile writes it.
+    yield '\037\213\010\000' + struct.pack('<L', long(time.time())) + \
+          '\002\377'
+    zobj = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS,
+                            zlib.DEF_MEM_LEVEL, 0)
+    crc = zlib.crc32('')
+    size = 0
+    for item in sequence:
+        crc = zlib.crc32(item, crc)
+        size += len(item)
+        data = zobj.compress(item) + zobj.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield zobj.flush() + struct.pack('<LL', crc & 0xffffffffL,
+                                     size & 0xffffffffL)
+
 ustring_re = re.compile(u"([\u0080-\uffff])")
 
 def javascript_quote(s, quote_double_quotes=False):
@@ -28,6 +28,9 @@ __all__ = ['Lexer', 'RegexLexer', 'ExtendedRegexLexer', 'DelegatingLexer',
 
 _default_analyse = staticmethod(lambda x: 0.0)
 
+# Matches a "^" anchor in a regex, conservatively.
+_anchor_re = re.compile(r'(?<![\[\\])\^')
+
 
 class LexerMeta(type):
     """
@@ -127,6 +130,22 @@ class Lexer(object):
         Also preprocess the text, i.e. expand tabs and strip it if
         wanted and applies registered filters.
         """
+        text = self.preprocess(text)
+
+        def streamer():
+            for i, t, v in self.get_tokens_unprocessed(text):
+                yield t, v
+        stream = streamer()
+        if not unfiltered:
+            stream = apply_filters(stream, self.filters, self)
+        return stream
+
+    def preprocess(self, text):
+        """
+        Return `text` as it is lexed by `get_tokens`: decoded, with
+        normalized newlines, stripped if wanted, with expanded tabs and
+        ending with a newline.
+        """
         if isinstance(text, unicode):
             text = u'\n'.join(text.splitlines())
         else:
@@ -157,14 +176,7 @@ class Lexer(object):
             text = text.expandtabs(self.tabsize)
         if not text.endswith('\n'):
             text += '\n'
-
-        def streamer():
-            for i, t, v in self.get_tokens_unprocessed(text):
-                yield t, v
-        stream = streamer()
-        if not unfiltered:
-            stream = apply_filters(stream, self.filters, self)
-        return stream
+        return text
 
     def get_tokens_unprocessed(self, text):
         """
@@ -470,10 +482,20 @@ class RegexLexer(Lexer):
 
         ``stack`` is the inital stack (default: ``['root']``)
         """
+        return self._lex(text, list(stack))
+
+    def _lex(self, text, statestack, line_states=None):
+        """
+        Lex ``text`` starting from the state stack ``statestack``, which is
+        modified in place. If ``line_states`` is a list, the state stack at
+        the start of every following line is appended to it (see
+        `get_line_states`).
+        """
         pos = 0
         tokendefs = self._tokens
-        statestack = list(stack)
         statetokens = tokendefs[statestack[-1]]
+        if line_states is not None:
+            anchored = self._get_anchored_states()
         while 1:
             for rexmatch, action, new_state in statetokens:
                 m = rexmatch(text, pos)
@@ -484,6 +506,7 @@ class RegexLexer(Lexer):
                     else:
                         for item in action(self, m):
                             yield item
+                    start = pos
                     pos = m.end()
                     if new_state is not None:
                         # state transition
@@ -503,14 +526,36 @@ class RegexLexer(Lexer):
                         else:
                             assert False, "wrong state def: %r" % new_state
                         statetokens = tokendefs[statestack[-1]]
+                    if line_states is not None:
+                        newlines = text.count('\n', start, pos)
+                        if newlines:
+                            state = tuple(statestack)
+                            if new_state is None and \
+                               statestack[-1] not in anchored and not \
+                               text[start:pos].strip():
+                                # Whitespace (e.g. a newline and the next
+                                # line's indentation) lexes the same when
+                                # resumed from any of its lines, unless
+                                # rules match at the start of lines.
+                                line_states.extend([state] * newlines)
+                            else:
+                                # Lines starting inside of the match can't
+                                # be resumed.
+                                line_states.extend([None] * (newlines - 1))
+                                if text[pos - 1] == '\n':
+                                    line_states.append(state)
+                                else:
+                                    line_states.append(None)
                     break
             else:
                 try:
                     if text[pos] == '\n':
                         # at EOL, reset state to "root"
                         pos += 1
-                        statestack = ['root']
+                        statestack[:] = ['root']
                         statetokens = tokendefs['root']
+                        if line_states is not None:
+                            line_states.append(('root',))
                         yield pos, Text, u'\n'
                         continue
                     yield pos, Error, text[pos]
@@ -518,6 +563,68 @@ class RegexLexer(Lexer):
                 except IndexError:
                     break
 
+    def _get_anchored_states(self):
+        """
+        Return the names of the states having rules which can match at the
+        start of lines only.
+        """
+        cls = self.__class__
+        if '_anchored_states' not in cls.__dict__:
+            cls._anchored_states = set([
+                state for state, statetokens in self._tokens.iteritems()
+                if [rexmatch for rexmatch, action, new_state in statetokens
+                    if _anchor_re.search(rexmatch.__self__.pattern)]])
+        return cls._anchored_states
+
+    def is_resumable(self):
+        """
+        Return whether lexing can be resumed from a state stack, with
+        `get_line_states` and `get_tokens_from_state`. This isn't the case
+        for lexers post-processing the tokens of `get_tokens_unprocessed`.
+        """
+        return self.__class__.get_tokens_unprocessed.im_func is \
+               RegexLexer.get_tokens_unprocessed.im_func
+
+    def get_line_states(self, text, stack=('root',)):
+        """
+        Lex `text` (preprocessed like `get_tokens` does) and return a list
+        holding the state stack at the start of every line, as tuples.
+
+        Lexing a line and the following ones with `get_tokens_from_state`
+        from its state stack gives the same tokens as lexing the whole
+        text, so these are checkpoints to resume lexing from. Lines
+        starting inside of a token (e.g. a multi-line string matched by a
+        single regex) have no checkpoint and are ``None``.
+        """
+        if not self.is_resumable():
+            raise NotImplementedError('%s can\'t resume lexing from a state'
+                                      % self.__class__.__name__)
+        text = self.preprocess(text)
+        line_states = [tuple(stack)]
+        for item in self._lex(text, list(stack), line_states):
+            pass
+        # The text ends with a newline, which doesn't start a line.
+        return line_states[:text.count('\n')]
+
+    def get_tokens_from_state(self, text, stack=('root',), unfiltered=False):
+        """
+        Like `get_tokens`, but lex `text` starting from the state stack
+        `stack`, which is either a checkpoint from `get_line_states` or a
+        guess (e.g. ``('root',)`` for a fragment of a file).
+        """
+        if not self.is_resumable():
+            raise NotImplementedError('%s can\'t resume lexing from a state'
+                                      % self.__class__.__name__)
+        text = self.preprocess(text)
+
+        def streamer():
+            for i, t, v in self._lex(text, list(stack)):
+                yield t, v
+        stream = streamer()
+        if not unfiltered:
+            stream = apply_filters(stream, self.filters, self)
+        return stream
+
 
 class LexerContext(object):
     """
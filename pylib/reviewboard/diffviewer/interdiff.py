@@ -0,0 +1,376 @@
+import re
+from bisect import bisect_right
+
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+
+class InterdiffError(Exception):
+    pass
+
+
+class Hunk:
+    def __init__(self, orig_start, orig_len, new_start, new_len):
+        self.orig_start = orig_start
+        self.orig_len = orig_len
+        self.new_start = new_start
+        self.new_len = new_len
+        self.lines = []
+
+
+class ComposedLines(object):
+    """
+    The lines of a file made of runs of other line sequences, such as the
+    original file's lines and the lines of hunks. Lines are only looked up
+    in the runs when indexed, sliced or iterated over.
+    """
+    def __init__(self):
+        self.runs = []
+        self.offsets = []
+        self.length = 0
+
+    def append(self, lines, start=0, end=None):
+        """
+        Appends lines[start:end] to the file.
+        """
+        if end is None:
+            end = len(lines)
+
+        if start < end:
+            self.runs.append((lines, start, end))
+            self.offsets.append(self.length)
+            self.length += end - start
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+
+            if step != 1:
+                return [self[i] for i in xrange(start, stop, step)]
+
+            result = []
+            i = bisect_right(self.offsets, start) - 1
+
+            while start < stop:
+                lines, begin, end = self.runs[i]
+                offset = self.offsets[i]
+                result.extend(lines[begin + start - offset:
+                                    begin + min(stop, offset + end - begin) -
+                                    offset])
+                start = offset + end - begin
+                i += 1
+
+            return result
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("line index out of range")
+
+        i = bisect_right(self.offsets, index) - 1
+        lines, begin, end = self.runs[i]
+        return lines[begin + index - self.offsets[i]]
+
+    def __iter__(self):
+        for lines, begin, end in self.runs:
+            for line in lines[begin:end]:
+                yield line
+
+
+class InterDiffer:
+    """
+    Computes the interdiff between two unified diffs of the same original
+    file by composing their hunks, rather than patching the file twice and
+    diffing both results in full.
+
+    The hunks of each diff are applied in-process to the original lines,
+    and must match them exactly: the first diff's hunks give the old file
+    and the second diff's hunks the new one. Outside of the lines touched
+    by either diff, both files are the original, so they're equal. Only
+    the clusters of overlapping or adjacent changes from both diffs are
+    diffed, which makes comparing two revisions of a change as cheap as
+    the hunks are small.
+
+    InterdiffError is raised whenever the result would be ambiguous: when
+    a diff isn't a unified diff or a hunk doesn't apply exactly (patch
+    would have looked for an offset or fuzz). The full files then need
+    to be patched and diffed instead.
+    """
+    HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+    def __init__(self, orig, diff1, diff2, ignore_space=False,
+                 normalize=None):
+        """
+        orig is the text of the original file, or its lines. ignore_space
+        and normalize are passed on to the MyersDiffer of changed lines.
+        """
+        self.ignore_space = ignore_space
+        self.normalize = normalize
+
+        if isinstance(orig, basestring):
+            orig_lines = self._split(orig)
+        else:
+            orig_lines = orig
+
+        self.edits1 = self._get_edits(self.parse_hunks(diff1), orig_lines)
+        self.edits2 = self._get_edits(self.parse_hunks(diff2), orig_lines)
+        self.a, self.b, self.opcodes = self._compose(orig_lines)
+        self._old = self._new = None
+
+    @property
+    def old(self):
+        """
+        The text of the old file, only joined when asked for (e.g. to
+        highlight it).
+        """
+        if self._old is None:
+            self._old = self._join(self.a)
+        return self._old
+
+    @property
+    def new(self):
+        """
+        The text of the new file, like old.
+        """
+        if self._new is None:
+            self._new = self._join(self.b)
+        return self._new
+
+    def get_opcodes(self):
+        """
+        Generator returning opcodes from a to b, like
+        SequenceMatcher.get_opcodes.
+        """
+        for opcode in self.opcodes:
+            yield opcode
+
+    def parse_hunks(self, diff):
+        """
+        Returns the hunks of a unified diff, with the lines of each hunk
+        stripped of their line endings.
+        """
+        hunks = []
+        lines = self._split(diff)
+        i = 0
+
+        while i < len(lines):
+            m = self.HUNK_RE.match(lines[i])
+            i += 1
+
+            if not m:
+                if hunks and lines[i - 1][:1] in (" ", "-", "+"):
+                    raise InterdiffError("Line %d is outside of any hunk" % i)
+                continue
+
+            orig_start, orig_len, new_start, new_len = m.groups()
+            hunk = Hunk(int(orig_start), int(orig_len or 1),
+                        int(new_start), int(new_len or 1))
+            orig_left, new_left = hunk.orig_len, hunk.new_len
+
+            while orig_left > 0 or new_left > 0:
+                if i == len(lines):
+                    raise InterdiffError("Hunk ending at line %d is "
+                                         "truncated" % i)
+
+                line = lines[i]
+                i += 1
+
+                if line.startswith("\\"):
+                    # "\ No newline at end of file". Trailing newlines are
+                    # normalized in the result anyway.
+                    continue
+                elif line == "":
+                    # Some tools strip the space of empty context lines.
+                    line = " "
+
+                if line[0] == " ":
+                    orig_left -= 1
+                    new_left -= 1
+                elif line[0] == "-":
+                    orig_left -= 1
+                elif line[0] == "+":
+                    new_left -= 1
+                else:
+                    raise InterdiffError("Invalid line %d in hunk" % i)
+
+                if orig_left < 0 or new_left < 0:
+                    raise InterdiffError("Hunk ending at line %d is longer "
+                                         "than its header says" % i)
+
+                hunk.lines.append(line)
+
+            while i < len(lines) and lines[i].startswith("\\"):
+                i += 1
+
+            hunks.append(hunk)
+
+        if not hunks and diff.strip() and \
+           not [line for line in lines if line.startswith("+++ ")]:
+            # Not a unified diff, or nothing we understand.
+            raise InterdiffError("No unified diff hunks found")
+
+        return hunks
+
+    def _get_edits(self, hunks, orig_lines):
+        """
+        Returns the (start, end, lines) edits of a diff's hunks, replacing
+        the original lines start to end with lines, in order. Raises
+        InterdiffError if a hunk doesn't apply exactly.
+        """
+        edits = []
+        last_end = 0
+
+        for hunk in hunks:
+            if hunk.orig_len:
+                pos = hunk.orig_start - 1
+            else:
+                # Pure insertions give the line they follow.
+                pos = hunk.orig_start
+
+            if pos < last_end or pos + hunk.orig_len > len(orig_lines):
+                raise InterdiffError("Hunk at line %d doesn't apply" %
+                                     hunk.orig_start)
+
+            start = None
+            new_lines = []
+
+            for line in hunk.lines:
+                tag = line[0]
+
+                if tag == "+":
+                    if start is None:
+                        start = pos
+                    new_lines.append(line[1:])
+                    continue
+
+                if orig_lines[pos] != line[1:]:
+                    raise InterdiffError("Hunk at line %d doesn't apply" %
+                                         hunk.orig_start)
+
+                if tag == "-":
+                    if start is None:
+                        start = pos
+                elif start is not None:
+                    edits.append((start, pos, new_lines))
+                    start = None
+                    new_lines = []
+
+                pos += 1
+
+            if start is not None:
+                edits.append((start, pos, new_lines))
+
+            last_end = pos
+
+        return edits
+
+    def _compose(self, orig_lines):
+        """
+        Returns the lines of the old and new files, as ComposedLines
+        referring to the original lines outside of the clusters of changes,
+        along with the opcodes between them. Only the lines of each cluster
+        are copied.
+        """
+        a = ComposedLines()
+        b = ComposedLines()
+        opcodes = []
+
+        def add_opcode(tag, i1, i2, j1, j2):
+            if opcodes and tag == "equal" and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], i2,
+                               opcodes[-1][3], j2)
+            else:
+                opcodes.append((tag, i1, i2, j1, j2))
+
+        def apply_edits(edits, start, end):
+            lines = []
+            pos = start
+            for edit_start, edit_end, new_lines in edits:
+                lines.extend(orig_lines[pos:edit_start])
+                lines.extend(new_lines)
+                pos = edit_end
+            lines.extend(orig_lines[pos:end])
+            return lines
+
+        last_end = 0
+
+        for start, end, edits1, edits2 in self._get_clusters():
+            if last_end < start:
+                add_opcode("equal", len(a), len(a) + start - last_end,
+                           len(b), len(b) + start - last_end)
+                a.append(orig_lines, last_end, start)
+                b.append(orig_lines, last_end, start)
+
+            a_lines = apply_edits(edits1, start, end)
+            b_lines = apply_edits(edits2, start, end)
+            a_offset, b_offset = len(a), len(b)
+
+            if a_lines == b_lines:
+                if a_lines:
+                    add_opcode("equal", a_offset, a_offset + len(a_lines),
+                               b_offset, b_offset + len(b_lines))
+            elif not a_lines:
+                add_opcode("insert", a_offset, a_offset,
+                           b_offset, b_offset + len(b_lines))
+            elif not b_lines:
+                add_opcode("delete", a_offset, a_offset + len(a_lines),
+                           b_offset, b_offset)
+            else:
+                differ = MyersDiffer(a_lines, b_lines, self.ignore_space,
+                                     self.normalize)
+                for tag, i1, i2, j1, j2 in differ.get_opcodes():
+                    add_opcode(tag, a_offset + i1, a_offset + i2,
+                               b_offset + j1, b_offset + j2)
+
+            a.append(a_lines)
+            b.append(b_lines)
+            last_end = end
+
+        if last_end < len(orig_lines):
+            add_opcode("equal", len(a), len(a) + len(orig_lines) - last_end,
+                       len(b), len(b) + len(orig_lines) - last_end)
+            a.append(orig_lines, last_end, len(orig_lines))
+            b.append(orig_lines, last_end, len(orig_lines))
+
+        return a, b, opcodes
+
+    def _get_clusters(self):
+        """
+        Returns the (start, end, edits1, edits2) clusters of overlapping or
+        adjacent edits from both diffs, in order. Everything between two
+        clusters is unchanged by both diffs.
+        """
+        edits = [(edit, 0) for edit in self.edits1] + \
+                [(edit, 1) for edit in self.edits2]
+        edits.sort()
+
+        clusters = []
+        for edit, side in edits:
+            start, end, new_lines = edit
+
+            if clusters and start <= clusters[-1][1]:
+                cluster = clusters[-1]
+                cluster[1] = max(cluster[1], end)
+            else:
+                cluster = [start, end, [], []]
+                clusters.append(cluster)
+
+            cluster[2 + side].append(edit)
+
+        return clusters
+
+    def _split(self, data):
+        lines = re.split(r"\r?\n", data or '')
+
+        # Drop what follows the trailing newline.
+        if lines[-1] == '':
+            del lines[-1]
+
+        return lines
+
+    def _join(self, lines):
+        if lines:
+            return "\n".join(lines) + "\n"
+        return ""
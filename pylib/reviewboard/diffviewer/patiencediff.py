@@ -0,0 +1,167 @@
+from bisect import bisect_left
+
+
+class PatienceDiffer:
+    """
+    A cheap differ for files too large (or with lines too long) for
+    MyersDiffer, running in O(n log n) time and O(n) space whatever the
+    number of changes.
+
+    After skipping the common leading and trailing lines, the lines
+    occurring exactly once in both files are matched up in order (the
+    longest increasing subsequence of their positions, as patience diff
+    does) and extended over the equal lines around them. Whatever is left
+    between two matches is reported as replaced, inserted or deleted
+    without being diffed any further, so the result can be coarser than
+    MyersDiffer's.
+    """
+    def __init__(self, a, b):
+        if type(a) != type(b):
+            raise TypeError
+
+        self.a = a
+        self.b = b
+
+    def get_opcodes(self):
+        """
+        Generator returning opcodes, like SequenceMatcher.get_opcodes.
+        """
+        i = j = 0
+        last = None
+
+        for ai, bj, size in self._get_matching_blocks():
+            if i < ai and j < bj:
+                tag = "replace"
+            elif i < ai:
+                tag = "delete"
+            elif j < bj:
+                tag = "insert"
+            else:
+                tag = None
+
+            if tag:
+                if last:
+                    yield last
+                    last = None
+                yield tag, i, ai, j, bj
+
+            if size:
+                if last:
+                    # Adjacent matches are merged.
+                    last = ("equal", last[1], ai + size, last[3], bj + size)
+                else:
+                    last = ("equal", ai, ai + size, bj, bj + size)
+
+            i, j = ai + size, bj + size
+
+        if last:
+            yield last
+
+    def _get_matching_blocks(self):
+        """
+        Returns the (i, j, size) blocks of equal lines in a and b, ending
+        with (len(a), len(b), 0).
+        """
+        a, b = self.a, self.b
+        a_len, b_len = len(a), len(b)
+
+        prefix = 0
+        max_prefix = min(a_len, b_len)
+        while prefix < max_prefix and a[prefix] == b[prefix]:
+            prefix += 1
+
+        suffix = 0
+        max_suffix = max_prefix - prefix
+        while suffix < max_suffix and a[-1 - suffix] == b[-1 - suffix]:
+            suffix += 1
+
+        a_hi = a_len - suffix
+        b_hi = b_len - suffix
+        blocks = []
+
+        if prefix:
+            blocks.append((0, 0, prefix))
+
+        last_i, last_j = prefix, prefix
+
+        for i, j in self._get_unique_matches(prefix, a_hi, prefix, b_hi):
+            if i < last_i or j < last_j:
+                # Already part of the previous block.
+                continue
+
+            start = 0
+            while i - start > last_i and j - start > last_j and \
+                  a[i - start - 1] == b[j - start - 1]:
+                start += 1
+
+            end = 1
+            while i + end < a_hi and j + end < b_hi and \
+                  a[i + end] == b[j + end]:
+                end += 1
+
+            blocks.append((i - start, j - start, start + end))
+            last_i, last_j = i + end, j + end
+
+        if suffix:
+            blocks.append((a_hi, b_hi, suffix))
+
+        blocks.append((a_len, b_len, 0))
+        return blocks
+
+    def _get_unique_matches(self, a_lo, a_hi, b_lo, b_hi):
+        """
+        Returns the longest sequence of (i, j) pairs of lines occurring once
+        in both a[a_lo:a_hi] and b[b_lo:b_hi], increasing in both i and j.
+        """
+        a_index = {}
+        for i in xrange(a_lo, a_hi):
+            line = self.a[i]
+            if line in a_index:
+                a_index[line] = None
+            else:
+                a_index[line] = i
+
+        b_index = {}
+        for j in xrange(b_lo, b_hi):
+            line = self.b[j]
+            if line in b_index:
+                b_index[line] = None
+            else:
+                b_index[line] = j
+
+        pairs = []
+        for line, j in b_index.iteritems():
+            if j is not None:
+                i = a_index.get(line)
+                if i is not None:
+                    pairs.append((j, i))
+        pairs.sort()
+
+        # Patience sorting: tails[k] is the smallest i ending an increasing
+        # subsequence of length k + 1, and links point back to the previous
+        # pair of the subsequence.
+        tails = []
+        tail_pairs = []
+        links = {}
+        for j, i in pairs:
+            k = bisect_left(tails, i)
+            if k:
+                links[(i, j)] = tail_pairs[k - 1]
+            else:
+                links[(i, j)] = None
+            if k == len(tails):
+                tails.append(i)
+                tail_pairs.append((i, j))
+            else:
+                tails[k] = i
+                tail_pairs[k] = (i, j)
+
+        matches = []
+        if tail_pairs:
+            pair = tail_pairs[-1]
+            while pair is not None:
+                matches.append(pair)
+                pair = links[pair]
+            matches.reverse()
+
+        return matches
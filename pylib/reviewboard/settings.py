@@ -49,6 +49,9 @@ TEMPLATE_DIRS = (
     os.path.join(REVIEWBOARD_ROOT, 'templates'),
 )
 
+# Compile the diff templates into Python code, they're rendered once per line.
+TEMPLATE_COMPILE = True
+
 INSTALLED_APPS = (
     'reviewboard.diffviewer',
 )
@@ -11,7 +11,9 @@ SECRET_KEY = '***********************************************'
 
 # Cache backend.  Unset this to turn off caching completely.  As with most
 # django installations, the best option is probably to use memcached.
-CACHE_BACKEND = 'locmem:///'
+# Rendered diff fragments vary from a few KB to several MB, so bound the cache
+# by size and evict least recently used fragments first.
+CACHE_BACKEND = 'locmem:///?strategy=lru&max_entries=1000&max_size=67108864&pickle_strings=0'
 
 # Whether to send e-mail for review requests.
 SEND_REVIEW_MAIL = False
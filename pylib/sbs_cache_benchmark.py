@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+# 
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+# 
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+# License for the specific language governing rights and limitations
+# under the License.
+# 
+# The Original Code is "side by side diff" code.
+# 
+# The Initial Developer of the Original Code is ActiveState Software Inc.
+# Portions created by ActiveState Software Inc are Copyright (C) 2008-2009
+# ActiveState Software Inc. All Rights Reserved.
+# 
+# Contributor(s):
+#   Todd Whiteman @ ActiveState Software Inc
+# 
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+# 
+# ***** END LICENSE BLOCK *****
+
+
+
+#
+# Overview:
+#   Multi-threaded contention benchmark for the in-memory (locmem) cache
+#   backend, comparing locked and lock-free reads. Reader threads fetch
+#   rendered-fragment-sized values while writer threads keep replacing some
+#   of them, as concurrent diff viewer requests do.
+#
+# Usage:
+#   python sbs_cache_benchmark.py [options]
+#
+#   --threads=N     number of reader threads (default 8)
+#   --writers=N     number of writer threads (default 1)
+#   --ops=N         operations per thread (default 20000)
+#   --keys=N        number of distinct keys (default 500)
+#   --size=N        size in bytes of every value (default 4096)
+#   --strategy=S    "cull" or "lru" (default both)
+#
+
+import os
+import sys
+import random
+import threading
+import time
+from optparse import OptionParser
+
+pylib_dir = os.path.dirname(os.path.abspath(__file__))
+for path in (pylib_dir, os.path.join(pylib_dir, "reviewboard")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from django.core.cache.backends.locmem import CacheClass
+
+
+def _make_cache(strategy, lock_free, options):
+    params = {
+        'max_entries': str(options.keys * 2),
+        'pickle_strings': '0',
+        'lock_free_reads': lock_free and '1' or '0',
+    }
+    if strategy == 'lru':
+        params['strategy'] = 'lru'
+    return CacheClass('', params)
+
+
+def run(strategy, lock_free, options):
+    """
+    Returns the wall time taken and the hit and miss counts of the run.
+    """
+    cache = _make_cache(strategy, lock_free, options)
+    keys = ['diff-fragment-%d' % i for i in xrange(options.keys)]
+    value = 'x' * options.size
+    for key in keys:
+        cache.set(key, value)
+
+    start_barrier = threading.Event()
+
+    def reader(seed):
+        rnd = random.Random(seed)
+        start_barrier.wait()
+        for i in xrange(options.ops):
+            cache.get(keys[rnd.randrange(len(keys))])
+
+    def writer(seed):
+        rnd = random.Random(seed)
+        start_barrier.wait()
+        # One write for every ten reads of a reader.
+        for i in xrange(options.ops // 10):
+            cache.set(keys[rnd.randrange(len(keys))], value)
+
+    threads = [threading.Thread(target=reader, args=(i,))
+               for i in xrange(options.threads)]
+    threads += [threading.Thread(target=writer, args=(-i - 1,))
+                for i in xrange(options.writers)]
+    for t in threads:
+        t.start()
+    start = time.time()
+    start_barrier.set()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    stats = cache.get_stats()
+    return elapsed, stats['hits'], stats['misses']
+
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option("--threads", type="int", default=8)
+    parser.add_option("--writers", type="int", default=1)
+    parser.add_option("--ops", type="int", default=20000)
+    parser.add_option("--keys", type="int", default=500)
+    parser.add_option("--size", type="int", default=4096)
+    parser.add_option("--strategy", action="append")
+    options, args = parser.parse_args(argv[1:])
+
+    reads = options.threads * options.ops
+    print "%d reader(s), %d writer(s), %d reads" % (options.threads,
+                                                    options.writers, reads)
+    print "%-6s %-10s %10s %14s" % ("", "reads", "time (s)", "reads/s")
+    for strategy in options.strategy or ["cull", "lru"]:
+        for lock_free in (False, True):
+            elapsed, hits, misses = run(strategy, lock_free, options)
+            print "%-6s %-10s %10.3f %14.0f" % (
+                strategy, lock_free and "lock-free" or "locked", elapsed,
+                reads / elapsed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
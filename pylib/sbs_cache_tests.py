@@ -0,0 +1,523 @@
+
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+# 
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+# 
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+# License for the specific language governing rights and limitations
+# under the License.
+# 
+# The Original Code is "side by side diff" code.
+# 
+# The Initial Developer of the Original Code is ActiveState Software Inc.
+# Portions created by ActiveState Software Inc are Copyright (C) 2008-2009
+# ActiveState Software Inc. All Rights Reserved.
+# 
+# Contributor(s):
+#   Todd Whiteman @ ActiveState Software Inc
+# 
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+# 
+# ***** END LICENSE BLOCK *****
+
+
+
+#
+# Overview:
+#   Unit tests for the cache backends changed for the diff viewer: LRU
+#   eviction and lock-free reads in locmem, the index of the file-based
+#   backend, and the batched get_many/set_many/delete_many methods.
+#
+# Usage:
+#   python sbs_cache_tests.py
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+pylib_dir = os.path.dirname(os.path.abspath(__file__))
+for path in (pylib_dir, os.path.join(pylib_dir, "reviewboard")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from django.conf import settings
+# The database backend is tested against an in-memory database.
+settings.DATABASE_ENGINE = 'sqlite3'
+settings.DATABASE_NAME = ':memory:'
+
+
+class FakeCMemcacheClient(object):
+    """
+    Stands in for a cmemcache.Client talking to a memcached server, which
+    has no multi-key set and delete.
+    """
+    def __init__(self, servers=None):
+        self.data = {}
+
+    def get(self, key):
+        value, exp = self.data.get(key, (None, 0))
+        if exp < time.time():
+            return None
+        return value
+
+    def set(self, key, value, timeout=0):
+        self.data[key] = (value, time.time() + timeout)
+
+    def add(self, key, value, timeout=0):
+        if self.get(key) is None:
+            self.set(key, value, timeout)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def get_multi(self, keys):
+        d = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                d[key] = value
+        return d
+
+
+class FakeMemcacheClient(FakeCMemcacheClient):
+    """
+    Stands in for a memcache.Client talking to a memcached server.
+    """
+    def set_multi(self, data, timeout=0):
+        for key, value in data.items():
+            self.set(key, value, timeout)
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+
+
+try:
+    import memcache
+except ImportError:
+    memcache = types.ModuleType('memcache')
+    memcache.Client = FakeMemcacheClient
+    sys.modules['memcache'] = memcache
+
+from django.core.cache.backends import db, dummy, filebased, locmem, memcached
+from django.core.management import call_command
+
+
+def make_locmem(**params):
+    return locmem.CacheClass(None, dict([(k, str(v))
+                                         for k, v in params.items()]))
+
+
+class LocMemLRUTest(unittest.TestCase):
+    def testEvictionOrder(self):
+        """Testing locmem LRU eviction order"""
+        cache = make_locmem(strategy='lru', max_entries=3, lock_free_reads=0)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+
+        # Reading a moves it to the front, b becomes the oldest.
+        self.assertEqual(cache.get('a'), 'a')
+        cache.set('d', 'd')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get_many(['a', 'c', 'd']),
+                         {'a': 'a', 'c': 'c', 'd': 'd'})
+
+        # Replacing an entry also makes it the most recently used.
+        cache.set('a', 'A')
+        cache.set('e', 'e')
+        self.assertEqual(cache.get('c'), None)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get_stats()['evictions'], 2)
+        self.assertEqual(cache.get_stats()['entries'], 3)
+
+    def testMaxSize(self):
+        """Testing locmem LRU eviction by size"""
+        cache = make_locmem(max_size=10, pickle_strings=0, lock_free_reads=0)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        self.assertEqual(cache.get_stats()['size'], 8)
+
+        cache.set('c', 'x' * 4)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get_stats()['size'], 8)
+
+        # A value larger than the whole cache isn't stored, and doesn't
+        # flush it either.
+        cache.set('d', 'x' * 11)
+        self.assertEqual(cache.get('d'), None)
+        self.assertEqual(cache.get_many(['b', 'c']),
+                         {'b': 'x' * 4, 'c': 'x' * 4})
+
+    def testUnicodeSize(self):
+        """Testing locmem sizes unicode values by their encoded length"""
+        cache = make_locmem(max_size=10, pickle_strings=0, lock_free_reads=0)
+        cache.set('a', u'\xe9' * 4)
+        self.assertEqual(cache.get_stats()['size'], 8)
+
+        cache.set('b', u'\xe9' * 2)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), u'\xe9' * 2)
+
+    def testDelete(self):
+        """Testing locmem LRU accounting on deletes and expiry"""
+        cache = make_locmem(max_size=100, pickle_strings=0,
+                            lock_free_reads=0)
+        cache.set('a', 'x' * 10)
+        cache.set('b', 'x' * 20, -1)
+        cache.delete('a')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get_stats()['size'], 0)
+        self.assertEqual(cache.get_stats()['entries'], 0)
+
+        # The linked list is still consistent.
+        for key in ('c', 'd', 'e'):
+            cache.set(key, key)
+        cache.delete('d')
+        cache._evict()
+        self.assertEqual(self._lru_keys(cache), ['e', 'c'])
+
+    def _lru_keys(self, cache):
+        """Returns the keys from the most to the least recently used."""
+        keys = []
+        node = cache._root[locmem.NEXT]
+        while node is not cache._root:
+            keys.append(node[locmem.KEY])
+            node = node[locmem.NEXT]
+        return keys
+
+
+class LocMemLockFreeTest(unittest.TestCase):
+    def testExpiry(self):
+        """Testing expiry under lock-free locmem reads"""
+        for strategy in ('cull', 'lru'):
+            cache = make_locmem(strategy=strategy)
+            cache.set('a', 1, -1)
+            cache.set('b', 2)
+            self.assertEqual(cache.get('a', 'default'), 'default')
+            self.failIf(cache.has_key('a'))
+            self.assertEqual(cache.get_many(['a', 'b']), {'b': 2})
+
+            # Expiring after being set.
+            cache._expire_info['b'] = time.time() - 1
+            self.assertEqual(cache.get('b'), None)
+            self.assertEqual(cache.get_stats()['hits'], 1)
+            self.assertEqual(cache.get_stats()['misses'], 3)
+
+            # Readers leave expired entries for writers to delete.
+            self.assertEqual(cache.get_stats()['entries'], 2)
+            cache.set('a', 3)
+            self.assertEqual(cache.get('a'), 3)
+
+    def testEvictExpiredFirst(self):
+        """Testing lock-free locmem LRU evicts expired entries first"""
+        cache = make_locmem(strategy='lru', max_entries=3)
+        cache.set('a', 'a')
+        cache.set('b', 'b', -1)
+        cache.set('c', 'c', -1)
+        self.assertEqual(cache.get('b'), None)
+
+        # a is the oldest, but the expired entries make room for d and e.
+        cache.set('d', 'd')
+        cache.set('e', 'e')
+        self.assertEqual(cache.get_many(['a', 'd', 'e']),
+                         {'a': 'a', 'd': 'd', 'e': 'e'})
+        self.assertEqual(cache.get_stats()['entries'], 3)
+        self.failIf('b' in cache._expire_info)
+        self.failIf('c' in cache._expire_info)
+
+    def testSecondChance(self):
+        """Testing the second chance of entries read without the lock"""
+        cache = make_locmem(strategy='lru', max_entries=3)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+
+        # a is the oldest, but it was read since it was linked.
+        self.assertEqual(cache.get('a'), 'a')
+        cache.set('d', 'd')
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']),
+                         {'a': 'a', 'c': 'c', 'd': 'd'})
+
+        # Reading every entry doesn't keep them all from being evicted.
+        cache.set('e', 'e')
+        self.assertEqual(cache.get_stats()['entries'], 3)
+        self.assertEqual(cache.get('e'), 'e')
+
+    def testConcurrentReads(self):
+        """Testing lock-free locmem reads against concurrent writes"""
+        cache = make_locmem(strategy='lru', max_entries=20)
+        errors = []
+
+        def read():
+            try:
+                for i in xrange(2000):
+                    key = str(i % 40)
+                    value = cache.get(key)
+                    if value is not None and value != key * 10:
+                        errors.append((key, value))
+            except Exception, e:
+                errors.append(e)
+
+        def write():
+            try:
+                for i in xrange(2000):
+                    key = str(i % 40)
+                    cache.set(key, key * 10)
+                    if i % 7 == 0:
+                        cache.delete(str(i % 13))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read) for i in range(3)] + \
+                  [threading.Thread(target=write)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.failUnless(cache.get_stats()['entries'] <= 20)
+        self.assertEqual(len(cache._nodes), len(cache._cache))
+
+
+class FileIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_cache(self, **params):
+        params.setdefault('index', 1)
+        return filebased.CacheClass(self.dir, dict([(k, str(v))
+                                                    for k, v in params.items()]))
+
+    def testIndex(self):
+        """Testing the file-based cache index"""
+        cache = self.make_cache()
+        cache.set('a', [1])
+        cache.set('b', 2, -1)
+        self.assertEqual(cache.get('a'), [1])
+        self.failUnless(cache.has_key('a'))
+        self.failIf(cache.has_key('b'))
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache._num_entries, 1)
+
+        cache.delete('a')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache._num_entries, 0)
+        self.assertEqual(cache._index.size, 0)
+
+    def testJournalReplay(self):
+        """Testing the file-based cache index journal across processes"""
+        cache1 = self.make_cache()
+        cache2 = self.make_cache()
+        cache1.set('a', 1)
+        self.assertEqual(cache2.get('a'), 1)
+
+        # The journal is replaced by a snapshot, which the other process
+        # picks up along with the records appended after it.
+        cache1._index.compact()
+        cache1.set('b', 2)
+        cache1.delete('a')
+        self.failIf(cache2.has_key('a'))
+        self.assertEqual(cache2.get('b'), 2)
+        self.assertEqual(cache2._index.entries.keys(),
+                         cache1._index.entries.keys())
+        self.assertEqual(cache2._index.size, cache1._index.size)
+
+        # A new process reads the same index back.
+        cache3 = self.make_cache()
+        self.assertEqual(cache3._num_entries, 1)
+        self.assertEqual(cache3._index.size, cache1._index.size)
+
+    def testCompactAfterAppends(self):
+        """Testing compacting keeps other processes' journal records"""
+        cache1 = self.make_cache()
+        cache2 = self.make_cache()
+        cache1.set('a', 1)
+        cache2.set('b', 2)
+
+        # cache1 hasn't synced cache2's record yet.
+        cache1._index.compact()
+        cache3 = self.make_cache()
+        self.assertEqual(cache3._num_entries, 2)
+        self.assertEqual(cache3._index.size, cache2._index.size)
+
+    def testMissingEntry(self):
+        """Testing file cache entries missing from the index"""
+        cache = self.make_cache()
+        cache.set('a', 'x' * 100)
+        size = cache._index.size
+        name = cache._file_to_name(cache._key_to_file('a'))
+
+        # As if the record of a's set had been lost.
+        cache._index.record_delete(name)
+        self.assertEqual(cache._index.size, 0)
+        self.assertEqual(cache.get('a'), 'x' * 100)
+        self.assertEqual(cache._index.size, size)
+
+        cache._index.record_delete(name)
+        self.failUnless(cache.has_key('a'))
+        self.assertEqual(cache._num_entries, 1)
+
+    def testBuild(self):
+        """Testing building the file-based cache index from its files"""
+        cache = self.make_cache(index=0)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        cache = self.make_cache()
+        self.assertEqual(cache._num_entries, 2)
+        self.assertEqual(cache.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        self.failUnless(os.path.exists(cache._index.path))
+
+    def testCull(self):
+        """Testing culling the least recently accessed file cache entries"""
+        cache = self.make_cache(max_entries=4, cull_frequency=2)
+        for key in ('a', 'b', 'c', 'd'):
+            cache.set(key, key)
+
+        # Accesses within ACCESS_GRANULARITY are only kept in memory, and
+        # must survive replaying the journal.
+        now = time.time()
+        for key, atime in (('a', 4), ('b', 1), ('c', 2), ('d', 3)):
+            name = cache._file_to_name(cache._key_to_file(key))
+            cache._index.record_access(name, now + atime)
+
+        # Half of the entries budget is freed up, oldest first.
+        cache.set('e', 'e')
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd', 'e']),
+                         {'a': 'a', 'e': 'e'})
+
+    def testMaxSize(self):
+        """Testing culling file cache entries by size"""
+        cache = self.make_cache(max_entries=100, max_size=1000)
+        for i in range(5):
+            cache.set(str(i), 'x' * 300)
+            self.failUnless(cache._index.size <= 1000 + 400)
+
+        self.failUnless(cache.has_key('4'))
+        self.failIf(cache.has_key('0'))
+
+
+class BatchMethodsTests:
+    """
+    Checks that get_many, set_many and delete_many behave like get, set and
+    delete called on every key, for the cache returned by make_cache().
+    """
+    def testBatchMethods(self):
+        """Testing batched cache methods against single key ones"""
+        cache = self.make_cache()
+        data = {'a': 1, 'b': u'two', 'c': [3]}
+        cache.set_many(data)
+        for key, value in data.items():
+            self.assertEqual(cache.get(key), value)
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']), data)
+
+        cache.set('d', 4)
+        cache.delete_many(['a', 'd', 'missing'])
+        for key in ('a', 'd'):
+            self.assertEqual(cache.get(key), None)
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']),
+                         {'b': u'two', 'c': [3]})
+
+        # Replacing entries.
+        cache.set_many({'b': 2, 'e': 5})
+        self.assertEqual(cache.get_many(['b', 'e']), {'b': 2, 'e': 5})
+
+        # Expired entries are missing, like with get.
+        cache.set_many({'f': 6}, -1)
+        self.assertEqual(cache.get('f'), None)
+        self.assertEqual(cache.get_many(['f', 'e']), {'e': 5})
+
+        cache.set_many({})
+        cache.delete_many([])
+        self.assertEqual(cache.get_many([]), {})
+
+
+class LocMemBatchTest(unittest.TestCase, BatchMethodsTests):
+    def make_cache(self):
+        return make_locmem()
+
+
+class LocMemLRUBatchTest(unittest.TestCase, BatchMethodsTests):
+    def make_cache(self):
+        return make_locmem(strategy='lru', max_entries=10,
+                           lock_free_reads=0)
+
+
+class FileBatchTest(unittest.TestCase, BatchMethodsTests):
+    index = 0
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_cache(self):
+        return filebased.CacheClass(self.dir, {'index': str(self.index)})
+
+
+class FileIndexBatchTest(FileBatchTest):
+    index = 1
+
+
+class DBBatchTest(unittest.TestCase, BatchMethodsTests):
+    def setUp(self):
+        call_command('createcachetable', 'sbs_cache_tests')
+
+    def tearDown(self):
+        cursor = db.connection.cursor()
+        cursor.execute("DROP TABLE sbs_cache_tests")
+
+    def make_cache(self):
+        return db.CacheClass('sbs_cache_tests', {})
+
+
+class MemcachedBatchTest(unittest.TestCase, BatchMethodsTests):
+    client_class = FakeMemcacheClient
+
+    def make_cache(self):
+        cache = memcached.CacheClass('127.0.0.1:11211', {})
+        cache._cache = self.client_class()
+        return cache
+
+
+class CMemcacheBatchTest(MemcachedBatchTest):
+    client_class = FakeCMemcacheClient
+
+
+class DummyBatchTest(unittest.TestCase):
+    def testBatchMethods(self):
+        """Testing batched dummy cache methods"""
+        cache = dummy.CacheClass(None, {})
+        cache.set_many({'a': 1})
+        cache.delete_many(['a'])
+        self.assertEqual(cache.get_many(['a']), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+# 
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+# 
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+# License for the specific language governing rights and limitations
+# under the License.
+# 
+# The Original Code is "side by side diff" code.
+# 
+# The Initial Developer of the Original Code is ActiveState Software Inc.
+# Portions created by ActiveState Software Inc are Copyright (C) 2008-2009
+# ActiveState Software Inc. All Rights Reserved.
+# 
+# Contributor(s):
+#   Todd Whiteman @ ActiveState Software Inc
+# 
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+# 
+# ***** END LICENSE BLOCK *****
+
+
+#
+# Overview:
+#   Standalone benchmark harness for the side-by-side diff pipeline. It runs
+#   outside of Komodo (no XPCOM): file contents are generated in memory and
+#   handed directly to DiffItem, so no koFileEx reads or patch runs occur.
+#
+# Usage:
+#   python sbs_diff_benchmark.py [options] [case ...]
+#
+#   --scale=N             multiply corpus sizes by N (default 1.0)
+#   --repeat=N            best of N runs for every timing (default 3)
+#   --no-highlight        disable pygments highlighting
+#   --save-baseline=FILE  store the results as a JSON baseline
+#   --baseline=FILE       compare the results against a stored baseline
+#   --threshold=PCT       allowed slowdown before a stage is reported as a
+#                         regression (default 20)
+#
+#   Each case runs in its own child process so that the reported peak memory
+#   belongs to that case alone. The exit status is 1 if a regression was
+#   found when comparing against a baseline.
+#
+
+import os
+import sys
+import random
+import subprocess
+import time
+from optparse import OptionParser
+
+pylib_dir = os.path.dirname(os.path.abspath(__file__))
+for path in (pylib_dir, os.path.join(pylib_dir, "reviewboard")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from django.utils import simplejson
+
+import sbs_diff_helper
+from sbs_diff_helper import DiffItem, DiffStats, get_line_changed_regions
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+from reviewboard.diffviewer.smdiff import SMDiffer
+
+
+#---- Synthetic corpora
+
+_words = ("self", "return", "value", "index", "result", "None", "data",
+          "line", "chunk", "if", "for", "in", "not", "and", "or", "key",
+          "0", "1", "42", "'text'", "+", "-", "==", "(", ")", "[", "]")
+
+def _gen_line(rnd, width=8):
+    indent = "    " * rnd.randint(0, 3)
+    return indent + " ".join([rnd.choice(_words)
+                              for i in range(rnd.randint(1, width))])
+
+def _gen_lines(rnd, count, width=8):
+    return [_gen_line(rnd, width) for i in xrange(count)]
+
+def _edit_lines(rnd, lines, num_edits, width=8):
+    """
+    Returns a copy of lines with num_edits small, scattered edits (changed,
+    inserted and deleted lines).
+    """
+    lines = list(lines)
+    for i in range(num_edits):
+        pos = rnd.randint(0, max(0, len(lines) - 1))
+        action = rnd.randint(0, 2)
+        if action == 0 and lines:
+            lines[pos] = lines[pos] + " " + rnd.choice(_words)
+        elif action == 1:
+            lines.insert(pos, _gen_line(rnd, width))
+        elif lines:
+            del lines[pos]
+    return lines
+
+def _join(lines, eol="\n"):
+    return eol.join(lines) + eol
+
+def corpus_small_edits_huge_file(rnd, scale):
+    old = _gen_lines(rnd, int(50000 * scale))
+    new = _edit_lines(rnd, old, 20)
+    return [("huge.py", _join(old), _join(new))]
+
+def corpus_many_small_files(rnd, scale):
+    files = []
+    for i in range(int(200 * scale)):
+        old = _gen_lines(rnd, 50)
+        new = _edit_lines(rnd, old, rnd.randint(1, 2))
+        files.append(("small%d.py" % (i, ), _join(old), _join(new)))
+    return files
+
+def corpus_whole_file_rewrite(rnd, scale):
+    count = int(5000 * scale)
+    return [("rewrite.py", _join(_gen_lines(rnd, count)),
+                           _join(_gen_lines(rnd, count)))]
+
+def corpus_long_lines(rnd, scale):
+    old = _gen_lines(rnd, int(500 * scale), width=400)
+    new = list(old)
+    for i in range(0, len(new), 2):
+        # Small change in the middle of every other long line, so that the
+        # intraline differ has to do the work.
+        mid = len(new[i]) // 2
+        new[i] = new[i][:mid] + rnd.choice(_words) + new[i][mid:]
+    return [("long.py", _join(old), _join(new))]
+
+def corpus_crlf(rnd, scale):
+    old = _gen_lines(rnd, int(10000 * scale))
+    new = _edit_lines(rnd, old, 50)
+    return [("crlf.py", _join(old, "\r\n"), _join(new, "\r\n"))]
+
+CASES = [
+    ("small_edits_huge_file", corpus_small_edits_huge_file),
+    ("many_small_files", corpus_many_small_files),
+    ("whole_file_rewrite", corpus_whole_file_rewrite),
+    ("long_lines", corpus_long_lines),
+    ("crlf", corpus_crlf),
+]
+
+
+#---- Stubs replacing the XPCOM pieces of the pipeline
+
+class StubFileDiffEx(object):
+    """
+    Minimal stand-in for Komodo's koDiff file diff object.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.diff = ""
+        self.hunks = []
+        self.paths = {"a": path, "b": path}
+
+    def best_path(self, cwd):
+        return "file:///%s" % (self.path, )
+
+
+class StubDiffItem(DiffItem):
+    """
+    DiffItem with both file contents supplied up front, so neither koFileEx
+    nor the external patch program is ever needed.
+    """
+    def __init__(self, id, path, old, new, hl_enabled=True):
+        DiffItem.__init__(self, id, StubFileDiffEx(path), cwd="/",
+                          hl_enabled=hl_enabled, file_on_disk=True)
+        self._left_contents = old
+        self._right_contents = new
+
+    def get_original_file(self, allow_patching=True):
+        return self._left_contents
+
+    def get_patched_file(self, allow_patching=True):
+        return self._right_contents
+
+
+#---- Measurements
+
+def _best_of(repeat, func, *args):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _peak_memory_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes rather than kilobytes.
+        peak //= 1024
+    return peak
+
+def _split(text):
+    return sbs_diff_helper.re.split(r"\r?\n", text)[:-1]
+
+def _bench_myers(files):
+    for path, old, new in files:
+        list(MyersDiffer(_split(old), _split(new)).get_opcodes())
+
+def _bench_smdiff(files):
+    for path, old, new in files:
+        list(SMDiffer(_split(old), _split(new)).get_opcodes())
+
+def _changed_pairs(files):
+    pairs = []
+    for path, old, new in files:
+        a, b = _split(old), _split(new)
+        for tag, i1, i2, j1, j2 in MyersDiffer(a, b).get_opcodes():
+            if tag == "replace":
+                pairs.extend(zip(a[i1:i2], b[j1:j2]))
+    return pairs
+
+def _bench_regions(pairs):
+    for oldline, newline in pairs:
+        get_line_changed_regions(oldline, newline)
+
+def _bench_highlightregion(pairs):
+    from django.utils.html import escape
+    from reviewboard.diffviewer.templatetags.difftags import highlightregion
+    for oldline, newline in pairs:
+        oldregion, newregion = get_line_changed_regions(oldline, newline)
+        highlightregion(escape(oldline), oldregion)
+        highlightregion(escape(newline), newregion)
+
+def _reset_highlight_cache():
+    # A new memory-only cache, so that the files are highlighted again
+    # rather than found in the cache of the previous run.
+    sbs_diff_helper._highlight_cache = sbs_diff_helper.HighlightCache()
+
+def _bench_pygments(files, cached=False):
+    if not cached:
+        _reset_highlight_cache()
+    for path, old, new in files:
+        sbs_diff_helper.apply_pygments(old, path)
+        sbs_diff_helper.apply_pygments(new, path)
+
+def _bench_pipeline(files, hl_enabled, stats):
+    _reset_highlight_cache()
+    for i, (path, old, new) in enumerate(files):
+        d = StubDiffItem(str(i + 1), path, old, new, hl_enabled)
+        d.load_chunks()
+        d.toHTML()
+        stats.merge(d.stats)
+
+def run_case(name, scale=1.0, repeat=3, hl_enabled=True):
+    """
+    Runs a single benchmark case in this process, returning a dict of stage
+    timings (best of repeat runs), counters and the peak memory use.
+    """
+    factory = dict(CASES)[name]
+    files = factory(random.Random(name), scale)
+    pairs = _changed_pairs(files)
+
+    timings = {}
+    timings["myers"] = _best_of(repeat, _bench_myers, files)
+    timings["smdiff"] = _best_of(repeat, _bench_smdiff, files)
+    timings["regions"] = _best_of(repeat, _bench_regions, pairs)
+    timings["highlightregion"] = _best_of(repeat, _bench_highlightregion,
+                                          pairs)
+    if hl_enabled and sbs_diff_helper._have_pygments:
+        timings["pygments"] = _best_of(repeat, _bench_pygments, files)
+        # The files highlighted by the last run are all in the cache.
+        timings["pygments.cached"] = _best_of(repeat, _bench_pygments, files,
+                                              True)
+
+    best = None
+    for i in range(repeat):
+        stats = DiffStats()
+        start = time.time()
+        _bench_pipeline(files, hl_enabled, stats)
+        elapsed = time.time() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, stats)
+    timings["pipeline"] = best[0]
+    for stage, seconds in best[1].timings.items():
+        timings["pipeline." + stage] = seconds
+
+    counters = dict(best[1].counters)
+    counters["files"] = len(files)
+    counters["bytes"] = sum([len(old) + len(new)
+                             for path, old, new in files])
+    return {
+        "timings": timings,
+        "counters": counters,
+        "peak_memory_kb": _peak_memory_kb(),
+    }
+
+def run_case_in_child(name, options):
+    argv = [sys.executable, os.path.abspath(__file__), "--child",
+            "--scale=%s" % (options.scale, ),
+            "--repeat=%d" % (options.repeat, )]
+    if not options.highlight:
+        argv.append("--no-highlight")
+    argv.append(name)
+    p = subprocess.Popen(argv, stdout=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise RuntimeError("benchmark case %r failed" % (name, ))
+    return simplejson.loads(stdout)
+
+
+#---- Reporting
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Returns a list of (case, stage, baseline, current) tuples for every
+    stage that got slower by more than threshold percent.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for stage, seconds in result["timings"].items():
+            old = base["timings"].get(stage)
+            if old and seconds > old * (1 + threshold / 100.0):
+                regressions.append((name, stage, old, seconds))
+    return regressions
+
+def print_results(results, baseline=None):
+    for name, dummy in CASES:
+        if name not in results:
+            continue
+        result = results[name]
+        base = (baseline or {}).get(name, {}).get("timings", {})
+        print "%s (peak memory: %s KB)" % (name, result["peak_memory_kb"])
+        for stage in sorted(result["timings"]):
+            seconds = result["timings"][stage]
+            line = "    %-26s %10.4fs" % (stage, seconds)
+            if base.get(stage):
+                line += "  (baseline %.4fs, %+.1f%%)" % (
+                        base[stage], (seconds / base[stage] - 1) * 100)
+            print line
+        counters = result["counters"]
+        print "    " + ", ".join(["%s=%s" % (k, counters[k])
+                                  for k in sorted(counters)])
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options] [case ...]")
+    parser.add_option("--scale", type="float", default=1.0)
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--no-highlight", dest="highlight",
+                      action="store_false", default=True)
+    parser.add_option("--save-baseline", dest="save_baseline")
+    parser.add_option("--baseline")
+    parser.add_option("--threshold", type="float", default=20.0)
+    parser.add_option("--child", action="store_true", default=False,
+                      help="internal: run one case and print JSON")
+    options, args = parser.parse_args(argv[1:])
+
+    names = args or [name for name, dummy in CASES]
+    for name in names:
+        if name not in dict(CASES):
+            parser.error("unknown case %r, expected one of: %s" % (
+                         name, ", ".join([n for n, dummy in CASES])))
+
+    if options.child:
+        result = run_case(names[0], options.scale, options.repeat,
+                          options.highlight)
+        sys.stdout.write(simplejson.dumps(result))
+        return 0
+
+    results = {}
+    for name in names:
+        results[name] = run_case_in_child(name, options)
+
+    baseline = None
+    if options.baseline:
+        baseline = simplejson.loads(file(options.baseline).read())
+    print_results(results, baseline)
+
+    if options.save_baseline:
+        file(options.save_baseline, "w").write(
+            simplejson.dumps(results, sort_keys=True, indent=2))
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline,
+                                          options.threshold)
+        for name, stage, old, new in regressions:
+            print "REGRESSION: %s %s %.4fs -> %.4fs" % (name, stage, old, new)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
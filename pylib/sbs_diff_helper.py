@@ -49,24 +49,37 @@ import os
 import sys
 import fnmatch
 import logging
+import mmap
+import Queue
 import re
 import subprocess
 import tempfile
+import threading
+import time
+from array import array
 from difflib import SequenceMatcher
+try:
+    from hashlib import sha1
+except ImportError:
+    # Python 2.4
+    from sha import new as sha1
 
 try:
-    from uriparse import URIToPath
+    from uriparse import URIToPath, localPathToURI
 except ImportError:
     import warnings
     warnings.warn("Could not import uriparse", ImportWarning)
     def URIToPath(uri):
         return uri.split("file://", 1)[1]
+    def localPathToURI(path):
+        return "file://" + path
 
 try:
     import pygments
     from pygments.lexers import get_lexer_for_filename
     # from pygments.lexers import guess_lexer_for_filename
     from pygments.formatters import HtmlFormatter
+    from pygments.lexer import RegexLexer
     _have_pygments = True
 except ImportError:
     import warnings
@@ -76,12 +89,160 @@ except ImportError:
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 from django.utils.html import escape
+from django.utils.encoding import force_unicode
+from django.utils import simplejson
+from django.utils.profiling import ProfileAggregator, format_stats
 
+from reviewboard.diffviewer.interdiff import InterDiffer, InterdiffError
 from reviewboard.diffviewer.myersdiff import MyersDiffer
+from reviewboard.diffviewer.patiencediff import PatienceDiffer
 from reviewboard.diffviewer.smdiff import SMDiffer
 
 
-DEFAULT_DIFF_COMPAT_VERSION = 1
+# Number of leading bytes examined when deciding if a file is binary.
+BINARY_SNIFF_SIZE = 8192
+
+# Characters that are considered to be text, everything else counts towards
+# the binary ratio (the same heuristic used by Perl's -B file test).
+_text_characters = "".join(map(chr, [7, 8, 9, 10, 12, 13, 27] +
+                                    range(0x20, 0x100)))
+# str.translate() only takes None as its table from Python 2.6 on.
+_identity_table = "".join(map(chr, range(0x100)))
+
+# Local files smaller than this are read rather than memory-mapped (see
+# map_file()), as are files modified in the last MAP_SETTLE_TIME seconds,
+# which may still be being written.
+MAP_MIN_SIZE = 256 * 1024
+MAP_SETTLE_TIME = 2
+
+# Setting SBSDIFF_PROFILE in the environment profiles every
+# SideBySideDiff.toHTML() call with cProfile. When it names a directory, the
+# profiles aggregated across calls are dumped there as
+# SideBySideDiff.toHTML.prof.
+PROFILE_ENV_VAR = "SBSDIFF_PROFILE"
+
+# Komodo's component reloads this module before every diff, the aggregated
+# profiles must survive that.
+try:
+    _profiler
+except NameError:
+    _profiler = None
+
+def get_profiler():
+    """
+    Returns the ProfileAggregator used for toHTML(), or None if profiling
+    isn't enabled.
+    """
+    global _profiler
+    setting = os.environ.get(PROFILE_ENV_VAR)
+    if not setting:
+        return None
+    if _profiler is None:
+        data_dir = None
+        if os.path.isdir(setting):
+            data_dir = setting
+        _profiler = ProfileAggregator(data_dir)
+    return _profiler
+
+# Highlighted markup is cached in memory, see HighlightCache. When
+# SBSDIFF_HIGHLIGHT_CACHE names a directory, it's also cached there, which
+# keeps it across Komodo sessions.
+HIGHLIGHT_CACHE_ENV_VAR = "SBSDIFF_HIGHLIGHT_CACHE"
+
+class HighlightCache(object):
+    """
+    A cache of highlighted text, holding the markup lines of every text
+    highlighted with a given lexer and formatter. Entries are keyed by the
+    lexer's name, options and filters, the formatter's options and the SHA-1
+    of the text, so unchanged files (e.g. the left side of successive diffs
+    of a working copy) only cost hashing their contents.
+
+    The markup is kept in a least-recently-used in-memory cache bounded by
+    memory_size bytes, and also on disk when a data_dir is given. Entries
+    read from the disk are copied into memory.
+    """
+    MEMORY_CACHE_URI = "locmem:///?strategy=lru&max_entries=%d&max_size=%d" \
+                       "&pickle_strings=0&timeout=%d"
+    DISK_CACHE_URI = "file://%s?index=1&max_entries=%d&max_size=%d" \
+                     "&timeout=%d"
+
+    def __init__(self, data_dir=None, memory_size=32 * 1024 * 1024,
+                 disk_size=256 * 1024 * 1024, max_entries=2000,
+                 timeout=30 * 24 * 60 * 60):
+        from django.core.cache import get_cache
+        self.memory = get_cache(self.MEMORY_CACHE_URI % (max_entries,
+                                                         memory_size,
+                                                         timeout))
+        self.disk = None
+        if data_dir:
+            self.disk = get_cache(self.DISK_CACHE_URI % (data_dir,
+                                                         max_entries * 10,
+                                                         disk_size, timeout))
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, text, lexer, formatter, stack=None):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        options = (lexer.name, sorted(lexer.options.items()),
+                   [f.__class__.__name__ for f in lexer.filters],
+                   sorted(formatter.options.items()), stack)
+        return "highlight-%s-%s" % (sha1(repr(options)).hexdigest(),
+                                    sha1(text).hexdigest())
+
+    def highlight(self, text, lexer, formatter, stack=None):
+        """
+        Returns the lines of the markup of text highlighted with lexer and
+        formatter, cached. text may be a memory-mapped file, which is only
+        copied when it needs highlighting. If stack is given, lexing starts from this state
+        stack (see RegexLexer.get_tokens_from_state).
+        """
+        key = self.get_key(text, lexer, formatter, stack)
+        markup = self.memory.get(key)
+        if markup is None and self.disk is not None:
+            markup = self.disk.get(key)
+            if markup is not None:
+                self.memory.set(key, markup)
+        if markup is not None:
+            self.hits += 1
+            # Lines are stored joined, so that they don't need pickling.
+            return markup.split("\n")
+
+        self.misses += 1
+        if not isinstance(text, basestring):
+            # A memory-mapped file, which pygments can't lex.
+            text = text[:]
+        if stack is None:
+            tokens = lexer.get_tokens(text)
+        else:
+            tokens = lexer.get_tokens_from_state(text, stack)
+        lines = pygments.format(tokens, formatter).splitlines()
+        markup = u"\n".join(lines)
+        self.memory.set(key, markup)
+        if self.disk is not None:
+            self.disk.set(key, markup)
+        return lines
+
+# Kept across module reloads, like _profiler.
+try:
+    _highlight_cache
+except NameError:
+    _highlight_cache = None
+
+def get_highlight_cache():
+    """
+    Returns the HighlightCache used for syntax highlighting, with a disk
+    tier if HIGHLIGHT_CACHE_ENV_VAR names a directory.
+    """
+    global _highlight_cache
+    if _highlight_cache is None:
+        _highlight_cache = HighlightCache(
+            os.environ.get(HIGHLIGHT_CACHE_ENV_VAR) or None)
+    return _highlight_cache
+
+# Hunk-less file diffs generated by diff, svn, hg and git for binary files.
+_binary_diff_re = re.compile(r"^(Binary files .* differ|GIT binary patch)\s*$",
+                             re.M)
 
 
 class UserVisibleError(Exception):
@@ -92,6 +253,49 @@ class DiffCompatError(Exception):
     pass
 
 
+class DiffStats(object):
+    """
+    Per-file timings (in seconds) and counters for each stage of generating
+    a side-by-side diff: reading, patching, highlighting, diffing, intraline
+    regions and template rendering.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def incr(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def timed(self, stage, func, *args, **kwargs):
+        """
+        Calls func with the given arguments, recording the elapsed time
+        against stage.
+        """
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.add_time(stage, time.time() - start)
+
+    def merge(self, other):
+        for stage, seconds in other.timings.items():
+            self.add_time(stage, seconds)
+        for counter, amount in other.counters.items():
+            self.incr(counter, amount)
+
+    def as_dict(self):
+        timings = {}
+        for stage, seconds in self.timings.items():
+            timings[stage] = round(seconds, 6)
+        return {
+            'timings': timings,
+            'counters': dict(self.counters),
+        }
+
+
 class OpCode(object):
     def __init__(self, tag, i1, i2, j1, j2, i_offset=0, j_offset=0):
         self.tag = tag
@@ -102,29 +306,371 @@ class OpCode(object):
         self.i_offset = i_offset
         self.j_offset = j_offset
 
-def Differ(a, b, ignore_space=False,
-           compat_version=DEFAULT_DIFF_COMPAT_VERSION):
+def is_binary_data(data):
     """
-    Factory wrapper for returning a differ class based on the compat version
-    and flags specified.
+    Returns True when the leading block of data looks like binary content,
+    i.e. it contains a NUL byte or more than 30% non-text characters.
     """
-    if compat_version == 0:
-        return SMDiffer(a, b)
-    elif compat_version == 1:
-        return MyersDiffer(a, b, ignore_space)
-    else:
-        raise DiffCompatError(
-            "Invalid diff compatibility version (%s) passed to Differ" %
-                (compat_version))
+    if not data:
+        return False
+    block = data[:BINARY_SNIFF_SIZE]
+    if "\0" in block:
+        return True
+    if isinstance(block, unicode):
+        # Already decoded, so it was text as far as the reader was concerned.
+        return False
+    nontext = block.translate(_identity_table, _text_characters)
+    return float(len(nontext)) / len(block) > 0.3
+
+
+def escape_lines(data):
+    """
+    Returns the HTML escaped lines of data, escaped as they are accessed
+    rather than copied up front (see EscapedLines). data is either a string,
+    which is split on "\n" and "\r\n" like re.split(r"\r?\n", escape(data)),
+    or a sequence of lines, giving the same lines as
+    [escape(x) for x in data].
+    """
+    if isinstance(data, basestring):
+        # TextLines drops the empty line after a trailing newline.
+        data = TextLines(data + "\n")
+    return EscapedLines(data)
+
+
+class EscapedLines(object):
+    """
+    The HTML escaped lines of a sequence of lines, such as TextLines. Lines
+    are escaped when they're indexed or sliced, a slice in one pass over
+    its text, so the markup of a file's unchanged lines isn't copied until
+    the chunks holding them are built.
+    """
+    # Lines escaped at a time when iterating.
+    BLOCK_SIZE = 1000
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._escape(self.lines[index])
+        return self._escape([self.lines[index]])[0]
+
+    def __iter__(self):
+        for start in xrange(0, len(self), self.BLOCK_SIZE):
+            for line in self[start:start + self.BLOCK_SIZE]:
+                yield line
+
+    def _escape(self, lines):
+        if not lines:
+            return []
+        text = force_unicode("\n".join(lines))
+        return text.replace('&', '&amp;').replace('<', '&lt;') \
+                   .replace('>', '&gt;').replace('"', '&quot;') \
+                   .replace("'", '&#39;').split("\n")
+
+
+def map_file(path):
+    """
+    Returns the contents of the local file at path as a read-only memory
+    map, which slices and searches like a string without reading the file
+    in full. Empty files, which can't be mapped, give "". Files under
+    MAP_MIN_SIZE, or modified less than MAP_SETTLE_TIME seconds ago, are
+    read instead.
+
+    Accessing the map raises SIGBUS (crashing the process) on some
+    platforms once another process truncates the file, and the map shows
+    changes made to it meanwhile. The map should only be kept while the
+    diff is built, see DiffItem._release_contents().
+    """
+    f = open(path, "rb")
+    try:
+        st = os.fstat(f.fileno())
+        if st.st_size == 0:
+            return ""
+        if st.st_size < MAP_MIN_SIZE or \
+           time.time() - st.st_mtime < MAP_SETTLE_TIME:
+            return f.read()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+
+class TextLines(object):
+    """
+    The lines of a text, split on "\n" and "\r\n" like
+    re.split(r"\r?\n", text) less the empty line following a trailing
+    newline. Only the offsets of the lines are built, in one pass over the
+    text, and lines are sliced out of it when accessed, so a memory-mapped
+    file (see map_file()) can be diffed without being copied as a whole.
+    """
+    def __init__(self, text):
+        self.text = text
+
+        offsets = array('l', [0])
+        find = text.find
+        pos = find("\n")
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = find("\n", pos + 1)
+
+        if offsets[-1] != len(text):
+            # The last line has no newline.
+            offsets.append(len(text) + 1)
 
+        self.offsets = offsets
 
-def get_line_changed_regions(oldline, newline):
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._iter_lines(*index.indices(len(self))))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("line index out of range")
+
+        return self._iter_lines(index, index + 1).next()
+
+    def __iter__(self):
+        return self._iter_lines(0, len(self))
+
+    def _iter_lines(self, start, stop, step=1):
+        text = self.text
+        offsets = self.offsets
+        for i in xrange(start, stop, step):
+            begin = offsets[i]
+            end = offsets[i + 1] - 1
+            if end > begin and text[end - 1] == "\r":
+                end -= 1
+            yield text[begin:end]
+
+
+def is_binary_diff(diff):
+    """
+    Returns True when the diff only states that binary files differ.
+    """
+    return bool(diff and _binary_diff_re.search(diff))
+
+
+class DifferEngine(object):
+    """
+    A differ registered with register_differ(), along with what it can
+    handle, which select_differ() looks at to pick the differ of each file.
+
+    max_lines and max_line_length bound the total number of lines of both
+    files and their average line length the engine should be used for
+    (None for no bound). file_patterns are fnmatch patterns of file names
+    it's picked for first, whatever their size. normalize tells whether it
+    supports ignoring whitespace and the other line normalizations.
+    Engines are tried from the highest priority down, and ones with a
+    priority of None are only used when asked for by name.
+    """
+    def __init__(self, name, factory, priority=None, max_lines=None,
+                 max_line_length=None, file_patterns=None, normalize=False,
+                 description=""):
+        self.name = name
+        self.factory = factory
+        self.priority = priority
+        self.max_lines = max_lines
+        self.max_line_length = max_line_length
+        self.file_patterns = file_patterns or []
+        self.normalize = normalize
+        self.description = description
+
+    def __repr__(self):
+        return "<DifferEngine %s>" % self.name
+
+    def matches_file(self, filename):
+        name = os.path.basename(filename or "")
+        for pattern in self.file_patterns:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def accepts(self, num_lines, line_length, normalize):
+        """
+        Returns whether the engine can diff files of num_lines lines in
+        total, averaging line_length characters, ignoring whitespace or
+        other differences if normalize is set.
+        """
+        if normalize and not self.normalize:
+            return False
+        if self.max_lines is not None and num_lines > self.max_lines:
+            return False
+        if self.max_line_length is not None and \
+           line_length > self.max_line_length:
+            return False
+        return True
+
+    def create(self, a, b, ignore_space=False, normalize=None):
+        if self.normalize:
+            return self.factory(a, b, ignore_space, normalize)
+        return self.factory(a, b)
+
+_differ_engines = {}
+
+def register_differ(engine):
+    """
+    Registers a DifferEngine, replacing any engine of the same name.
+    """
+    _differ_engines[engine.name] = engine
+
+def get_differ_engine(name):
+    try:
+        return _differ_engines[name]
+    except KeyError:
+        raise DiffCompatError("Unknown differ %r" % (name, ))
+
+def get_differ_engines():
+    """
+    Returns the registered engines, in the order they're tried.
+    """
+    engines = [e for e in _differ_engines.values() if e.priority is not None]
+    engines.sort(key=lambda e: -e.priority)
+    return engines
+
+# Setting SBSDIFF_DIFFER in the environment to the name of a registered
+# differ uses it for every file, bypassing select_differ().
+DIFFER_ENV_VAR = "SBSDIFF_DIFFER"
+
+DEFAULT_DIFFER = "myers"
+
+register_differ(DifferEngine(
+    "myers", MyersDiffer, priority=10, max_lines=100000,
+    max_line_length=500, normalize=True,
+    description="Myers O(ND) diff, as GNU diff"))
+register_differ(DifferEngine(
+    "patience", PatienceDiffer, priority=0,
+    file_patterns=["*.min.js", "*.min.css", "*.js.map", "*.css.map",
+                   "*.lock", "package-lock.json"],
+    description="O(n log n) unique line matching, for huge and generated "
+                "files"))
+register_differ(DifferEngine(
+    "sequencematcher", SMDiffer,
+    description="difflib.SequenceMatcher, diff compat version 0"))
+
+def select_differ(filename, a, b, ignore_space=False, normalize=None,
+                  size=None):
+    """
+    Returns the DifferEngine to diff the lines a and b of filename with: the
+    first engine matching the file's name, or else the first engine that
+    can handle its size, in priority order. Only engines supporting
+    normalization are picked when ignoring whitespace or normalizing lines.
+    The DIFFER_ENV_VAR environment variable overrides the choice.
+
+    size is the total size in bytes of both files, if known, which saves
+    measuring every line to get their average length.
+    """
+    name = os.environ.get(DIFFER_ENV_VAR)
+    if name:
+        return get_differ_engine(name)
+
+    normalize = ignore_space or normalize
+    engines = get_differ_engines()
+    for engine in engines:
+        if engine.matches_file(filename) and \
+           (engine.normalize or not normalize):
+            return engine
+
+    num_lines = len(a) + len(b)
+    line_length = 0
+    if num_lines:
+        if size is None:
+            size = sum(map(len, a)) + sum(map(len, b))
+        line_length = size / num_lines
+    for engine in engines:
+        if engine.accepts(num_lines, line_length, normalize):
+            return engine
+
+    return get_differ_engine(DEFAULT_DIFFER)
+
+
+# Granularities of the intraline diffs, see get_line_changed_regions().
+INTRALINE_CHARS = "chars"
+INTRALINE_TOKENS = "tokens"
+
+# Splits text into words, whitespace runs and punctuation runs.
+_word_re = re.compile(r"\w+|\s+|[^\w\s]+", re.U)
+_space_re = re.compile(r"\s", re.U)
+
+# Splits highlighted markup into text and tags, and matches the character
+# references of the text.
+_tag_re = re.compile(r"(<[^>]*>)")
+_entity_re = re.compile(r"&[^;]*;")
+
+def get_line_tokens(line, markup=None):
+    """
+    Returns the offsets at which the tokens of line start, followed by
+    len(line). When given the line's markup as highlighted by pygments, the
+    tokens are the lexer's (identifiers, literals, operators, ...), as
+    delimited by the markup's spans, and the ones holding whitespace
+    (strings, comments, ...) are split into words, whitespace runs and
+    punctuation runs. Otherwise, or if the markup doesn't match the line,
+    the whole line is split that way.
+    """
+    offsets = []
+    if markup:
+        pos = 0
+        in_span = False
+        pieces = _tag_re.split(markup)
+        for i in xrange(len(pieces)):
+            piece = pieces[i]
+            if i % 2:
+                in_span = piece.startswith("<span")
+                continue
+            if not piece:
+                continue
+            if "&" in piece:
+                # Every reference stands for one punctuation character.
+                piece = _entity_re.sub("&", piece)
+            if in_span and (piece.isspace() or
+                            not _space_re.search(piece)):
+                offsets.append(pos)
+            else:
+                offsets.extend([pos + m.start()
+                                for m in _word_re.finditer(piece)])
+            pos += len(piece)
+        if pos != len(line):
+            offsets = []
+    if not offsets and line:
+        offsets = [m.start() for m in _word_re.finditer(line)]
+    offsets.append(len(line))
+    return offsets
+
+def get_line_changed_regions(oldline, newline, granularity=INTRALINE_CHARS,
+                             oldmarkup=None, newmarkup=None):
+    """
+    Returns the lists of (start, end) character ranges of oldline and
+    newline that changed, or (None, None) when most of the line changed.
+
+    The lines are compared character by character, or token by token with
+    the INTRALINE_TOKENS granularity (see get_line_tokens(), which takes the
+    tokens from the lines' highlighted markup when given). This aligns the
+    regions to the tokens and makes the comparison of long lines cheaper.
+    """
     if oldline is None or newline is None:
         return (None, None)
 
-    # Use the SequenceMatcher directly. It seems to give us better results
-    # for this. We should investigate steps to move to the new differ.
-    differ = SequenceMatcher(None, oldline, newline)
+    if granularity == INTRALINE_TOKENS:
+        old_offsets = get_line_tokens(oldline, oldmarkup)
+        new_offsets = get_line_tokens(newline, newmarkup)
+        differ = SequenceMatcher(None,
+            [oldline[old_offsets[i]:old_offsets[i + 1]]
+             for i in xrange(len(old_offsets) - 1)],
+            [newline[new_offsets[j]:new_offsets[j + 1]]
+             for j in xrange(len(new_offsets) - 1)])
+    else:
+        old_offsets = new_offsets = None
+
+        # Use the SequenceMatcher directly. It seems to give us better
+        # results for this. We should investigate steps to move to the new
+        # differ.
+        differ = SequenceMatcher(None, oldline, newline)
 
     # This thresholds our results -- we don't want to show inter-line diffs if
     # most of the line has changed, unless those lines are very short.
@@ -140,6 +686,11 @@ def get_line_changed_regions(oldline, newline):
     back = (0, 0)
 
     for tag, i1, i2, j1, j2 in differ.get_opcodes():
+        if old_offsets is not None:
+            # Token indexes to character offsets.
+            i1, i2 = old_offsets[i1], old_offsets[i2]
+            j1, j2 = new_offsets[j1], new_offsets[j2]
+
         if tag == "equal":
             if (i2 - i1 < 3) or (j2 - j1 < 3):
                 back = (j2 - j1, i2 - i1)
@@ -164,9 +715,11 @@ def get_line_changed_regions(oldline, newline):
 
 
 def diff_line(vlinenum, oldlinenum, newlinenum, oldline, newline,
-              oldmarkup, newmarkup):
+              oldmarkup, newmarkup, granularity=INTRALINE_CHARS):
     if oldline and newline and oldline != newline:
-        oldregion, newregion = get_line_changed_regions(oldline, newline)
+        oldregion, newregion = get_line_changed_regions(oldline, newline,
+                                                        granularity,
+                                                        oldmarkup, newmarkup)
     else:
         oldregion = newregion = []
 
@@ -192,13 +745,17 @@ class DifferFromFileDiffItem:
         self.diffitem = diffitem
         self._left_contents = None
         self._right_contents = None
+        self._hunk_ranges = None
         self._opcodes = None
 
     def _set_contents(self):
         opcodes = []
         self._left_contents = []
         self._right_contents = []
+        self._hunk_ranges = []
         for hunk in self.diffitem.hunks:
+            left_start = len(self._left_contents)
+            right_start = len(self._right_contents)
             left_lines = []
             right_lines = []
             last_tag = None
@@ -261,6 +818,9 @@ class DifferFromFileDiffItem:
                                right_no, right_no+len(right_lines)))
             self._left_contents += left_lines
             self._right_contents += right_lines
+            self._hunk_ranges.append((left_start, len(self._left_contents),
+                                      right_start,
+                                      len(self._right_contents)))
         self._opcodes = opcodes
 
     @property
@@ -275,11 +835,21 @@ class DifferFromFileDiffItem:
             self._set_contents()
         return self._right_contents
 
+    @property
+    def hunk_ranges(self):
+        """
+        The (left start, left end, right start, right end) ranges of the
+        lines of every hunk in left_contents and right_contents.
+        """
+        if self._hunk_ranges is None:
+            self._set_contents()
+        return self._hunk_ranges
+
     def get_opcodes(self):
         for opcode in self._opcodes:
             yield opcode
 
-def apply_pygments(data, filename):
+def get_lexer(filename):
     # XXX Guessing is preferable but really slow, especially on XML
     #     files.
     #if filename.endswith(".xml"):
@@ -293,7 +863,71 @@ def apply_pygments(data, filename):
     except AttributeError:
         pass
 
-    return pygments.highlight(data, lexer, HtmlFormatter()).splitlines()
+    return lexer
+
+def apply_pygments(data, filename):
+    return get_highlight_cache().highlight(data, get_lexer(filename),
+                                           HtmlFormatter())
+
+def apply_pygments_to_fragments(lines, fragments, filename,
+                                stack=('root',)):
+    """
+    Returns the markup of lines, highlighting each (start, end) fragment of
+    them (e.g. the lines of a hunk) on its own. The text preceding a
+    fragment isn't known, so its lexing starts from a guessed state stack,
+    the lexer's initial state unless another one is given. Lines outside of
+    the fragments are only escaped.
+    """
+    lexer = get_lexer(filename)
+    if not isinstance(lexer, RegexLexer) or not lexer.is_resumable():
+        # Such lexers always start from their initial state.
+        stack = None
+    formatter = HtmlFormatter(nowrap=True)
+    cache = get_highlight_cache()
+    markup = list(escape_lines(lines))
+
+    for start, end in fragments:
+        if start >= end:
+            continue
+        text = "\n".join(lines[start:end]) + "\n"
+        fragment_markup = cache.highlight(text, lexer, formatter, stack)
+        # The lexer drops trailing empty lines.
+        missing = lines[start + len(fragment_markup):end]
+        if not [line for line in missing if line]:
+            fragment_markup += [u''] * len(missing)
+        # Lines split differently by the lexer (on form feeds, ...) are
+        # left unhighlighted.
+        if len(fragment_markup) == end - start:
+            markup[start:end] = fragment_markup
+
+    return markup
+
+
+def get_interdiffer(filediff, interfilediff, ignore_space=False,
+                    normalize=None):
+    """
+    Returns an InterDiffer composing the hunks of two DiffItems against the
+    same original file, or None if they can't be composed exactly and both
+    files need patching.
+    """
+    # Patches have no original file, it's the patched file reversed. The
+    # originals of two patches of the same file then agree outside of their
+    # hunks, and InterDiffer checks the hunks against the original.
+    if filediff.source_file != interfilediff.source_file or \
+       filediff.dest_file != interfilediff.dest_file:
+        return None
+
+    orig = filediff.get_original_file()
+    if orig is None:
+        return None
+
+    try:
+        return InterDiffer(TextLines(orig), filediff.diff or "",
+                           interfilediff.diff or "", ignore_space, normalize)
+    except InterdiffError, e:
+        logging.debug("Patching files for interdiff ids %s-%s: %s",
+                      filediff.id, interfilediff.id, e)
+        return None
 
 
 def get_chunks(filediff, interfilediff, force_interdiff,
@@ -334,37 +968,38 @@ def get_chunks(filediff, interfilediff, force_interdiff,
 
     assert filediff
 
+    stats = filediff.stats
     ignore_space = False
 
     if filediff.file_on_disk:
-        old = filediff.get_original_file()
-        
-        new = filediff.get_patched_file()
+        interdiffer = None
         if interfilediff:
-            old = new
-            interdiff_orig = get_original_file(interfilediff)
-            new = get_patched_file(interdiff_orig, interfilediff)
-        elif force_interdiff:
-            # Basically, revert the change.
-            temp = old
-            old = new
-            new = temp
-    
-        # Normalize the input so that if there isn't a trailing newline, we add
-        # it.
-        if old and old[-1] != '\n':
-            old += '\n'
-    
-        if new and new[-1] != '\n':
-            new += '\n'
-    
-        a = re.split(r"\r?\n", old or '')
-        b = re.split(r"\r?\n", new or '')
-    
-        # Remove the trailing newline, now that we've split this. This will
-        # prevent a duplicate line number at the end of the diff.
-        del(a[-1])
-        del(b[-1])
+            # Both diffs' hunks are composed, unless that's ambiguous.
+            interdiffer = stats.timed("interdiff", get_interdiffer, filediff,
+                                      interfilediff, ignore_space,
+                                      filediff.normalize)
+
+        if interdiffer is not None:
+            old, new = interdiffer.old, interdiffer.new
+            a, b = interdiffer.a, interdiffer.b
+        else:
+            old = filediff.get_original_file()
+
+            new = filediff.get_patched_file()
+            if interfilediff:
+                old = new
+                new = interfilediff.get_patched_file()
+            elif force_interdiff:
+                # Basically, revert the change.
+                temp = old
+                old = new
+                new = temp
+
+            # The files may be memory-mapped, they're split without being
+            # copied. A missing trailing newline doesn't make for an extra
+            # line.
+            a = TextLines(old or '')
+            b = TextLines(new or '')
     
         a_num_lines = len(a)
         b_num_lines = len(b)
@@ -375,8 +1010,10 @@ def get_chunks(filediff, interfilediff, force_interdiff,
             try:
                 # TODO: Try to figure out the right lexer for these files
                 #       once instead of twice.
-                markup_a = apply_pygments(old or '', filediff.source_file or filediff.dest_file)
-                markup_b = apply_pygments(new or '', filediff.dest_file or filediff.source_file)
+                markup_a = stats.timed("highlight", apply_pygments, old or '',
+                                       filediff.source_file or filediff.dest_file)
+                markup_b = stats.timed("highlight", apply_pygments, new or '',
+                                       filediff.dest_file or filediff.source_file)
             except ValueError, ex:
                 import warnings
                 warnings.warn("apply_pygments failed: %r" % (ex, ))
@@ -384,13 +1021,22 @@ def get_chunks(filediff, interfilediff, force_interdiff,
     
         # If no highlighting, no pygments, or there was a pygments error (i.e. no lexer)
         if not markup_a:
-            markup_a = re.split(r"\r?\n", escape(old))
+            markup_a = escape_lines(a)
         if not markup_b:
-            markup_b = re.split(r"\r?\n", escape(new))
+            markup_b = escape_lines(b)
     
         #siteconfig = SiteConfiguration.objects.get_current()
 
-        differ = Differ(a, b, ignore_space=ignore_space)
+        if interdiffer is not None:
+            filediff.differ_name = "interdiff"
+            differ = interdiffer
+        else:
+            engine = select_differ(filediff.dest_file or filediff.source_file,
+                                   a, b, ignore_space, filediff.normalize,
+                                   len(old or '') + len(new or ''))
+            filediff.differ_name = engine.name
+            differ = engine.create(a, b, ignore_space=ignore_space,
+                                   normalize=filediff.normalize)
     
         if interfilediff:
             logging.debug("Generating diff chunks for interdiff ids %s-%s",
@@ -399,11 +1045,35 @@ def get_chunks(filediff, interfilediff, force_interdiff,
             logging.debug("Generating diff chunks for filediff id %s", filediff.id)
 
     else:
+        # Only the hunks are known, they're highlighted one by one.
         differ = DifferFromFileDiffItem(filediff)
+        filediff.differ_name = "hunks"
         a = differ.left_contents
         b = differ.right_contents
-        markup_a = [ escape(x) for x in a ]
-        markup_b = [ escape(x) for x in b ]
+        markup_a = markup_b = None
+
+        if enable_syntax_highlighting and _have_pygments:
+            hunk_ranges = differ.hunk_ranges
+            try:
+                markup_a = stats.timed("highlight",
+                                       apply_pygments_to_fragments, a,
+                                       [r[0:2] for r in hunk_ranges],
+                                       filediff.source_file or
+                                       filediff.dest_file)
+                markup_b = stats.timed("highlight",
+                                       apply_pygments_to_fragments, b,
+                                       [r[2:4] for r in hunk_ranges],
+                                       filediff.dest_file or
+                                       filediff.source_file)
+            except ValueError, ex:
+                import warnings
+                warnings.warn("apply_pygments failed: %r" % (ex, ))
+                markup_a = markup_b = None
+
+        if markup_a is None:
+            markup_a = escape_lines(a)
+        if markup_b is None:
+            markup_b = escape_lines(b)
 
     chunks = []
     linenum = 1
@@ -411,15 +1081,32 @@ def get_chunks(filediff, interfilediff, force_interdiff,
     context_num_lines = 11
     collapse_threshold = 2 * context_num_lines + 3
 
-    for tag, i1, i2, j1, j2 in differ.get_opcodes():
+    moved_to = moved_from = {}
+
+    if filediff.detect_moves and isinstance(differ, MyersDiffer):
+        opcodes = stats.timed("diff", list, differ.get_opcodes_with_moves())
+        stats.incr("moves", len(differ.moves))
+        moved_to = dict([(m[0], m[2]) for m in differ.moves])
+        moved_from = dict([(m[2], m[0]) for m in differ.moves])
+    else:
+        opcodes = stats.timed("diff", list, differ.get_opcodes())
+    stats.incr("lines", len(a) + len(b))
+    stats.incr("opcodes", len(opcodes))
+
+    granularity = filediff.intraline or INTRALINE_CHARS
+
+    def diff_file_line(*args):
+        return diff_line(granularity=granularity, *args)
+
+    for tag, i1, i2, j1, j2 in opcodes:
         oldlines = markup_a[i1:i2]
         newlines = markup_b[j1:j2]
         numlines = max(len(oldlines), len(newlines))
 
-        lines = map(diff_line,
-                    xrange(linenum, linenum + numlines),
-                    xrange(i1 + 1, i2 + 1), xrange(j1 + 1, j2 + 1),
-                    a[i1:i2], b[j1:j2], oldlines, newlines)
+        lines = stats.timed("intraline", map, diff_file_line,
+                            xrange(linenum, linenum + numlines),
+                            xrange(i1 + 1, i2 + 1), xrange(j1 + 1, j2 + 1),
+                            a[i1:i2], b[j1:j2], oldlines, newlines)
         linenum += numlines
 
         if tag == 'equal' and numlines > collapse_threshold:
@@ -437,6 +1124,16 @@ def get_chunks(filediff, interfilediff, force_interdiff,
                     add_ranged_chunks(chunks, lines, context_num_lines,
                                       last_range_start, True)
                     add_ranged_chunks(chunks, lines, last_range_start, numlines)
+        elif tag == 'move':
+            # Moved lines aren't intraline diffed, the chunk points to the
+            # line where they moved to or from instead. They're collapsed
+            # like unchanged lines, as the lines themselves didn't change.
+            chunk = new_chunk(lines, numlines, tag, True)
+            if i1 < i2:
+                chunk['moved_to'] = moved_to[i1] + 1
+            else:
+                chunk['moved_from'] = moved_from[j1] + 1
+            chunks.append(chunk)
         else:
             chunks.append(new_chunk(lines, numlines, tag))
 
@@ -450,13 +1147,285 @@ def get_chunks(filediff, interfilediff, force_interdiff,
     return chunks
 
 
+def parallel_map(func, items, workers=4):
+    """
+    Returns an iterator over func(item) for each of items, in order,
+    computed by a pool of worker threads that start right away and run
+    ahead of the caller. Exceptions raised by func are raised again when
+    their result is reached.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return (func(item) for item in items)
+
+    pending = Queue.Queue()
+    for i in xrange(len(items)):
+        pending.put(i)
+    results = {}
+    done = threading.Condition()
+    threads = []
+
+    def work():
+        while True:
+            try:
+                i = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result = (True, func(items[i]))
+            except Exception, ex:
+                result = (False, ex)
+            done.acquire()
+            try:
+                results[i] = result
+                done.notifyAll()
+            finally:
+                done.release()
+
+    for n in xrange(min(workers, len(items))):
+        thread = threading.Thread(target=work)
+        thread.start()
+        threads.append(thread)
+
+    return ParallelResults(len(items), results, done, pending, threads)
+
+
+class ParallelResults(object):
+    """
+    Iterator over the results of parallel_map(), in order. The workers are
+    stopped once it's exhausted, closed or let go of, so a caller giving up
+    early doesn't leave them running.
+    """
+    def __init__(self, count, results, done, pending, threads):
+        self.count = count
+        self.results = results
+        self.done = done
+        self.pending = pending
+        self.threads = threads
+        self.index = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.index == self.count:
+            self.close()
+            raise StopIteration
+        i = self.index
+        self.done.acquire()
+        try:
+            while i not in self.results:
+                self.done.wait()
+            ok, result = self.results.pop(i)
+        finally:
+            self.done.release()
+        self.index += 1
+        if not ok:
+            self.close()
+            raise result
+        return result
+
+    def close(self):
+        try:
+            while True:
+                self.pending.get_nowait()
+        except Queue.Empty:
+            pass
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    __del__ = close
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """
+    Returns the SHA-1 digest of the contents of the file at path.
+    """
+    digest = sha1()
+    f = open(path, "rb")
+    try:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    finally:
+        f.close()
+    return digest.digest()
+
+
+class TreeFileDiff(object):
+    """
+    A file that differs between the two trees of a TreeComparison, standing
+    in for the file diffs of a patch. It has no diff or hunks, both of its
+    sides are read from the disk, and one of its URIs is "" when it only
+    exists in one tree.
+    """
+    diff = ""
+
+    def __init__(self, path, left_uri, right_uri):
+        self.paths = {"a": path, "b": path}
+        self.hunks = []
+        self.left_uri = left_uri
+        self.right_uri = right_uri
+
+    def best_path(self, cwd=None):
+        return self.right_uri
+
+
+class TreeComparison(object):
+    """
+    A comparison of two directory trees, which SideBySideDiff renders like
+    the koIDiff of a patch. compare() walks both trees and streams a
+    TreeFileDiff for every file that was added, removed or changed, which
+    are also collected in file_diffs.
+
+    Files are assumed identical when their size and modification time
+    match, and changed when their size doesn't. The others are told apart
+    by hashing their contents, in a pool of worker threads, so comparing
+    large trees is mostly bound by the disk.
+    """
+    # Names of files and directories left out of comparisons.
+    DEFAULT_IGNORE = [".git", ".hg", ".svn", ".bzr", "CVS", "*.pyc", "*.pyo"]
+
+    # Number of files hashed by a worker thread at a time.
+    HASH_BATCH_SIZE = 16
+
+    def __init__(self, left_dir, right_dir, ignore=None, workers=4):
+        self.left_dir = left_dir
+        self.right_dir = right_dir
+        if ignore is None:
+            ignore = self.DEFAULT_IGNORE
+        self.ignore = ignore
+        self.workers = workers
+        self.file_diffs = []
+        self.counters = {}
+
+        # SideBySideDiff reads the file diffs from koIDiff.diffex.
+        self.diffex = self
+
+    def _incr(self, name, count=1):
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def _is_ignored(self, name):
+        for pattern in self.ignore:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def _list_files(self, top):
+        """
+        Returns a dict of the (size, mtime) of the files under top, by path
+        relative to top, using "/" as the separator.
+        """
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not self._is_ignored(d)]
+            reldir = dirpath[len(top):].strip(os.sep)
+            if reldir:
+                reldir = reldir.replace(os.sep, "/") + "/"
+            for name in filenames:
+                if self._is_ignored(name):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    # e.g. a dangling symlink.
+                    continue
+                files[reldir + name] = (st.st_size, int(st.st_mtime))
+        return files
+
+    def _local_path(self, top, path):
+        return os.path.join(top, *path.split("/"))
+
+    def _contents_differ(self, paths):
+        """
+        Returns whether the contents of each of paths differ between the
+        trees.
+        """
+        return [hash_file(self._local_path(self.left_dir, path)) !=
+                hash_file(self._local_path(self.right_dir, path))
+                for path in paths]
+
+    def _hash_in_parallel(self, paths):
+        """
+        Returns an iterator over whether the contents of each of paths
+        differ, hashed by the worker threads in batches, which keeps their
+        synchronization cheap next to hashing small files.
+        """
+        batches = [paths[i:i + self.HASH_BATCH_SIZE]
+                   for i in xrange(0, len(paths), self.HASH_BATCH_SIZE)]
+        for results in parallel_map(self._contents_differ, batches,
+                                    self.workers):
+            for result in results:
+                yield result
+
+    def compare(self):
+        """
+        Generator returning the TreeFileDiff of every file differing
+        between the trees, by path.
+        """
+        self.file_diffs = []
+        self.counters = {}
+        left = self._list_files(self.left_dir)
+        right = self._list_files(self.right_dir)
+
+        paths = sorted(set(left) | set(right))
+        to_hash = [path for path in paths
+                   if left.get(path) and right.get(path) and
+                      left[path][0] == right[path][0] and
+                      left[path][1] != right[path][1]]
+        hashed = self._hash_in_parallel(to_hash)
+        self._incr("files", len(paths))
+
+        for path in paths:
+            if path in left and path in right:
+                if left[path] == right[path]:
+                    self._incr("same_stat")
+                    continue
+                if left[path][0] == right[path][0]:
+                    self._incr("hashed")
+                    if not hashed.next():
+                        self._incr("same_hash")
+                        continue
+
+            left_uri = right_uri = ""
+            if path in left:
+                left_uri = localPathToURI(self._local_path(self.left_dir,
+                                                           path))
+            if path in right:
+                right_uri = localPathToURI(self._local_path(self.right_dir,
+                                                            path))
+            file_diff = TreeFileDiff(path, left_uri, right_uri)
+            self.file_diffs.append(file_diff)
+            self._incr("differ")
+            yield file_diff
+
+        logging.debug("Compared %s to %s: %r", self.left_dir,
+                      self.right_dir, self.counters)
+
+
 class DiffItem(object):
-    def __init__(self, id, filediffex, cwd=None, hl_enabled=True, file_on_disk=True):
+    def __init__(self, id, filediffex, cwd=None, hl_enabled=True, file_on_disk=True,
+                 normalize=None, intraline=None, detect_moves=True):
         self.id = id
         self.filediffex = filediffex
         self.cwd = cwd
         self.enable_syntax_highlighting = hl_enabled
         self.file_on_disk = file_on_disk
+        # Line normalization modes used when diffing full files, see
+        # MyersDiffer.NORMALIZERS.
+        self.normalize = normalize
+        # Granularity of the intraline diffs, INTRALINE_CHARS (the default)
+        # or INTRALINE_TOKENS.
+        self.intraline = intraline
+        # Whether blocks of lines moved within the file are shown as "move"
+        # chunks, see MyersDiffer.get_opcodes_with_moves().
+        self.detect_moves = detect_moves
+        # Name of the registered differ get_chunks() picked, see
+        # select_differ().
+        self.differ_name = None
 
         self._left_file_uri = None
         self._left_contents = None
@@ -464,6 +1433,8 @@ class DiffItem(object):
         self._right_contents = None
         self.source_revision = ""
         self.dest_revision = ""
+        self._binary = None
+        self.stats = DiffStats()
 
         self.chunks = None
         self.changed_chunks = []
@@ -509,9 +1480,74 @@ class DiffItem(object):
     def diff(self):
         return self.filediffex.diff
 
+    @property
+    def binary(self):
+        if self._binary is None:
+            self._binary = self._detect_binary()
+        return self._binary
+
+    def _detect_binary(self):
+        """
+        Cheaply decide whether this is a binary file, looking only at the
+        diff text and the first few KB of each side, so that binary files
+        are never read in full, split, diffed or highlighted.
+        """
+        if is_binary_diff(self.diff):
+            return True
+        if not self.file_on_disk:
+            return False
+        for contents, uri in ((self._right_contents, self.right_file_uri),
+                              (self._left_contents, self.left_file_uri)):
+            if contents is not None:
+                block = contents[:BINARY_SNIFF_SIZE]
+            elif uri:
+                block = self._read_file_head(uri)
+            else:
+                continue
+            if is_binary_data(block):
+                return True
+        return False
+
+    def _read_file_head(self, uri, size=BINARY_SNIFF_SIZE):
+        path = None
+        if uri.startswith("file://"):
+            path = URIToPath(uri)
+        if path and os.path.isfile(path):
+            start = time.time()
+            f = open(path, "rb")
+            try:
+                data = f.read(size)
+            finally:
+                f.close()
+            self.stats.add_time("read", time.time() - start)
+            self.stats.incr("bytes_read", len(data))
+            return data
+
+        from xpcom import components
+        koFileEx = components.classes["@activestate.com/koFileEx;1"] \
+                      .createInstance(components.interfaces.koIFileEx)
+        koFileEx.URI = uri
+        if not koFileEx.exists:
+            return None
+        start = time.time()
+        koFileEx.open('rb')
+        try:
+            data = koFileEx.read(size)
+        finally:
+            koFileEx.close()
+        self.stats.add_time("read", time.time() - start)
+        self.stats.incr("bytes_read", len(data))
+        return data
+
     @property
     def left_file_uri(self):
-        return ""
+        if self._left_file_uri is None:
+            # Only tree comparisons give the original file, patches are
+            # reversed to get it.
+            self._left_file_uri = ""
+            if isinstance(self.filediffex, TreeFileDiff):
+                self._left_file_uri = self.filediffex.left_uri
+        return self._left_file_uri
 
     @property
     def right_file_uri(self):
@@ -562,24 +1598,63 @@ class DiffItem(object):
             if reversed:
                 argv.insert(1, "--reverse")
             PIPE = subprocess.PIPE
+            start = time.time()
             p = subprocess.Popen(argv, stdin=PIPE, stdout=PIPE, stderr=PIPE)
             stdout, stderr = p.communicate(diff)
+            self.stats.add_time("patch", time.time() - start)
+            self.stats.incr("patch_invocations")
             if p.returncode == 0:
                 result = file(tfname, "rb").read()
         finally:
             os.remove(tfname)
         return result
 
+    def _read_file(self, uri):
+        """
+        Returns the contents of the file at uri. Large local files are
+        memory mapped rather than read, see map_file().
+        """
+        start = time.time()
+        contents = None
+        if uri.startswith("file://"):
+            path = URIToPath(uri)
+            if os.path.isfile(path):
+                try:
+                    contents = map_file(path)
+                except EnvironmentError:
+                    # e.g. out of address space, read it instead.
+                    pass
+        if isinstance(contents, mmap.mmap):
+            self.stats.incr("bytes_mapped", len(contents))
+        elif contents is not None:
+            self.stats.incr("bytes_read", len(contents))
+        else:
+            from xpcom import components
+            koFileEx = components.classes["@activestate.com/koFileEx;1"] \
+                          .createInstance(components.interfaces.koIFileEx)
+            koFileEx.URI = uri
+            koFileEx.open('rb')
+            contents = koFileEx.readfile()
+            koFileEx.close()
+            self.stats.incr("bytes_read", len(contents))
+        self.stats.add_time("read", time.time() - start)
+        return contents
+
+    def _release_contents(self):
+        """
+        Unmaps the memory-mapped files, which keeps them from being locked
+        (on Windows) for as long as this item lives.
+        """
+        for name in ("_left_contents", "_right_contents"):
+            contents = getattr(self, name)
+            if isinstance(contents, mmap.mmap):
+                contents.close()
+                setattr(self, name, None)
+
     def get_original_file(self, allow_patching=True):
-        from xpcom import components
         if self._left_contents is None:
             if self.left_file_uri:
-                koFileEx = components.classes["@activestate.com/koFileEx;1"] \
-                              .createInstance(components.interfaces.koIFileEx)
-                koFileEx.URI = self.left_file_uri
-                koFileEx.open('rb')
-                self._left_contents = koFileEx.readfile()
-                koFileEx.close()
+                self._left_contents = self._read_file(self.left_file_uri)
             elif allow_patching and self.diff and (self._right_contents or self.right_file_uri):
                 right_contents = self.get_patched_file(allow_patching=False)
                 if right_contents is not None:
@@ -588,15 +1663,9 @@ class DiffItem(object):
         return self._left_contents
 
     def get_patched_file(self, allow_patching=True):
-        from xpcom import components
         if self._right_contents is None:
             if self.right_file_uri:
-                koFileEx = components.classes["@activestate.com/koFileEx;1"] \
-                              .createInstance(components.interfaces.koIFileEx)
-                koFileEx.URI = self.right_file_uri
-                koFileEx.open('rb')
-                self._right_contents = koFileEx.readfile()
-                koFileEx.close()
+                self._right_contents = self._read_file(self.right_file_uri)
             elif allow_patching and self.diff and (self._left_contents or self.left_file_uri):
                 left_contents = self.get_original_file(allow_patching=False)
                 if left_contents is not None:
@@ -605,7 +1674,20 @@ class DiffItem(object):
         return self._right_contents
 
     def load_chunks(self):
-        chunks = get_chunks(self, None, 0, self.enable_syntax_highlighting)
+        if self.binary:
+            # The template renders a placeholder for binary files.
+            self.chunks = []
+            self.has_changes = True
+            self.changed_chunks = []
+            self.num_changed_lines = 0
+            self.num_changes = 0
+            return
+        try:
+            chunks = get_chunks(self, None, 0,
+                                self.enable_syntax_highlighting)
+        finally:
+            self._release_contents()
+        self.stats.incr("chunks", len(chunks))
         self.chunks = chunks
         self.has_changes = False
         self.changed_chunks = []
@@ -629,50 +1711,160 @@ class DiffItem(object):
 </head>
 
 """
-        html += render_to_string('diffviewer/diff_file_fragment.html',
-                                { 'file': self,
-                                  'collapseall': True })
+        html += self.stats.timed("render", render_to_string,
+                                 'diffviewer/diff_file_fragment.html',
+                                 { 'file': self,
+                                   'collapseall': True })
         return html
 
 
 
 class SideBySideDiff(object):
-    def __init__(self, koIDiff, cwd=None, hl_enabled=True):
+    def __init__(self, koIDiff, cwd=None, hl_enabled=True,
+                 stats_footer=False, normalize=None, intraline=None):
         self.koIDiff = koIDiff
         self.cwd = cwd
         self.hl_enabled = hl_enabled
+        self.stats_footer = stats_footer
+        self.normalize = normalize
+        self.intraline = intraline
+        self.diffitems = []
+        self.total_time = 0.0
+        self.profile_report = None
+
+    def stats_json(self):
+        """
+        Returns the per-file and overall timings/counters of the last
+        toHTML() call as a JSON string.
+        """
+        files = []
+        total = DiffStats()
+        for d in self.diffitems:
+            info = d.stats.as_dict()
+            info['id'] = d.id
+            info['path'] = d.dest_file or d.source_file
+            info['binary'] = d.binary
+            files.append(info)
+            total.merge(d.stats)
+        total = total.as_dict()
+        total['elapsed'] = round(self.total_time, 6)
+        return simplejson.dumps({'files': files, 'total': total})
+
+    def get_file_diff(self, chunk_id):
+        """
+        Returns the index and file diff of the file a chunk id of the HTML
+        ("chunk.<file number>.<chunk number>") belongs to, or (-1, None).
+        """
+        sp = chunk_id.split(".")
+        if len(sp) == 3:
+            try:
+                file_pos = int(sp[1]) - 1
+            except ValueError:
+                return -1, None
+            file_diffs = self.koIDiff.diffex.file_diffs
+            if file_pos >= 0 and file_pos < len(file_diffs):
+                return file_pos, file_diffs[file_pos]
+        return -1, None
+
+    def get_filepath(self, chunk_id):
+        """
+        Returns the path of the file a chunk id belongs to, or None.
+        """
+        file_pos, fd = self.get_file_diff(chunk_id)
+        if fd is None:
+            return None
+        return fd.best_path(self.cwd)
+
+    def get_diff_lineno(self, chunk_id):
+        """
+        Returns the line of the file a chunk id belongs to that the diff
+        starts changing, or -1 if it isn't known. Files of tree comparisons
+        have no hunks, the line of their first changed chunk is used.
+        """
+        file_pos, fd = self.get_file_diff(chunk_id)
+        if fd is None:
+            return -1
+
+        if fd.hunks:
+            diffex = self.koIDiff.diffex
+            if not hasattr(diffex, "file_pos_from_diff_pos"):
+                return -1
+            return diffex.file_pos_from_diff_pos(fd.hunks[0].start_line, 0)[1]
+
+        if file_pos < len(self.diffitems):
+            changed = False
+            for chunk in self.diffitems[file_pos].chunks or []:
+                changed = changed or chunk['change'] != 'equal'
+                if changed:
+                    for line in chunk['lines']:
+                        if line[4]:
+                            return line[4]
+        return -1
 
     def toHTML(self):
+        """
+        Returns the HTML of the whole diff. See PROFILE_ENV_VAR for profiling
+        this call, the report of the last profiled call is then kept in
+        profile_report.
+        """
+        profiler = get_profiler()
+        if profiler is None:
+            return self._toHTML()
+        html, stats = profiler.runcall("SideBySideDiff.toHTML", self._toHTML)
+        self.profile_report = format_stats(stats)
+        logging.debug("SideBySideDiff.toHTML profile:\n%s", self.profile_report)
+        return html
+
+    def _toHTML(self):
+        start = time.time()
         cwd = self.cwd
         file_on_disk = ((cwd and True) or False)
+        self.diffitems = []
         file_count = 1
         html_pieces = ['<div id="diff-details"><p><label>Files Changed:</label></p>', "<ol>"]
         file_pieces = []
-        for filediffex in self.koIDiff.diffex.file_diffs:
-            # Add the index.
+        diffex = self.koIDiff.diffex
+        if isinstance(diffex, TreeComparison):
+            # The files are diffed as the trees are compared.
+            file_diffs = diffex.compare()
+        else:
+            file_diffs = diffex.file_diffs
+        for filediffex in file_diffs:
+            # Add the diff.
+            d = DiffItem("%s" % (file_count), filediffex, cwd=cwd,
+                         hl_enabled=self.hl_enabled,
+                         file_on_disk=file_on_disk,
+                         normalize=self.normalize,
+                         intraline=self.intraline)
+            self.diffitems.append(d)
+            d.load_chunks()
+            #print d
+            file_pieces.append(d.toHTML())
+
+            # Add the index. Files of tree comparisons have no hunks, their
+            # changed chunks are counted instead.
             shortest_path = None
             for key, path in filediffex.paths.items():
                 if path and (shortest_path is None or len(path) < len(shortest_path)):
                     shortest_path = path
+            num_changes = len(filediffex.hunks) or d.num_changes
             html_pieces.append('  <li><a href="#file.%d">%s</a>: %s change%s [' % (
                                file_count, escape(shortest_path),
-                               len(filediffex.hunks),
-                               len(filediffex.hunks) > 1 and "s" or ""))
+                               num_changes,
+                               num_changes > 1 and "s" or ""))
             hunk_count = 1
             for hunk in filediffex.hunks:
                 html_pieces.append('    <a href="#chunk.%d.%d" >%d</a>' % (
                                     file_count, hunk_count, hunk_count))
                 hunk_count += 1
             html_pieces.append("]\n  </li>")
-
-            # Add the diff.
-            d = DiffItem("%s" % (file_count), filediffex, cwd=cwd,
-                         hl_enabled=self.hl_enabled,
-                         file_on_disk=file_on_disk)
             file_count += 1
-            d.load_chunks()
-            #print d
-            file_pieces.append(d.toHTML())
         html_pieces.append("</div>")
         html_pieces += file_pieces
+        self.total_time = time.time() - start
+        if self.stats_footer:
+            # "--" is not allowed inside an HTML comment, escape it so the
+            # comment still holds valid JSON.
+            html_pieces.append("<!-- sbsdiff-stats %s -->" %
+                               (self.stats_json().replace("--", "-\\u002d"), ))
         return "\n\n".join(html_pieces)
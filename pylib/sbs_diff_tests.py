@@ -0,0 +1,446 @@
+
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+# 
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+# 
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+# License for the specific language governing rights and limitations
+# under the License.
+# 
+# The Original Code is "side by side diff" code.
+# 
+# The Initial Developer of the Original Code is ActiveState Software Inc.
+# Portions created by ActiveState Software Inc are Copyright (C) 2008-2009
+# ActiveState Software Inc. All Rights Reserved.
+# 
+# Contributor(s):
+#   Todd Whiteman @ ActiveState Software Inc
+# 
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+# 
+# ***** END LICENSE BLOCK *****
+
+
+
+#
+# Overview:
+#   Unit tests for sbs_diff_helper. Like sbs_diff_benchmark.py, they run
+#   outside of Komodo (no XPCOM).
+#
+# Usage:
+#   python sbs_diff_tests.py
+#
+
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+pylib_dir = os.path.dirname(os.path.abspath(__file__))
+for path in (pylib_dir, os.path.join(pylib_dir, "reviewboard")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+import sbs_diff_helper
+
+
+class BinaryDataTest(unittest.TestCase):
+    def testIsBinaryData(self):
+        """Testing binary data detection"""
+        is_binary_data = sbs_diff_helper.is_binary_data
+        self.failIf(is_binary_data(""))
+        self.failIf(is_binary_data("def foo():\n\treturn 1\r\n"))
+        self.failIf(is_binary_data("caf\xc3\xa9\n"))
+        self.failUnless(is_binary_data("GIF89a\0\1"))
+        self.failUnless(is_binary_data("\x01\x02\x03\x04text"))
+
+
+class EscapeLinesTest(unittest.TestCase):
+    def testEscapeLines(self):
+        """Testing lazily escaped lines"""
+        escape_lines = sbs_diff_helper.escape_lines
+        self.assertEqual(list(escape_lines("a<b\r\n'c'\n")),
+                         [u"a&lt;b", u"&#39;c&#39;", u""])
+        self.assertEqual(list(escape_lines("")), [u""])
+
+        lines = escape_lines(sbs_diff_helper.TextLines("x & y\n\"z\"\r\n"))
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1], u"&quot;z&quot;")
+        self.assertEqual(lines[0:2], [u"x &amp; y", u"&quot;z&quot;"])
+        self.assertEqual(lines[2:2], [])
+
+        lines = ["<%d>" % i for i in range(2500)]
+        self.assertEqual(list(escape_lines(lines)),
+                         ["&lt;%d&gt;" % i for i in range(2500)])
+
+
+class MapFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testMapFile(self):
+        """Testing only large settled files being memory-mapped"""
+        map_file = sbs_diff_helper.map_file
+        path = os.path.join(self.dir, "file.txt")
+        data = "line\n" * (sbs_diff_helper.MAP_MIN_SIZE / 5 + 1)
+        self._write(path, "")
+        self.assertEqual(map_file(path), "")
+
+        self._write(path, "small\n")
+        self.assertEqual(map_file(path), "small\n")
+        self.failIf(isinstance(map_file(path), mmap.mmap))
+
+        # Just written, it may still be being written.
+        self._write(path, data)
+        self.failIf(isinstance(map_file(path), mmap.mmap))
+
+        settled = time.time() - sbs_diff_helper.MAP_SETTLE_TIME - 1
+        os.utime(path, (settled, settled))
+        contents = map_file(path)
+        self.failUnless(isinstance(contents, mmap.mmap))
+        self.assertEqual(contents[:], data)
+        contents.close()
+
+    def _write(self, path, data):
+        f = open(path, "wb")
+        f.write(data)
+        f.close()
+
+
+class ParallelMapTest(unittest.TestCase):
+    def testParallelMap(self):
+        """Testing results and errors of parallel_map"""
+        parallel_map = sbs_diff_helper.parallel_map
+        self.assertEqual(list(parallel_map(abs, range(-50, 0))),
+                         range(50, 0, -1))
+
+        def check(x):
+            if x == 5:
+                raise ValueError(x)
+            return x
+
+        self.assertRaises(ValueError, list, parallel_map(check, range(10)))
+
+    def testClose(self):
+        """Testing parallel_map stopping its workers when let go of"""
+        results = sbs_diff_helper.parallel_map(lambda x: x, range(1000))
+        self.assertEqual(results.next(), 0)
+        threads = results.threads
+        del results
+        self.failIf([thread for thread in threads if thread.isAlive()])
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.setting = os.environ.get(sbs_diff_helper.PROFILE_ENV_VAR)
+        os.environ[sbs_diff_helper.PROFILE_ENV_VAR] = "1"
+
+    def tearDown(self):
+        if self.setting is None:
+            del os.environ[sbs_diff_helper.PROFILE_ENV_VAR]
+        else:
+            os.environ[sbs_diff_helper.PROFILE_ENV_VAR] = self.setting
+
+    def testReload(self):
+        """Testing the profile aggregator surviving a module reload"""
+        profiler = sbs_diff_helper.get_profiler()
+        self.failUnless(profiler is not None)
+        reload(sbs_diff_helper)
+        self.failUnless(sbs_diff_helper.get_profiler() is profiler)
+
+
+class HighlightCacheTest(unittest.TestCase):
+    def testReload(self):
+        """Testing the highlight cache surviving a module reload"""
+        if not sbs_diff_helper._have_pygments:
+            return
+
+        text = "import os\nprint os.getcwd()\n"
+        markup = sbs_diff_helper.apply_pygments(text, "test.py")
+        cache = sbs_diff_helper.get_highlight_cache()
+        hits = cache.hits
+
+        reload(sbs_diff_helper)
+        self.failUnless(sbs_diff_helper.get_highlight_cache() is cache)
+        self.assertEqual(sbs_diff_helper.apply_pygments(text, "test.py"),
+                         markup)
+        self.assertEqual(cache.hits, hits + 1)
+
+
+class SelectDifferTest(unittest.TestCase):
+    def testSelectDiffer(self):
+        """Testing differ selection by file name and size"""
+        select_differ = sbs_diff_helper.select_differ
+        a = ["x = 1"] * 10
+        b = ["x = 2"] * 10
+
+        self.assertEqual(select_differ("foo.py", a, b).name, "myers")
+        self.assertEqual(select_differ("foo.min.js", a, b).name, "patience")
+
+        # Normalizing lines needs a differ supporting it.
+        self.assertEqual(select_differ("foo.min.js", a, b, True).name,
+                         "myers")
+
+        # The average line length comes from the size when it's given.
+        self.assertEqual(select_differ("foo.py", a, b, size=20000).name,
+                         "patience")
+        self.assertEqual(select_differ("foo.py", a * 6000, b * 6000).name,
+                         "patience")
+
+
+class FileDiffEx(object):
+    """
+    A koIDiff file diff without a diff, as far as DiffItem is concerned.
+    """
+    diff = ""
+    hunks = []
+
+    def best_path(self, cwd):
+        return "file:///test.txt"
+
+
+class ContentsDiffItem(sbs_diff_helper.DiffItem):
+    """
+    A DiffItem of two file contents given up front.
+    """
+    def __init__(self, old, new, **kwargs):
+        super(ContentsDiffItem, self).__init__("1", FileDiffEx(), **kwargs)
+        self._left_contents = old
+        self._right_contents = new
+
+    def get_original_file(self, allow_patching=True):
+        return self._left_contents
+
+    def get_patched_file(self, allow_patching=True):
+        return self._right_contents
+
+
+class MoveChunkTest(unittest.TestCase):
+    def testCollapsedMoves(self):
+        """Testing moved blocks being collapsed"""
+        block = ["moved %d" % i for i in range(6)]
+        rest = ["line %d" % i for i in range(30)]
+        old = "\n".join(block + rest) + "\n"
+        new = "\n".join(rest + block) + "\n"
+
+        item = ContentsDiffItem(old, new, hl_enabled=False)
+        item.load_chunks()
+        moves = [chunk for chunk in item.chunks if chunk['change'] == 'move']
+        self.assertEqual(len(moves), 2)
+        self.failUnless(moves[0]['collapsable'] and moves[1]['collapsable'])
+        self.assertEqual(moves[0]['moved_to'], 31)
+        self.assertEqual(moves[1]['moved_from'], 1)
+
+        html = item.toHTML()
+        self.failUnless("6 lines moved to line 31" in html)
+        unmoved = ContentsDiffItem(old, new, hl_enabled=False,
+                                   detect_moves=False)
+        unmoved.load_chunks()
+        self.failUnless(self._visible_rows(html) <
+                        self._visible_rows(unmoved.toHTML()))
+
+    def _visible_rows(self, html):
+        rows = 0
+        for tbody in html.split("<tbody")[1:]:
+            if 'style="display: none;"' not in tbody.split(">")[0]:
+                rows += tbody.count("<tr")
+        return rows
+
+
+class PatchItem(object):
+    """
+    A DiffItem of a patch, as far as get_interdiffer is concerned.
+    """
+    source_file = ""
+
+    def __init__(self, id, dest_file, orig, diff):
+        self.id = id
+        self.dest_file = dest_file
+        self.orig = orig
+        self.diff = diff
+
+    def get_original_file(self):
+        return self.orig
+
+
+class InterdifferTest(unittest.TestCase):
+    ORIG = "a\nb\nc\n"
+    DIFF1 = "--- f\n+++ f\n@@ -2,1 +2,1 @@\n-b\n+x\n"
+    DIFF2 = "--- f\n+++ f\n@@ -2,1 +2,1 @@\n-b\n+y\n"
+
+    def testGetInterdiffer(self):
+        """Testing composing the hunks of two patches"""
+        get_interdiffer = sbs_diff_helper.get_interdiffer
+        filediff = PatchItem(1, "/f", self.ORIG, self.DIFF1)
+        differ = get_interdiffer(filediff,
+                                 PatchItem(2, "/f", None, self.DIFF2))
+        self.assertEqual((differ.old, differ.new),
+                         ("a\nx\nc\n", "a\ny\nc\n"))
+        self.assertEqual(differ.a[:], ["a", "x", "c"])
+
+        # Patches of another file, or hunks that don't apply.
+        self.assertEqual(get_interdiffer(filediff,
+                                         PatchItem(2, "/g", None, self.DIFF2)),
+                         None)
+        self.assertEqual(get_interdiffer(filediff,
+                                         PatchItem(2, "/f", None,
+                                                   self.DIFF2.replace("-b",
+                                                                      "-z"))),
+                         None)
+
+
+class Hunk(object):
+    """
+    A hunk of a koIDiff file diff, as far as chunk ids are concerned.
+    """
+    def __init__(self, start_line):
+        self.start_line = start_line
+
+
+class ChunkIdTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.left_dir = os.path.join(self.tempdir, "left")
+        self.right_dir = os.path.join(self.tempdir, "right")
+        os.mkdir(self.left_dir)
+        os.mkdir(self.right_dir)
+        self._write(self.left_dir, "same.txt", "same\n")
+        self._write(self.right_dir, "same.txt", "same\n")
+        self._write(self.left_dir, "foo.txt",
+                    "".join(["%d\n" % i for i in range(20)]))
+        self._write(self.right_dir, "foo.txt",
+                    "".join(["%d\n" % i for i in range(20) if i != 12]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testTreeComparison(self):
+        """Testing chunk ids of tree comparisons"""
+        tree = sbs_diff_helper.TreeComparison(self.left_dir, self.right_dir)
+        sbsdiff = sbs_diff_helper.SideBySideDiff(tree, self.right_dir, False)
+        sbsdiff.toHTML()
+
+        # Like koIDiff's file diffs, the path is given as a URI.
+        self.assertEqual(sbsdiff.get_filepath("chunk.1.1"),
+                         sbs_diff_helper.localPathToURI(
+                             os.path.join(self.right_dir, "foo.txt")))
+        self.assertEqual(sbsdiff.get_diff_lineno("chunk.1.1"), 13)
+
+        for chunk_id in ("chunk.2.1", "chunk.x.1", "chunk.0.1", "chunk"):
+            self.assertEqual(sbsdiff.get_filepath(chunk_id), None)
+            self.assertEqual(sbsdiff.get_diff_lineno(chunk_id), -1)
+
+    def testNoDiffPositions(self):
+        """Testing chunk ids of diffs without file positions"""
+        tree = sbs_diff_helper.TreeComparison(self.left_dir, self.right_dir)
+        sbsdiff = sbs_diff_helper.SideBySideDiff(tree, self.right_dir, False)
+        sbsdiff.toHTML()
+
+        # A hunk can't be mapped back to the file without
+        # file_pos_from_diff_pos.
+        tree.file_diffs[0].hunks = [Hunk(1)]
+        self.assertEqual(sbsdiff.get_diff_lineno("chunk.1.1"), -1)
+
+    def _write(self, dir, name, data):
+        f = open(os.path.join(dir, name), "w")
+        f.write(data)
+        f.close()
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.left_dir = os.path.join(self.tempdir, "left")
+        self.right_dir = os.path.join(self.tempdir, "right")
+        os.mkdir(self.left_dir)
+        os.mkdir(self.right_dir)
+        for name in ("a--b.txt", "c.txt"):
+            self._write(self.left_dir, name,
+                        "".join(["%d\n" % i for i in range(20)]))
+            self._write(self.right_dir, name,
+                        "".join(["%d\n" % i for i in range(20) if i != 7]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testStatsJson(self):
+        """Testing the per-file and total stats of a side-by-side diff"""
+        tree = sbs_diff_helper.TreeComparison(self.left_dir, self.right_dir)
+        sbsdiff = sbs_diff_helper.SideBySideDiff(tree, self.right_dir, False)
+        sbsdiff.toHTML()
+        stats = sbs_diff_helper.simplejson.loads(sbsdiff.stats_json())
+
+        self.assertEqual(sorted(stats.keys()), ["files", "total"])
+        self.assertEqual(sorted(stats["total"].keys()),
+                         ["counters", "elapsed", "timings"])
+        self.assertEqual(len(stats["files"]), 2)
+        for info in stats["files"]:
+            self.assertEqual(sorted(info.keys()),
+                             ["binary", "counters", "id", "path", "timings"])
+            self.failIf(info["binary"])
+        self.assertEqual(sorted([os.path.basename(info["path"])
+                                 for info in stats["files"]]),
+                         ["a--b.txt", "c.txt"])
+
+        # The totals are the sums over the files.
+        for key in ("counters", "timings"):
+            names = {}
+            for info in stats["files"]:
+                names.update(info[key])
+            self.failUnless(names)
+            self.assertEqual(sorted(stats["total"][key].keys()),
+                             sorted(names.keys()))
+            for name in names:
+                total = 0
+                for info in stats["files"]:
+                    total += info[key].get(name, 0)
+                self.assertAlmostEqual(stats["total"][key][name], total, 5)
+
+    def testStatsFooter(self):
+        """Testing the stats footer is a valid HTML comment"""
+        tree = sbs_diff_helper.TreeComparison(self.left_dir, self.right_dir)
+        sbsdiff = sbs_diff_helper.SideBySideDiff(tree, self.right_dir, False,
+                                                 stats_footer=True)
+        html = sbsdiff.toHTML()
+        start = html.index("<!-- sbsdiff-stats ")
+        end = html.index(" -->", start)
+        comment = html[start + len("<!-- sbsdiff-stats "):end]
+
+        # "--" would end the comment early, but the JSON still decodes to
+        # the file names.
+        self.failIf("--" in comment)
+        stats = sbs_diff_helper.simplejson.loads(comment)
+        self.assertEqual(sorted([os.path.basename(info["path"])
+                                 for info in stats["files"]]),
+                         ["a--b.txt", "c.txt"])
+
+    def _write(self, dir, name, data):
+        f = open(os.path.join(dir, name), "w")
+        f.write(data)
+        f.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
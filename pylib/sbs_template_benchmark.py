@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# ***** BEGIN LICENSE BLOCK *****
+# Version: MPL 1.1/GPL 2.0/LGPL 2.1
+# 
+# The contents of this file are subject to the Mozilla Public License
+# Version 1.1 (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://www.mozilla.org/MPL/
+# 
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See the
+# License for the specific language governing rights and limitations
+# under the License.
+# 
+# The Original Code is "side by side diff" code.
+# 
+# The Initial Developer of the Original Code is ActiveState Software Inc.
+# Portions created by ActiveState Software Inc are Copyright (C) 2008-2009
+# ActiveState Software Inc. All Rights Reserved.
+# 
+# Contributor(s):
+#   Todd Whiteman @ ActiveState Software Inc
+# 
+# Alternatively, the contents of this file may be used under the terms of
+# either the GNU General Public License Version 2 or later (the "GPL"), or
+# the GNU Lesser General Public License Version 2.1 or later (the "LGPL"),
+# in which case the provisions of the GPL or the LGPL are applicable instead
+# of those above. If you wish to allow use of your version of this file only
+# under the terms of either the GPL or the LGPL, and not to allow others to
+# use your version of this file under the terms of the MPL, indicate your
+# decision by deleting the provisions above and replace them with the notice
+# and other provisions required by the GPL or the LGPL. If you do not delete
+# the provisions above, a recipient may use your version of this file under
+# the terms of any one of the MPL, the GPL or the LGPL.
+# 
+# ***** END LICENSE BLOCK *****
+
+
+
+#
+# Overview:
+#   Micro-benchmark for rendering the diff file fragment template, the
+#   hottest template of the diff viewer as it renders one row per line. It
+#   compares the original stack-scanning context lookups, the current
+#   Context and compiled templates, with extra dicts under the template's
+#   variables as a RequestContext has one per context processor.
+#
+# Usage:
+#   python sbs_template_benchmark.py [options]
+#
+#   --lines=N       number of lines in the diff fragment (default 50000)
+#   --chunk-size=N  lines per chunk (default 50)
+#   --depth=N       extra dicts at the bottom of the context (default 5)
+#   --repeat=N      best of N runs for every timing (default 3)
+#
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+pylib_dir = os.path.dirname(os.path.abspath(__file__))
+for path in (pylib_dir, os.path.join(pylib_dir, "reviewboard")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from django.template import Context, Template
+from django.template.compiler import compile_template
+from django.template.loader import find_template_source
+
+
+class StackContext(Context):
+    """
+    A Context looking variables up by scanning the whole stack, as it did
+    before lookups were cached.
+    """
+    def __getitem__(self, key):
+        for d in self.dicts:
+            if key in d:
+                return d[key]
+        raise KeyError(key)
+
+    def has_key(self, key):
+        for d in self.dicts:
+            if key in d:
+                return True
+        return False
+
+    __contains__ = has_key
+
+    def get(self, key, otherwise=None):
+        for d in self.dicts:
+            if key in d:
+                return d[key]
+        return otherwise
+
+
+def make_file(options):
+    """
+    Returns the file dict of a diff fragment alternating replaced and
+    unchanged chunks.
+    """
+    chunks = []
+    linenum = 1
+    while linenum <= options.lines:
+        numlines = min(options.chunk_size, options.lines - linenum + 1)
+        change = len(chunks) % 2 and 'replace' or 'equal'
+        lines = [[i, i, '<span class="k">def</span> f%d(a, b):' % i,
+                  [(4, 7)], i, '<span class="k">def</span> g%d(a, b):' % i,
+                  [(4, 7)]]
+                 for i in xrange(linenum, linenum + numlines)]
+        chunks.append({
+            'lines': lines,
+            'numlines': numlines,
+            'change': change,
+            'collapsable': False,
+            'index': len(chunks),
+        })
+        linenum += numlines
+    return {
+        'id': 1,
+        'newfile': False,
+        'binary': False,
+        'chunks': chunks,
+        'dest_file': 'benchmark.py',
+        'source_revision': '1',
+        'dest_revision': '2',
+    }
+
+
+def make_context(context_class, file, options):
+    context = context_class({'processor': 0})
+    for i in xrange(options.depth - 1):
+        context.update({'processor%d' % i: i})
+    context.update({
+        'file': file,
+        'collapseall': False,
+        'standalone': False,
+    })
+    return context
+
+
+def run(template, context_class, file, options):
+    """
+    Returns the best wall time of rendering the fragment.
+    """
+    best = None
+    for i in xrange(options.repeat):
+        context = make_context(context_class, file, options)
+        start = time.time()
+        template.render(context)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    parser = OptionParser()
+    parser.add_option("--lines", type="int", default=50000)
+    parser.add_option("--chunk-size", type="int", default=50)
+    parser.add_option("--depth", type="int", default=5)
+    parser.add_option("--repeat", type="int", default=3)
+    options, args = parser.parse_args(argv[1:])
+
+    source, origin = find_template_source('diffviewer/diff_file_fragment.html')
+    template = Template(source, origin)
+    compiled = compile_template(template)
+    file = make_file(options)
+
+    print "%d lines, %d context dicts" % (options.lines, options.depth + 1)
+    print "%-22s %10s %14s" % ("", "time (s)", "lines/s")
+    for name, t, context_class in [
+            ("stack context", template, StackContext),
+            ("context", template, Context),
+            ("compiled", compiled, Context)]:
+        elapsed = run(t, context_class, file, options)
+        print "%-22s %10.3f %14.0f" % (name, elapsed,
+                                        options.lines / elapsed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))